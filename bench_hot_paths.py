@@ -0,0 +1,410 @@
+"""
+Micro-benchmarks for the CPU-bound hot paths in web_main.py, on deterministic
+synthetic fixtures (no network, no Supabase, no Groq):
+
+  rank_jobs          _rank_jobs_for_profile over 1,000 JDs
+  create_docx        _create_docx_from_text over 200 AI resume texts
+  render_pdf         _render_pdf_builtin over the same 200 resume texts
+  inject_projects    _inject_ai_projects over the same 200 resume texts
+  dedup_discovery    _dedup_discovered_jobs over 5 scrapers x 300 jobs (~35% repeats)
+  voyager_parse      _parse_voyager_saved_page over 25 recorded-shape 40-item pages
+  trim_jd            _trim_jd(…, 500) over 1,000 JDs
+  html_text          html_to_text over 500 MCF-style HTML job descriptions
+  linkedin_cards     linkedin_job_cards over 30 guest-search result pages
+  jd_page            extract_jd_from_page over 60 LinkedIn/Indeed/MCF/other job pages
+
+Each benchmark is run --repeat times; the median wall time is reported, plus
+the per-item time for the HTML benchmarks. Each html_* / *_cards / jd_page
+benchmark has a *_bs4 twin running the BeautifulSoup code it replaced, and
+the extracted fields of both are checked for equality before timing; the
+PDF writer's output is checked for unencodable (?) glyphs the same way.
+Recorded pages in FAKE_FIXTURES_DIR (linkedin_guest.html,
+linkedin_public.html) are added to the card fixtures when present.
+
+    python bench_hot_paths.py                           # run all, print a table
+    python bench_hot_paths.py --only rank_jobs,voyager_parse
+    python bench_hot_paths.py --save bench_baseline.json
+    python bench_hot_paths.py --compare bench_baseline.json --threshold 0.25
+
+--compare exits with status 1 when any benchmark's median is more than
+--threshold (fraction) slower than the saved baseline.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import statistics
+
+from bs4 import BeautifulSoup
+
+os.environ.setdefault("SUPABASE_URL", "")
+os.environ.setdefault("GROQ_API_KEY", "")
+
+import web_main as wm
+import fake_services
+
+_rng = random.Random(1729)
+
+_ROLES = ["Product Owner", "Senior Product Manager", "Business Analyst", "Digital Product Lead",
+          "Scrum Master", "Data Engineer", "Technical Project Manager", "Product Operations Manager"]
+_COMPANIES = ["DBS Bank", "Grab", "Shopee", "GovTech", "Accenture", "Sea Group", "KPMG", "Airwallex",
+              "OCBC", "Stripe", "Infosys", "Carousell", "PropertyGuru", "Nium", "Wise", "Lazada"]
+_JD_SENTENCES = [
+    "You will own the product backlog and write user stories with clear acceptance criteria.",
+    "Work closely with stakeholders across engineering, design and operations to define the product roadmap.",
+    "Experience with Agile, Scrum or SAFe and tools such as Jira and Confluence is required.",
+    "Drive data-driven decisions using SQL, Tableau or Power BI dashboards and clear KPIs.",
+    "Domain experience in banking, payments or fintech is highly preferred.",
+    "Lead discovery, MVP definition and go-to-market planning for new digital features.",
+    "Exposure to generative AI, LLM and prompt engineering is a strong plus.",
+    "We offer hybrid work, flexible hours and a strong learning & development budget.",
+    "Singapore citizens and PR only; no sponsorship is available for this role.",
+    "Visa sponsorship available for exceptional candidates; open to all nationalities.",
+    "Conduct UAT, manage change management activities and support the release train.",
+    "Our product is a B2B SaaS platform used by thousands of merchants across the region.",
+    "Equal opportunity employer. We do not discriminate on the basis of race or religion.",
+    "Benefits include medical insurance, annual leave and a wellness allowance.",
+]
+
+
+def make_jds(n=1000):
+    jobs = []
+    for i in range(n):
+        body = [_rng.choice(_JD_SENTENCES) for _ in range(_rng.randint(8, 22))]
+        jd = ("About the role\n" + " ".join(body[:len(body) // 2]) +
+              "\n\nRequirements\n" + "\n".join(f"- {s}" for s in body[len(body) // 2:]) +
+              "\n\nAbout us\nWe are an equal opportunity employer based in Singapore.")
+        jobs.append({"id": f"bench-{i}", "role": _rng.choice(_ROLES),
+                     "company": _rng.choice(_COMPANIES), "jd": jd})
+    return jobs
+
+
+def make_resumes(n=200):
+    texts = []
+    for i in range(n):
+        bullets = "\n".join(f"• {_rng.choice(_JD_SENTENCES)} Delivered {_rng.randint(10, 60)}% improvement."
+                            for _ in range(_rng.randint(5, 9)))
+        ai_block = ("\nAI PROJECTS:\nGenerated project block that should be replaced\n- bullet\n"
+                    if i % 3 == 0 else "")
+        texts.append(
+            f"AMRETHA KARTHIKEYAN\nSingapore | +65 9000 {i:04d} | amretha@example.com\n\n"
+            f"PROFESSIONAL SUMMARY:\nProduct Owner with {_rng.randint(6, 12)}+ years in digital banking.\n"
+            f"{ai_block}\n"
+            "SKILL SET:\nProduct: Backlog, Roadmap, User Stories\nTools: Jira, Confluence, SQL, Tableau\n\n"
+            f"PROFESSIONAL EXPERIENCE:\nAcme Bank | Jan 2020 – Present\nSenior Product Owner\n{bullets}\n\n"
+            f"Globex | Jun 2016 – Dec 2019\nBusiness Analyst\n{bullets}\n\n"
+            "ACADEMIC QUALIFICATION:\nBachelor of Engineering — Anna University | 2012\n"
+        )
+    return texts
+
+
+def make_scraper_batches(scrapers=5, per_scraper=300):
+    pool = [{"role": _rng.choice(_ROLES), "company": _rng.choice(_COMPANIES) + f" {k % 90}",
+             "url": f"https://www.linkedin.com/jobs/view/{3900000000 + k}/"} for k in range(1000)]
+    out = []
+    for _ in range(scrapers):
+        for j in _rng.sample(pool, per_scraper):
+            j = dict(j)
+            if _rng.random() < 0.3:
+                j["url"] += f"?trk=public_jobs&refId={_rng.randint(0, 1 << 30)}"
+            out.append(j)
+    return out
+
+
+def make_voyager_pages(pages=25, per_page=40):
+    """Normalized Voyager saved-jobs pages: 'included' holds companies, postings
+    and SavedJob wrappers that reference them by URN."""
+    now_ms = int(time.time() * 1000)
+    out = []
+    for p in range(pages):
+        included = []
+        for k in range(per_page):
+            jid = 3900000000 + p * per_page + k
+            comp_urn = f"urn:li:fsd_company:{1000 + (jid % 300)}"
+            post_urn = f"urn:li:fsd_jobPosting:{jid}"
+            included.append({"$type": "com.linkedin.voyager.dash.organization.Company",
+                             "entityUrn": comp_urn, "name": _rng.choice(_COMPANIES)})
+            posting = {"$type": "com.linkedin.voyager.dash.jobs.JobPosting", "entityUrn": post_urn,
+                       "title": _rng.choice(_ROLES),
+                       "companyDetails": {"*companyResolutionResult": comp_urn},
+                       "listedAt": now_ms - _rng.randint(0, 40) * 86400000}
+            if k % 2:
+                posting["description"] = {"text": " ".join(_rng.sample(_JD_SENTENCES, 6))}
+            included.append(posting)
+            included.append({"$type": "com.linkedin.voyager.dash.jobs.SavedJob",
+                             "entityUrn": f"urn:li:fsd_savedJob:{jid}", "*jobPosting": post_urn,
+                             "savedAt": now_ms - _rng.randint(0, 45) * 86400000})
+        out.append({"included": included, "paging": {"total": pages * per_page, "start": p * per_page,
+                                                     "count": per_page}})
+    return out
+
+
+def make_mcf_descriptions(n=500):
+    """MyCareersFuture descriptions: paragraphs, lists, inline markup, entities,
+    stray whitespace; some plain text."""
+    out = []
+    for i in range(n):
+        if i % 10 == 0:
+            out.append("  " + " ".join(_rng.sample(_JD_SENTENCES, 5)) + "\n")
+            continue
+        items = "".join(f"<li>\n  <span>{s}</span>&nbsp;</li>" for s in _rng.sample(_JD_SENTENCES, _rng.randint(4, 9)))
+        out.append(
+            f"<p><strong>About {_rng.choice(_COMPANIES)} &amp; the team</strong></p>"
+            f"<p>{_rng.choice(_JD_SENTENCES)}<br>{_rng.choice(_JD_SENTENCES)}</p>"
+            f"<h3>Responsibilities</h3>\n<ul>{items}</ul>"
+            "<!-- tracking -->"
+            f"<p><em>Requirements:</em> {_rng.choice(_JD_SENTENCES)} &lt;5 years&gt; </p>"
+        )
+    return out
+
+
+def _guest_card(k):
+    jid = 3900000000 + k
+    loc = "" if k % 7 == 0 else (
+        '\n        <span class="job-search-card__location">\n          Singapore, Singapore\n        </span>')
+    return (
+        '<li>\n  <div class="base-card relative w-full hover:no-underline focus:no-underline base-card--link '
+        f'base-search-card base-search-card--link job-search-card" data-entity-urn="urn:li:jobPosting:{jid}">\n'
+        f'    <a class="base-card__full-link absolute top-0 right-0" href="https://sg.linkedin.com/jobs/view/'
+        f'product-owner-at-acme-{jid}?position={k % 25}&amp;pageNum=0&amp;trk=public_jobs_jserp-result_search-card">\n'
+        f'      <span class="sr-only">\n          {_rng.choice(_ROLES)}\n      </span>\n    </a>\n'
+        '    <div class="base-search-card__info">\n'
+        f'      <h3 class="base-search-card__title">\n          {_rng.choice(_ROLES)}\n      </h3>\n'
+        '      <h4 class="base-search-card__subtitle">\n'
+        f'          <a class="hidden-nested-link" href="https://sg.linkedin.com/company/x">\n'
+        f'            {_rng.choice(_COMPANIES)} &amp; Co\n          </a>\n      </h4>\n'
+        f'      <div class="base-search-card__metadata">{loc}\n'
+        '        <!---->\n'
+        f'        <time class="job-search-card__listdate" datetime="2026-0{1 + k % 9}-1{k % 10}">\n'
+        '            1 week ago\n        </time>\n'
+        '      </div>\n    </div>\n  </div>\n</li>'
+    )
+
+
+def make_linkedin_pages(pages=30, per_page=25):
+    out = ["\n".join(_guest_card(p * per_page + k) for k in range(per_page)) for p in range(pages)]
+    for name in ("linkedin_guest.html", "linkedin_public.html"):
+        path = os.path.join(fake_services.FIXTURES_DIR, name)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                out.append(f.read())
+    return out
+
+
+def make_job_pages(n=60):
+    """Full job-detail pages, cycling through the fetch_jd selector sets."""
+    sites = [
+        ("https://www.linkedin.com/jobs/view/3900000001/",
+         '<h1 class="top-card-layout__title">{role}</h1><a class="topcard__org-name-link">\n {company}\n</a>'
+         '<section class="show-more-less-html"><div class="show-more-less-html__markup">{body}</div></section>'),
+        ("https://sg.indeed.com/viewjob?jk=abc",
+         '<h1>{role}</h1><div id="jobDescriptionText" class="jobsearch-jobDescriptionText">{body}</div>'),
+        ("https://www.mycareersfuture.gov.sg/job/abc",
+         '<h1>{role}</h1><div class="job-description-wrapper"><div id="description-content">{body}</div></div>'),
+        ("https://careers.example.com/jobs/42",
+         '<div class="nav">Home</div><article><h2>{role}</h2>{body}</article>'),
+    ]
+    pages = []
+    for i in range(n):
+        url, tmpl = sites[i % len(sites)]
+        body = ("<h3>Responsibilities</h3><ul>" +
+                "".join(f"<li>{s}</li>" for s in _rng.sample(_JD_SENTENCES, 8)) +
+                "</ul><h3>Requirements</h3><p>" + " ".join(_rng.sample(_JD_SENTENCES, 5)) + "</p>")
+        main = tmpl.format(role=_rng.choice(_ROLES), company=_rng.choice(_COMPANIES), body=body)
+        nav = "".join(f'<li><a href="/l/{k}">Link {k}</a></li>' for k in range(60))
+        pages.append((url, "<!DOCTYPE html><html><head><title>Job</title>"
+                           "<script>window.__data = {\"a\": 1};</script><style>.x{color:red}</style></head>"
+                           f"<body><header><ul>{nav}</ul></header><main>{main}</main>"
+                           "<footer><p>© 2026 Example</p></footer></body></html>"))
+    return pages
+
+
+# ── The BeautifulSoup code the lxml extractors replaced (reference + baseline) ──
+
+def bs4_html_text(html):
+    return BeautifulSoup(html, "html.parser").get_text(separator=" ", strip=True)
+
+
+def bs4_linkedin_cards(html):
+    out = []
+    for card in BeautifulSoup(html, "html.parser").select("div.base-card, li.result-card, div.job-search-card"):
+        title_el = card.select_one("h3.base-search-card__title, h3[class*='title']")
+        company_el = card.select_one("h4.base-search-card__subtitle, a[class*='company']")
+        link_el = card.select_one("a.base-card__full-link, a[class*='job-card']")
+        loc_el = card.select_one("span.job-search-card__location")
+        time_el = card.select_one("time")
+        out.append({
+            "title": title_el.get_text(strip=True) if title_el else "",
+            "company": company_el.get_text(strip=True) if company_el else "",
+            "href": link_el.get("href", "") if link_el else "",
+            "location": loc_el.get_text(strip=True) if loc_el else None,
+            "datetime": time_el.get("datetime") if time_el else None,
+        })
+    return out
+
+
+def bs4_jd_page(html, url):
+    soup = BeautifulSoup(html, "html.parser")
+    jd = title = company = ""
+    selectors = {
+        "linkedin.com": [".description__text", ".show-more-less-html__markup", "[class*='description']", "section.description"],
+        "indeed.com":   ["#jobDescriptionText", ".jobsearch-jobDescriptionText", "[class*='description']"],
+        "mycareersfuture.gov.sg": ["[class*='job-description']", "[class*='description']", "article"],
+    }
+    matched_sels = next((v for k, v in selectors.items() if k in url), None)
+    if matched_sels:
+        for sel in matched_sels:
+            el = soup.select_one(sel)
+            if el and len(el.get_text(strip=True)) > 100:
+                jd = el.get_text(separator="\n", strip=True)[:5000]
+                break
+        if "linkedin.com" in url:
+            t_el = soup.select_one("h1.top-card-layout__title, h1[class*='title']")
+            if t_el: title = t_el.get_text(strip=True)
+            c_el = soup.select_one("a.topcard__org-name-link, [class*='company-name']")
+            if c_el: company = c_el.get_text(strip=True)
+    else:
+        for tag in soup.find_all(["article", "section", "div"], limit=20):
+            text = tag.get_text(strip=True)
+            if len(text) > 500 and any(kw in text.lower() for kw in ["responsibilities", "requirements", "qualifications"]):
+                jd = text[:5000]
+                break
+    return jd, title, company
+
+
+def check_html_extraction(descs, pages, job_pages):
+    """Both extractors must produce identical fields on every fixture."""
+    mismatches = [("html_text", i) for i, d in enumerate(descs) if wm.html_to_text(d) != bs4_html_text(d)]
+    mismatches += [("linkedin_cards", i) for i, pg in enumerate(pages)
+                   if wm.linkedin_job_cards(pg) != bs4_linkedin_cards(pg)]
+    mismatches += [("jd_page", i) for i, (u, pg) in enumerate(job_pages)
+                   if wm.extract_jd_from_page(pg, u) != bs4_jd_page(pg, u)]
+    if mismatches:
+        sys.exit(f"lxml and BeautifulSoup extraction differ: {mismatches[:10]}")
+    print(f"html extraction: identical fields on {len(descs)} descriptions, {len(pages)} card pages, "
+          f"{len(job_pages)} job pages")
+
+
+def check_pdf_export(resumes):
+    """Every bullet must reach the PDF as WinAnsi 0x95, never as a '?' fallback."""
+    for i, text in enumerate(resumes):
+        pdf = wm._render_pdf_builtin(wm._parse_resume_blocks(text), "Resume")
+        if b"(?) Tj" in pdf or b"(\x95) Tj" not in pdf:
+            sys.exit(f"render_pdf: resume {i} has no WinAnsi bullet glyphs")
+    print(f"pdf export: bullets encoded on {len(resumes)} resumes")
+
+
+_HTML_BENCHES = ("html_text", "linkedin_cards", "jd_page")
+
+
+def build_benchmarks():
+    jds = make_jds()
+    resumes = make_resumes()
+    batches = make_scraper_batches()
+    pages = make_voyager_pages()
+    descs = make_mcf_descriptions()
+    li_pages = make_linkedin_pages()
+    job_pages = make_job_pages()
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=30)
+    profile = wm.DEFAULT_PROFILE
+    benches = {
+        "rank_jobs":       lambda: wm._rank_jobs_for_profile(jds, profile),
+        "create_docx":     lambda: [wm._create_docx_from_text(t, "Resume") for t in resumes],
+        "render_pdf":      lambda: [wm._render_pdf_builtin(wm._parse_resume_blocks(t), "Resume") for t in resumes],
+        "inject_projects": lambda: [wm._inject_ai_projects(t) for t in resumes],
+        "dedup_discovery": lambda: wm._dedup_discovered_jobs(batches),
+        "voyager_parse":   lambda: [wm._parse_voyager_saved_page(pg, cutoff) for pg in pages],
+        "trim_jd":         lambda: [wm._trim_jd(j["jd"], 500) for j in jds],
+        "html_text":       lambda: [wm.html_to_text(d) for d in descs],
+        "html_text_bs4":   lambda: [bs4_html_text(d) for d in descs],
+        "linkedin_cards":  lambda: [wm.linkedin_job_cards(pg) for pg in li_pages],
+        "linkedin_cards_bs4": lambda: [bs4_linkedin_cards(pg) for pg in li_pages],
+        "jd_page":         lambda: [wm.extract_jd_from_page(pg, u) for u, pg in job_pages],
+        "jd_page_bs4":     lambda: [bs4_jd_page(pg, u) for u, pg in job_pages],
+    }
+    items = {"html_text": len(descs), "linkedin_cards": len(li_pages), "jd_page": len(job_pages)}
+    items.update({f"{k}_bs4": v for k, v in items.items()})
+    return benches, items, (descs, li_pages, job_pages, resumes)
+
+
+def run(names, repeat, benches, items, fixtures):
+    descs, li_pages, job_pages, resumes = fixtures
+    if any(n.replace("_bs4", "") in _HTML_BENCHES for n in names):
+        check_html_extraction(descs, li_pages, job_pages)
+    if "render_pdf" in names:
+        check_pdf_export(resumes)
+    results = {}
+    for name in names:
+        fn = benches[name]
+        fn()                                    # warm caches / lazy imports
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - t0)
+        results[name] = {"median_ms": round(statistics.median(times) * 1000, 3),
+                         "min_ms": round(min(times) * 1000, 3), "repeat": repeat}
+        if name in items:
+            results[name]["per_item_us"] = round(statistics.median(times) / items[name] * 1e6, 1)
+    return results
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, res in results.items():
+        base = (baseline.get("results") or baseline).get(name)
+        if not base:
+            res["vs_baseline"] = None
+            continue
+        ratio = res["median_ms"] / base["median_ms"] if base["median_ms"] else 1.0
+        res["vs_baseline"] = round(ratio, 3)
+        if ratio > 1 + threshold:
+            regressions.append((name, ratio))
+    return regressions
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark web_main.py CPU hot paths")
+    ap.add_argument("--only", help="comma-separated benchmark names")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--save", metavar="FILE", help="write results as a baseline")
+    ap.add_argument("--compare", metavar="FILE", help="compare against a saved baseline")
+    ap.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown fraction (default 0.25)")
+    ap.add_argument("--json", action="store_true")
+    args = ap.parse_args(argv)
+
+    benches, items, fixtures = build_benchmarks()
+    names = list(benches) if not args.only else [n.strip() for n in args.only.split(",")]
+    results = run(names, args.repeat, benches, items, fixtures)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, res in results.items():
+            vs = res.get("vs_baseline")
+            print(f"{name:<18} median={res['median_ms']:>10.2f}ms  min={res['min_ms']:>10.2f}ms"
+                  + (f"  {res['per_item_us']:>9.1f}us/item" if "per_item_us" in res else "")
+                  + (f"  x{vs:.2f} vs baseline" if vs else ""))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"python": sys.version.split()[0], "saved_at": datetime.datetime.now().isoformat(),
+                       "results": results}, f, indent=2)
+        print(f"Baseline written to {args.save}")
+
+    if regressions:
+        for name, ratio in regressions:
+            print(f"REGRESSION: {name} is {ratio:.2f}x the baseline (threshold {1 + args.threshold:.2f}x)")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
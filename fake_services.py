@@ -0,0 +1,513 @@
+"""
+Local stand-ins for every upstream the app talks to, so hot paths can be
+benchmarked without live credentials or network:
+
+  /groq/openai/v1/chat/completions     OpenAI-compatible chat (latency, 429s, streaming)
+  /rest/v1/<table>                     PostgREST subset backed by memory (jobs/settings/config)
+  /mcf/v2/jobs                         MyCareersFuture search API
+  /linkedin/jobs-guest/...             LinkedIn guest search cards
+  /linkedin/jobs/search/               LinkedIn public search page
+  /linkedin/voyager/api/jobs/...       Voyager job posting detail
+  /workable/api/v1/jobs                Workable search API
+  /twilio/2010-04-01/.../Messages.json Twilio message sink
+
+Job-board responses are replayed from FAKE_FIXTURES_DIR when a recording
+exists there (see `record` below), otherwise generated deterministically.
+
+Usage:
+    python fake_services.py                      # serve on 127.0.0.1:8765
+    JOBHUNT_FAKE_SERVICES=http://127.0.0.1:8765 gunicorn wsgi:app
+    python fake_services.py record "Product Owner" Singapore   # capture live job-board responses
+
+Behaviour knobs (env at start-up, or POST /__fake/config at runtime):
+    FAKE_GROQ_LATENCY_MS     base LLM latency                 (default 400)
+    FAKE_GROQ_JITTER_MS      +/- uniform jitter               (default 150)
+    FAKE_GROQ_429_RATE       fraction of LLM calls that 429   (default 0)
+    FAKE_GROQ_RETRY_AFTER    Retry-After seconds on 429       (default 2)
+    FAKE_GROQ_TOKENS_PER_SEC streaming output speed           (default 400)
+    FAKE_BOARD_LATENCY_MS    MCF/LinkedIn/Workable latency    (default 250)
+    FAKE_LINKEDIN_429_RATE   fraction of Voyager calls that 429 (default 0)
+    FAKE_DB_LATENCY_MS       PostgREST latency                (default 15)
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import hashlib
+import threading
+import datetime
+from collections import Counter
+
+from flask import Flask, Response, request, jsonify
+
+app = Flask(__name__)
+
+CONFIG = {
+    "groq_latency_ms":     float(os.environ.get("FAKE_GROQ_LATENCY_MS", "400")),
+    "groq_jitter_ms":      float(os.environ.get("FAKE_GROQ_JITTER_MS", "150")),
+    "groq_429_rate":       float(os.environ.get("FAKE_GROQ_429_RATE", "0")),
+    "groq_retry_after":    float(os.environ.get("FAKE_GROQ_RETRY_AFTER", "2")),
+    "groq_tokens_per_sec": float(os.environ.get("FAKE_GROQ_TOKENS_PER_SEC", "400")),
+    "board_latency_ms":    float(os.environ.get("FAKE_BOARD_LATENCY_MS", "250")),
+    "linkedin_429_rate":   float(os.environ.get("FAKE_LINKEDIN_429_RATE", "0")),
+    "db_latency_ms":       float(os.environ.get("FAKE_DB_LATENCY_MS", "15")),
+}
+FIXTURES_DIR = os.environ.get("FAKE_FIXTURES_DIR",
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_fixtures"))
+
+_lock = threading.Lock()
+_hits = Counter()                # service -> request count
+_tables = {}                     # table -> {pk: row}
+_twilio_sink = []
+_PRIMARY_KEYS = {"jobs": "id", "settings": "key", "config": "key"}
+
+_COMPANIES = ["DBS Bank", "Grab", "Shopee", "GovTech", "OCBC", "Sea Group", "Singtel",
+              "Lazada", "PropertyGuru", "Carousell", "UOB", "Standard Chartered"]
+_SENIORITY = ["", "Senior ", "Lead ", "Associate ", "Principal "]
+
+
+def _sleep_ms(ms, jitter=0.0):
+    delay = max(0.0, ms + random.uniform(-jitter, jitter)) / 1000
+    if delay:
+        time.sleep(delay)
+
+
+def _hit(service):
+    with _lock:
+        _hits[service] += 1
+
+
+def _seed(*parts):
+    return int(hashlib.md5("|".join(str(p) for p in parts).encode()).hexdigest()[:8], 16)
+
+
+def _fixture(name):
+    path = os.path.join(FIXTURES_DIR, name)
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+    return None
+
+
+# ─── Groq (OpenAI-compatible chat) ───────────────────────────────────────────
+
+_CANNED_RESUME = """AMRETHA KARTHIKEYAN
+Singapore | +65 9000 0000 | amretha@example.com | linkedin.com/in/example
+
+PROFESSIONAL SUMMARY
+Product Owner with 8+ years delivering digital banking and payments products across APAC.
+
+CORE SKILLS
+Product: Backlog management, roadmap planning, stakeholder alignment
+Delivery: Scrum, SAFe, Jira, Confluence
+
+PROFESSIONAL EXPERIENCE
+Acme Bank | Jan 2020 – Present
+Senior Product Owner
+• Led a cross-functional squad of 9 to launch instant payments, growing volume 40% in 6 months
+• Cut release lead time from 6 weeks to 10 days by introducing trunk-based delivery
+
+Globex Consulting | Jun 2016 – Dec 2019
+Business Analyst
+• Gathered requirements for a core banking migration covering 2M customer accounts
+
+EDUCATION
+Bachelor of Engineering, Computer Science — Anna University
+"""
+
+_CANNED_COVER = """Dear Hiring Manager,
+
+I am excited to apply for this role. Over the past eight years I have owned digital products end to end, from discovery through launch, in regulated banking environments.
+
+In my current role I lead a squad of nine and recently shipped instant payments, growing volume 40% in six months.
+
+I would welcome the chance to bring the same focus on outcomes to your team.
+
+Sincerely,
+Amretha Karthikeyan
+"""
+
+_PRIORITIES = ["Apply Today", "Apply This Week", "Consider", "Skip"]
+
+
+def _fake_completion(prompt):
+    m = re.search(r"JOBS \((\d+)\):", prompt)
+    if m:
+        out = []
+        for i in range(int(m.group(1))):
+            line = re.search(rf"\nJOB {i}: ([^\n]*)", prompt)
+            score = 3 + _seed(line.group(1) if line else i) % 7
+            out.append({"idx": i, "score": score,
+                        "label": "✅ Good Fit" if score >= 7 else "⚠️ Partial Fit",
+                        "reason": "Role overlaps strongly with product ownership experience. Domain fit is reasonable.",
+                        "priority": _PRIORITIES[0 if score >= 9 else 1 if score >= 7 else 2 if score >= 5 else 3]})
+        return json.dumps(out)
+    if '"score": 8' in prompt or "Return ONLY valid JSON" in prompt:
+        score = 3 + _seed(prompt[-400:]) % 7
+        return json.dumps({"score": score, "label": "✅ Good Fit" if score >= 7 else "⚠️ Partial Fit",
+                           "reason": "Strong overlap with backlog ownership and stakeholder work. Some domain gaps.",
+                           "priority": "Apply This Week" if score >= 7 else "Consider"})
+    low = prompt.lower()
+    if "cover letter" in low[:2000]:
+        return _CANNED_COVER
+    if "resume" in low[:2000]:
+        return _CANNED_RESUME
+    return ("Here is a concise answer based on the information provided. "
+            "The role emphasises stakeholder management, delivery and measurable outcomes. " * 4).strip()
+
+
+def _approx_tokens(text):
+    return max(1, len(text) // 4)
+
+
+@app.route("/groq/openai/v1/chat/completions", methods=["POST"])
+def groq_chat():
+    _hit("groq")
+    body = request.get_json(force=True, silent=True) or {}
+    model = body.get("model", "llama-3.3-70b-versatile")
+    prompt = "\n".join(m.get("content", "") for m in body.get("messages", []))
+    _sleep_ms(CONFIG["groq_latency_ms"], CONFIG["groq_jitter_ms"])
+
+    if random.random() < CONFIG["groq_429_rate"]:
+        _hit("groq_429")
+        ra = CONFIG["groq_retry_after"]
+        return jsonify({"error": {"message": f"Rate limit reached for model `{model}`", "type": "tokens",
+                                  "code": "rate_limit_exceeded"}}), 429, {
+            "Retry-After": str(int(ra)), "x-ratelimit-reset-tokens": f"{ra}s"}
+
+    content = _fake_completion(prompt)
+    max_tokens = int(body.get("max_tokens") or 4096)
+    finish = "stop"
+    if _approx_tokens(content) > max_tokens:
+        content, finish = content[:max_tokens * 4], "length"
+    usage = {"prompt_tokens": _approx_tokens(prompt), "completion_tokens": _approx_tokens(content)}
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+    cid = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+    if not body.get("stream"):
+        return jsonify({"id": cid, "object": "chat.completion", "model": model, "usage": usage,
+                        "choices": [{"index": 0, "finish_reason": finish,
+                                     "message": {"role": "assistant", "content": content}}]})
+
+    def events():
+        step = 16
+        pause = step / 4 / max(1.0, CONFIG["groq_tokens_per_sec"])
+        for i in range(0, len(content), step):
+            chunk = {"id": cid, "model": model,
+                     "choices": [{"index": 0, "delta": {"content": content[i:i + step]}, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+            time.sleep(pause)
+        last = {"id": cid, "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": finish}],
+                "x_groq": {"usage": usage}}
+        yield f"data: {json.dumps(last)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return Response(events(), mimetype="text/event-stream")
+
+
+# ─── PostgREST subset ────────────────────────────────────────────────────────
+
+def _coerce(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return v
+
+
+def _matches(row, col, expr):
+    op, _, val = expr.partition(".")
+    cur = row.get(col)
+    if op == "eq":
+        return str(cur) == val or (isinstance(cur, bool) and str(cur).lower() == val)
+    if op == "neq":
+        return str(cur) != val
+    if op == "is":
+        return (cur is None) if val == "null" else str(cur).lower() == val
+    if op == "in":
+        return str(cur) in {v.strip().strip('"') for v in val.strip("()").split(",")}
+    if cur is None:
+        return False
+    a, b = _coerce(cur), _coerce(val)
+    if type(a) is not type(b):
+        a, b = str(a), str(b)
+    return {"gt": a > b, "gte": a >= b, "lt": a < b, "lte": a <= b}.get(op, False)
+
+
+_RESERVED = {"select", "order", "limit", "offset", "on_conflict"}
+
+
+def _filtered(table, args):
+    rows = list(_tables.get(table, {}).values())
+    for col, expr in args.items():
+        if col not in _RESERVED:
+            rows = [r for r in rows if _matches(r, col, expr)]
+    return rows
+
+
+def _project(rows, select):
+    if not select or select == "*":
+        return [dict(r) for r in rows]
+    cols = [c.strip() for c in select.split(",")]
+    return [{c: r.get(c) for c in cols} for r in rows]
+
+
+@app.route("/rest/v1/<table>", methods=["GET", "POST", "PATCH", "DELETE"])
+def postgrest(table):
+    _hit("supabase")
+    _sleep_ms(CONFIG["db_latency_ms"])
+    args = request.args.to_dict()
+    prefer = request.headers.get("Prefer", "")
+    pk = args.get("on_conflict") or _PRIMARY_KEYS.get(table, "id")
+
+    with _lock:
+        store = _tables.setdefault(table, {})
+        if request.method == "GET":
+            rows = _filtered(table, args)
+            total = len(rows)
+            if args.get("order"):
+                col, _, direction = args["order"].partition(".")
+                rows.sort(key=lambda r: (r.get(col) is None, str(r.get(col) or "")),
+                          reverse=direction.startswith("desc"))
+            offset = int(args.get("offset", 0))
+            rows = rows[offset:offset + int(args["limit"])] if args.get("limit") else rows[offset:]
+            headers = {}
+            if "count=" in prefer:
+                headers["Content-Range"] = f"{offset}-{offset + max(len(rows), 1) - 1}/{total}"
+            return jsonify(_project(rows, args.get("select"))), 200, headers
+
+        if request.method == "POST":
+            payload = request.get_json(force=True, silent=True)
+            payload = payload if isinstance(payload, list) else [payload or {}]
+            merge = "merge-duplicates" in prefer
+            ignore = "ignore-duplicates" in prefer
+            out = []
+            for row in payload:
+                key = row.get(pk) or str(uuid.uuid4())
+                if key in store and ignore:
+                    continue
+                if key in store and not merge:
+                    return jsonify({"code": "23505", "message": f"duplicate key value violates unique constraint \"{table}_pkey\""}), 409
+                merged = {**store.get(key, {}), **row, pk: key}
+                store[key] = merged
+                out.append(dict(merged))
+            return jsonify(out), 201
+
+        rows = _filtered(table, args)
+        if request.method == "PATCH":
+            patch = request.get_json(force=True, silent=True) or {}
+            for r in rows:
+                r.update(patch)
+            return jsonify([dict(r) for r in rows]), 200
+        for r in rows:
+            store.pop(r.get(pk), None)
+        return jsonify(rows), 200
+
+
+@app.route("/rest/v1/rpc/<fn>", methods=["POST"])
+def postgrest_rpc(fn):
+    _hit("supabase")
+    return jsonify({"code": "PGRST202", "message": f"Could not find the function public.{fn}"}), 404
+
+
+# ─── Job boards ──────────────────────────────────────────────────────────────
+
+def _synth_jobs(keywords, n, offset=0):
+    base = (keywords or "Product Owner").strip().title()
+    today = datetime.date.today()
+    out = []
+    for i in range(offset, offset + n):
+        s = _seed(base, i)
+        company = _COMPANIES[s % len(_COMPANIES)]
+        title = f"{_SENIORITY[(s >> 4) % len(_SENIORITY)]}{base}"
+        out.append({
+            "id": str(3900000000 + s % 99999999),
+            "uuid": hashlib.md5(f"{base}|{i}".encode()).hexdigest(),
+            "title": title,
+            "company": company,
+            "posted": (today - datetime.timedelta(days=(s >> 8) % 25)).isoformat(),
+            "salary": (6000 + (s % 8) * 500, 9000 + (s % 8) * 700),
+            "description": (
+                f"<p>{company} is hiring a {title} to own the roadmap for a customer-facing digital platform.</p>"
+                "<h3>Responsibilities</h3><ul><li>Own and prioritise the product backlog</li>"
+                "<li>Work with engineering, design and business stakeholders</li>"
+                "<li>Define acceptance criteria and drive sprint ceremonies</li></ul>"
+                "<h3>Requirements</h3><ul><li>5+ years in product or business analysis</li>"
+                "<li>Experience with Agile delivery, Jira and data-driven decisions</li>"
+                "<li>Banking, fintech or e-commerce domain experience preferred</li></ul>"
+                "<p>We offer competitive benefits, hybrid work and a collaborative culture.</p>"
+            ),
+        })
+    return out
+
+
+@app.route("/mcf/v2/jobs", methods=["GET"])
+def mcf_jobs():
+    _hit("mcf")
+    _sleep_ms(CONFIG["board_latency_ms"], CONFIG["board_latency_ms"] / 3)
+    recorded = _fixture("mcf_jobs.json")
+    if recorded:
+        return Response(recorded, mimetype="application/json")
+    limit = int(request.args.get("limit", 20))
+    page = int(request.args.get("page", 0))
+    results = [{
+        "uuid": j["uuid"],
+        "title": j["title"],
+        "description": j["description"],
+        "postedCompany": {"name": j["company"]},
+        "salary": {"minimum": j["salary"][0], "maximum": j["salary"][1], "type": {"salaryType": "Monthly"}},
+        "metadata": {"jobDetailsUrl": f"https://www.mycareersfuture.gov.sg/job/{j['uuid']}",
+                     "newPostingDate": j["posted"]},
+    } for j in _synth_jobs(request.args.get("search", ""), limit, page * limit)]
+    return jsonify({"results": results, "total": 500})
+
+
+def _linkedin_cards(jobs, location):
+    cards = []
+    for j in jobs:
+        cards.append(
+            '<li><div class="base-card job-search-card">'
+            f'<a class="base-card__full-link" href="https://www.linkedin.com/jobs/view/{j["id"]}/?trk=public_jobs"></a>'
+            f'<h3 class="base-search-card__title">{j["title"]}</h3>'
+            f'<h4 class="base-search-card__subtitle"><a>{j["company"]}</a></h4>'
+            f'<span class="job-search-card__location">{location}</span>'
+            f'<time datetime="{j["posted"]}"></time>'
+            '</div></li>'
+        )
+    return "\n".join(cards)
+
+
+@app.route("/linkedin/jobs-guest/jobs/api/seeMoreJobPostings/search", methods=["GET"])
+def linkedin_guest_search():
+    _hit("linkedin")
+    _sleep_ms(CONFIG["board_latency_ms"], CONFIG["board_latency_ms"] / 3)
+    recorded = _fixture("linkedin_guest.html")
+    if recorded:
+        return Response(recorded, mimetype="text/html")
+    start = int(request.args.get("start", 0))
+    jobs = _synth_jobs(request.args.get("keywords", ""), 10, 100 + start)
+    return Response(_linkedin_cards(jobs, request.args.get("location", "Singapore")), mimetype="text/html")
+
+
+@app.route("/linkedin/jobs/search/", methods=["GET"])
+def linkedin_public_search():
+    _hit("linkedin")
+    _sleep_ms(CONFIG["board_latency_ms"], CONFIG["board_latency_ms"] / 3)
+    recorded = _fixture("linkedin_public.html")
+    if recorded:
+        return Response(recorded, mimetype="text/html")
+    jobs = _synth_jobs(request.args.get("keywords", ""), 25, 200)
+    cards = _linkedin_cards(jobs, request.args.get("location", "Singapore"))
+    return Response(f"<html><body><ul class=\"jobs-search__results-list\">{cards}</ul></body></html>",
+                    mimetype="text/html")
+
+
+@app.route("/linkedin/voyager/api/jobs/jobPostings/<job_id>", methods=["GET"])
+def linkedin_voyager_posting(job_id):
+    _hit("linkedin")
+    _sleep_ms(CONFIG["board_latency_ms"], CONFIG["board_latency_ms"] / 3)
+    if random.random() < CONFIG["linkedin_429_rate"]:
+        _hit("linkedin_429")
+        return jsonify({"status": 429}), 429
+    j = _synth_jobs("Product Owner", 1, _seed(job_id) % 1000)[0]
+    return jsonify({"title": j["title"], "description": {"text": re.sub(r"<[^>]+>", " ", j["description"])}})
+
+
+@app.route("/workable/api/v1/jobs", methods=["GET"])
+def workable_jobs():
+    _hit("workable")
+    _sleep_ms(CONFIG["board_latency_ms"], CONFIG["board_latency_ms"] / 3)
+    recorded = _fixture("workable_jobs.json")
+    if recorded:
+        return Response(recorded, mimetype="application/json")
+    jobs = _synth_jobs(request.args.get("query", ""), int(request.args.get("limit", 30)), 300)
+    return jsonify({"jobs": [{
+        "title": j["title"],
+        "company": {"name": j["company"]},
+        "url": f"https://apply.workable.com/j/{j['uuid'][:10].upper()}",
+        "location": {"city": request.args.get("location", "Singapore")},
+        "description": re.sub(r"<[^>]+>", " ", j["description"]),
+    } for j in jobs]})
+
+
+# ─── Twilio sink ─────────────────────────────────────────────────────────────
+
+@app.route("/twilio/2010-04-01/Accounts/<sid>/Messages.json", methods=["POST"])
+def twilio_messages(sid):
+    _hit("twilio")
+    msg = {"sid": f"SM{uuid.uuid4().hex}", "account_sid": sid, "status": "queued",
+           "from": request.form.get("From"), "to": request.form.get("To"), "body": request.form.get("Body")}
+    with _lock:
+        _twilio_sink.append(msg)
+    return jsonify(msg), 201
+
+
+# ─── Control ─────────────────────────────────────────────────────────────────
+
+@app.route("/__fake/stats", methods=["GET"])
+def fake_stats():
+    with _lock:
+        return jsonify({"hits": dict(_hits), "tables": {t: len(r) for t, r in _tables.items()},
+                        "twilio_messages": len(_twilio_sink), "config": CONFIG})
+
+
+@app.route("/__fake/config", methods=["POST"])
+def fake_config():
+    for k, v in (request.get_json(force=True, silent=True) or {}).items():
+        if k in CONFIG:
+            CONFIG[k] = float(v)
+    return jsonify(CONFIG)
+
+
+@app.route("/__fake/reset", methods=["POST"])
+def fake_reset():
+    with _lock:
+        _hits.clear()
+        _tables.clear()
+        _twilio_sink.clear()
+    return jsonify({"ok": True})
+
+
+def serve_in_thread(host="127.0.0.1", port=8765):
+    """Start the fake services on a daemon thread (used by loadtest.py)."""
+    from werkzeug.serving import make_server
+    server = make_server(host, port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def record(keywords="Product Owner", location="Singapore"):
+    """Capture live job-board responses into FIXTURES_DIR for replay."""
+    import urllib.parse
+    import requests
+    q, loc = urllib.parse.quote_plus(keywords), urllib.parse.quote_plus(location)
+    ua = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"}
+    targets = {
+        "mcf_jobs.json": f"https://api.mycareersfuture.gov.sg/v2/jobs?search={q}&limit=50&page=0&sortBy=new_posting_date",
+        "linkedin_guest.html": f"https://www.linkedin.com/jobs-guest/jobs/api/seeMoreJobPostings/search?keywords={q}&location={loc}&start=0",
+        "linkedin_public.html": f"https://www.linkedin.com/jobs/search/?keywords={q}&location={loc}",
+        "workable_jobs.json": f"https://jobs.workable.com/api/v1/jobs?query={q}&location={loc}&limit=30",
+    }
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    for name, url in targets.items():
+        try:
+            resp = requests.get(url, headers=ua, timeout=20)
+            if resp.status_code != 200:
+                print(f"[record] {name}: HTTP {resp.status_code}, skipped")
+                continue
+            with open(os.path.join(FIXTURES_DIR, name), "w", encoding="utf-8") as f:
+                f.write(resp.text)
+            print(f"[record] {name}: {len(resp.text)} bytes")
+        except Exception as e:
+            print(f"[record] {name}: {e}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "record":
+        record(*sys.argv[2:4])
+        sys.exit(0)
+    port = int(os.environ.get("FAKE_SERVICES_PORT", "8765"))
+    print(f"[fake] Serving fake upstreams on http://127.0.0.1:{port}")
+    app.run(host="127.0.0.1", port=port, threaded=True)
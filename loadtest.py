@@ -0,0 +1,185 @@
+"""
+Load-test the hot routes against the fake upstreams in fake_services.py.
+
+By default this starts the fake services and the Flask app in-process (with
+JOBHUNT_FAKE_SERVICES pointing at them), seeds the fake Supabase, drives each
+scenario with N requests at the given concurrency, and prints throughput and
+latency percentiles. Point --target at an already running server (e.g.
+gunicorn started with JOBHUNT_FAKE_SERVICES set) to measure that instead.
+
+    python loadtest.py
+    python loadtest.py --scenarios jobs,discover --requests 50 --concurrency 8
+    python loadtest.py --groq-latency-ms 1500 --groq-429-rate 0.2 --json
+    python loadtest.py --groq-tpm 1000000          # lift client-side TPM pacing
+    python loadtest.py --target http://127.0.0.1:8000 --fake http://127.0.0.1:8765
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+SCENARIOS = ("jobs", "discover", "bulk_apply", "agent_run")
+
+_JD = ("We are looking for a Product Owner to own the backlog for our digital banking platform. "
+       "You will work with engineering, design and business stakeholders, define acceptance criteria, "
+       "run sprint ceremonies and use data to prioritise. 5+ years of product or business analysis "
+       "experience in banking or fintech required; Jira, SQL and Agile delivery a plus.")
+
+
+def _job(i, **extra):
+    return dict({"id": f"load-{i}", "role": "Product Owner", "company": f"Company {sum(map(ord, str(i))) % 17}",
+                 "platform": "MyCareersFuture", "jd": _JD, "status": "Saved"}, **extra)
+
+
+def percentile(sorted_ms, p):
+    if not sorted_ms:
+        return 0.0
+    k = min(len(sorted_ms) - 1, max(0, int(round(p / 100 * len(sorted_ms) + 0.5)) - 1))
+    return sorted_ms[k]
+
+
+def seed_jobs(fake, n):
+    requests.post(f"{fake}/__fake/reset", timeout=10)
+    rows = [_job(i) for i in range(n)]
+    requests.post(f"{fake}/rest/v1/jobs", json=rows, timeout=30,
+                  headers={"Prefer": "resolution=merge-duplicates,return=representation"})
+
+
+def make_request(target, scenario, i, args):
+    if scenario == "jobs":
+        return requests.get(f"{target}/api/jobs", timeout=120)
+    if scenario == "discover":
+        return requests.post(f"{target}/api/discover-jobs", timeout=300, json={
+            "keywords": args.keywords, "location": "Singapore", "maxDays": 30,
+            "platforms": ["mycareersfuture", "linkedin_guest", "workable", "linkedin", "mcf_extended"]})
+    if scenario == "bulk_apply":
+        jobs = [_job(f"bulk-{i}-{k}", aiScore=8) for k in range(args.bulk_jobs)]
+        return requests.post(f"{target}/api/bulk-apply", timeout=600,
+                             json={"jobIds": [j["id"] for j in jobs], "jobs": jobs})
+    if scenario == "agent_run":
+        return requests.post(f"{target}/api/agent/run", json={"force_all": False}, timeout=120)
+    raise ValueError(scenario)
+
+
+def run_scenario(target, scenario, args):
+    lat, errors = [], 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        t0 = time.perf_counter()
+        try:
+            resp = make_request(target, scenario, i, args)
+            ok = resp.status_code < 400
+        except requests.RequestException:
+            ok = False
+        ms = (time.perf_counter() - t0) * 1000
+        with lock:
+            lat.append(ms)
+            errors += 0 if ok else 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one, range(args.requests)))
+    wall = time.perf_counter() - started
+    lat.sort()
+    return {
+        "scenario": scenario, "requests": len(lat), "errors": errors,
+        "concurrency": args.concurrency, "wall_s": round(wall, 2),
+        "throughput_rps": round(len(lat) / wall, 2) if wall else 0.0,
+        "p50_ms": round(percentile(lat, 50), 1), "p90_ms": round(percentile(lat, 90), 1),
+        "p99_ms": round(percentile(lat, 99), 1), "max_ms": round(lat[-1], 1) if lat else 0.0,
+    }
+
+
+def wait_for_agent(target, timeout):
+    """The agent runs in a background thread — report how long it takes to drain."""
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < timeout:
+        status = requests.get(f"{target}/api/agent/status", timeout=30).json()
+        if status.get("total") and not status.get("pending"):
+            return round(time.perf_counter() - t0, 2)
+        time.sleep(0.5)
+    return None
+
+
+def start_local(fake_port, app_port, groq_tpm=None):
+    fake = f"http://127.0.0.1:{fake_port}"
+    os.environ["JOBHUNT_FAKE_SERVICES"] = fake
+    if groq_tpm:
+        # call_claude paces itself against each model's TPM limit; against the
+        # fake Groq that pacing, not the upstream, is usually what gets measured.
+        for slug in ("LLAMA_3_3_70B_VERSATILE", "LLAMA_3_1_8B_INSTANT"):
+            os.environ[f"GROQ_TPM_{slug}"] = str(groq_tpm)
+    os.environ.setdefault("TWILIO_ACCOUNT_SID", "ACfake")
+    os.environ.setdefault("TWILIO_AUTH_TOKEN", "fake")
+    os.environ.setdefault("NOTIFICATION_PHONE", "+6500000000")
+    import fake_services
+    fake_services.serve_in_thread(port=fake_port)
+
+    from werkzeug.serving import make_server
+    from web_main import app
+    server = make_server("127.0.0.1", app_port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{app_port}", fake
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS))
+    ap.add_argument("--requests", type=int, default=20, help="requests per scenario")
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--seed-jobs", type=int, default=200, help="rows seeded into the fake jobs table")
+    ap.add_argument("--bulk-jobs", type=int, default=2, help="jobs per /api/bulk-apply request")
+    ap.add_argument("--keywords", default="Product Owner")
+    ap.add_argument("--groq-latency-ms", type=float)
+    ap.add_argument("--groq-429-rate", type=float)
+    ap.add_argument("--board-latency-ms", type=float)
+    ap.add_argument("--groq-tpm", type=int, help="override the app's per-model TPM limit (in-process only)")
+    ap.add_argument("--agent-timeout", type=float, default=300)
+    ap.add_argument("--target", help="base URL of a running app (default: start one in-process)")
+    ap.add_argument("--fake", default="http://127.0.0.1:8765", help="fake services URL when --target is used")
+    ap.add_argument("--fake-port", type=int, default=8765)
+    ap.add_argument("--app-port", type=int, default=5055)
+    ap.add_argument("--json", action="store_true", help="print results as JSON")
+    args = ap.parse_args(argv)
+
+    if args.target:
+        target, fake = args.target.rstrip("/"), args.fake.rstrip("/")
+    else:
+        target, fake = start_local(args.fake_port, args.app_port, args.groq_tpm)
+
+    knobs = {"groq_latency_ms": args.groq_latency_ms, "groq_429_rate": args.groq_429_rate,
+             "board_latency_ms": args.board_latency_ms}
+    knobs = {k: v for k, v in knobs.items() if v is not None}
+    if knobs:
+        requests.post(f"{fake}/__fake/config", json=knobs, timeout=10)
+
+    results = []
+    for scenario in [s.strip() for s in args.scenarios.split(",") if s.strip()]:
+        if scenario not in SCENARIOS:
+            sys.exit(f"unknown scenario {scenario!r} (choose from {', '.join(SCENARIOS)})")
+        seed_jobs(fake, args.seed_jobs)
+        res = run_scenario(target, scenario, args)
+        if scenario == "agent_run":
+            res["agent_drain_s"] = wait_for_agent(target, args.agent_timeout)
+        res["upstream_hits"] = requests.get(f"{fake}/__fake/stats", timeout=10).json()["hits"]
+        results.append(res)
+        if not args.json:
+            print(f"{res['scenario']:<11} n={res['requests']:<4} err={res['errors']:<3} "
+                  f"{res['throughput_rps']:>7.2f} req/s  p50={res['p50_ms']:>8.1f}ms  "
+                  f"p90={res['p90_ms']:>8.1f}ms  p99={res['p99_ms']:>8.1f}ms  max={res['max_ms']:>8.1f}ms"
+                  + (f"  drain={res['agent_drain_s']}s" if "agent_drain_s" in res else ""))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# web_main reads its configuration at import time: no Supabase, no Groq, and a
+# throwaway local store so tests never touch jobhunt_local.db.
+os.environ["SUPABASE_URL"] = ""
+os.environ["SUPABASE_KEY"] = ""
+os.environ["GROQ_API_KEY"] = ""
+os.environ["LOCAL_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="jobhunt_tests_"), "jobhunt_local.db")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+import web_main as wm
+
+
+@pytest.fixture(autouse=True)
+def empty_queue():
+    wm.bookmark_drain()
+    wm._local_db().execute("DELETE FROM bookmark_seen")
+    yield
+    wm.bookmark_drain()
+
+
+def _capture(url, role="Product Owner", company="Acme"):
+    return {"role": role, "company": company, "url": url, "status": "wishlist"}
+
+
+def test_failed_flush_keeps_capture_in_queue(monkeypatch):
+    # Nothing listens on port 9, so the Supabase write fails for real.
+    monkeypatch.setattr(wm, "SUPABASE_URL", "http://127.0.0.1:9")
+    monkeypatch.setattr(wm, "SUPABASE_KEY", "test")
+
+    assert len(wm.ingest_captured_jobs([_capture("https://www.linkedin.com/jobs/view/4100000001/")])) == 1
+    drained, deadline = [], time.monotonic() + 10
+    while not drained and time.monotonic() < deadline:
+        wm._ingest_buffer.flush()          # races the flusher thread; either one flushes
+        drained = wm.bookmark_drain()
+        time.sleep(0.05)
+
+    assert [j["id"] for j in drained] == ["li_4100000001"]
+
+
+def test_recapture_is_deduplicated_without_supabase():
+    job = _capture("https://careers.example.com/jobs/42?utm_source=x")
+    assert len(wm.ingest_captured_jobs([job])) == 1
+    assert wm.ingest_captured_jobs([dict(job, url="https://careers.example.com/jobs/42/")]) == []
+    assert len(wm.bookmark_drain()) == 1
+
+
+@pytest.mark.parametrize("a, b", [
+    ("https://sg.indeed.com/viewjob?jk=abc123", "https://sg.indeed.com/viewjob?jk=zzz999"),
+    ("https://sg.indeed.com/jobs?q=po&vjk=abc123", "https://sg.indeed.com/jobs?q=po&vjk=zzz999"),
+    ("https://boards.example.com/acme?gh_jid=1", "https://boards.example.com/acme?gh_jid=2"),
+])
+def test_job_identifying_query_keeps_captures_apart(a, b):
+    ids = {wm._capture_job_id(wm.canonical_job_url(u), "Product Owner", "Acme") for u in (a, b)}
+    assert len(ids) == 2
+    assert len(wm.ingest_captured_jobs([_capture(a), _capture(b, role="Business Analyst")])) == 2
+
+
+def test_tracking_query_is_dropped():
+    assert (wm.canonical_job_url("https://sg.indeed.com/viewjob?utm_source=x&jk=abc123&from=serp#top")
+            == "https://sg.indeed.com/viewjob?jk=abc123")
+    assert (wm.canonical_job_url("https://www.linkedin.com/jobs/search/?currentJobId=3900000001&keywords=po")
+            == "https://www.linkedin.com/jobs/view/3900000001/")
+
+
+
+def test_flush_skips_a_job_tracked_under_another_id(monkeypatch):
+    import fake_services
+    server = fake_services.serve_in_thread(port=0)
+    monkeypatch.setattr(wm, "SUPABASE_URL", f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setattr(wm, "SUPABASE_KEY", "test")
+    monkeypatch.setitem(fake_services.CONFIG, "db_latency_ms", 0)
+    try:
+        wm.get_supabase().table("jobs").upsert({"id": "frontend-1", "role": "Product Owner", "company": "Acme",
+                                                "url": "https://careers.example.com/jobs/1"}).execute()
+        rows = [wm._job_row(dict(_capture(u), id=wm._capture_job_id(u, "", "")))
+                for u in ("https://careers.example.com/jobs/1", "https://careers.example.com/jobs/2")]
+        assert [r["url"] for r in wm._flush_ingest(rows)] == ["https://careers.example.com/jobs/2"]
+    finally:
+        server.shutdown()
+
+
+def test_ingest_hand_off_does_not_notify(monkeypatch):
+    runs, sent = [], []
+    monkeypatch.setattr(wm, "score_jobs_batched", lambda jobs, **kw: {"scored": 0, "failed": 0, "calls": 0})
+    monkeypatch.setattr(wm, "agent_process_job", lambda job: (job, []))
+    monkeypatch.setattr(wm, "_send_agent_notifications", sent.append)
+    monkeypatch.setattr(wm, "start_company_precompute", runs.append)
+    wm._ingest_buffer._hand_off([_capture("https://careers.example.com/jobs/9")])
+    deadline = time.monotonic() + 5
+    while not runs and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert runs and sent == []
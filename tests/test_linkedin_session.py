@@ -0,0 +1,29 @@
+import pytest
+
+import web_main as wm
+
+
+@pytest.fixture
+def session(monkeypatch):
+    s = wm._LinkedInSession()
+    calls = []
+    monkeypatch.setattr(wm, "_upstream_request", lambda *a, **kw: calls.append(kw.get("session")))
+    yield s, calls
+    s.reset()
+
+
+def test_request_never_goes_out_without_a_session(session, monkeypatch):
+    s, calls = session
+    monkeypatch.setattr(wm, "_get_li_at_cookie", lambda: "")
+    with pytest.raises(RuntimeError):
+        s.request("GET", f"{wm.LINKEDIN_BASE}/voyager/api/me", allow_login=False)
+    assert calls == []
+
+
+def test_ensure_hands_back_the_session_it_checked(session, monkeypatch):
+    s, calls = session
+    monkeypatch.setattr(wm, "_get_li_at_cookie", lambda: "cookie-1")
+    gen, http = s.ensure(allow_login=False)
+    s.reset()                                   # another thread drops the session
+    assert http is not None and gen == s.generation
+    assert http.cookies.get("li_at") == "cookie-1"
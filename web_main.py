@@ -35,6 +35,20 @@ FIRECRAWL_API_KEY = os.environ.get("FIRECRAWL_API_KEY", "")
 SUPABASE_URL = os.environ.get("SUPABASE_URL", "")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY", "")
 
+# Upstream base URLs. JOBHUNT_FAKE_SERVICES=http://127.0.0.1:8765 points Groq,
+# Supabase, MCF, LinkedIn, Workable and Twilio at the local stand-ins served
+# by fake_services.py, so hot paths can be benchmarked offline.
+FAKE_SERVICES_URL = os.environ.get("JOBHUNT_FAKE_SERVICES", "").rstrip("/")
+GROQ_API_BASE   = f"{FAKE_SERVICES_URL}/groq" if FAKE_SERVICES_URL else "https://api.groq.com"
+MCF_API_BASE    = f"{FAKE_SERVICES_URL}/mcf" if FAKE_SERVICES_URL else "https://api.mycareersfuture.gov.sg"
+LINKEDIN_BASE   = f"{FAKE_SERVICES_URL}/linkedin" if FAKE_SERVICES_URL else "https://www.linkedin.com"
+WORKABLE_BASE   = f"{FAKE_SERVICES_URL}/workable" if FAKE_SERVICES_URL else "https://jobs.workable.com"
+TWILIO_API_BASE = f"{FAKE_SERVICES_URL}/twilio" if FAKE_SERVICES_URL else "https://api.twilio.com"
+if FAKE_SERVICES_URL:
+    SUPABASE_URL, SUPABASE_KEY = FAKE_SERVICES_URL, "fake-service-key"
+    GROQ_API_KEY = GROQ_API_KEY or "fake-groq-key"
+    print(f"[BOOT] Using fake upstream services at {FAKE_SERVICES_URL}")
+
 print(f"[BOOT] GROQ_API_KEY={'SET' if GROQ_API_KEY else 'MISSING'}")
 print(f"[BOOT] SUPABASE_URL={'SET' if SUPABASE_URL else 'MISSING'} ({SUPABASE_URL[:30]}...)" if SUPABASE_URL else "[BOOT] SUPABASE_URL=MISSING")
 print(f"[BOOT] SUPABASE_KEY={'SET' if SUPABASE_KEY else 'MISSING'}")
@@ -42,6 +56,1038 @@ print(f"[BOOT] SUPABASE_KEY={'SET' if SUPABASE_KEY else 'MISSING'}")
 _supabase_error = None
 
 
+# ─── METRICS ─────────────────────────────────────────────────────────────────
+# In-process counters, gauges and histograms rendered in Prometheus text format
+# at /metrics. Under gunicorn every worker flushes its own snapshot to
+# METRICS_DIR/<pid>.json (at most once per METRICS_FLUSH_INTERVAL seconds) and
+# the worker serving the scrape merges all of them: counters and histograms are
+# summed across every file, gauges only across live processes.
+
+import time
+import tempfile
+import threading
+
+METRICS_DIR = os.environ.get("METRICS_DIR") or os.path.join(tempfile.gettempdir(), "jobhunt_metrics")
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "1"))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_METRIC_HELP = {
+    "jobhunt_http_request_duration_seconds":     ("histogram", "Flask request latency by route, method and status."),
+    "jobhunt_upstream_request_duration_seconds": ("histogram", "Outbound call latency by upstream and HTTP status."),
+    "jobhunt_upstream_rejected_total":           ("counter",   "Calls refused locally because the upstream's circuit was open."),
+    "jobhunt_llm_requests_total":                ("counter",   "Completed LLM calls by route, model and finish reason."),
+    "jobhunt_llm_tokens_total":                  ("counter",   "LLM tokens by route, model and kind (prompt/completion)."),
+    "jobhunt_cache_requests_total":              ("counter",   "Cache lookups by cache and result (hit/miss)."),
+    "jobhunt_queue_depth":                       ("gauge",     "Items waiting in an in-process work queue."),
+    "jobhunt_doc_render_duration_seconds":       ("histogram", "Document render time by output format."),
+    "jobhunt_ingest_jobs_total":                 ("counter",   "Captured jobs by ingestion result (inserted/duplicate/deferred)."),
+}
+
+
+class _Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}          # (name, labels) -> value
+        self._gauges = {}
+        self._hists = {}             # (name, labels) -> [bucket counts..., sum, count]
+        self._dirty = False
+        self._flusher_pid = None
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in (labels or {}).items()))
+
+    def inc(self, name, labels=None, value=1):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+            self._dirty = True
+        self._ensure_flusher()
+
+    def set(self, name, value, labels=None):
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+            self._dirty = True
+        self._ensure_flusher()
+
+    def observe(self, name, value, labels=None):
+        key = self._key(name, labels)
+        with self._lock:
+            h = self._hists.get(key)
+            if h is None:
+                h = self._hists[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+            for i, le in enumerate(LATENCY_BUCKETS):
+                if value <= le:
+                    h[i] += 1
+                    break
+            h[-2] += value
+            h[-1] += 1
+            self._dirty = True
+        self._ensure_flusher()
+
+    def snapshot(self):
+        with self._lock:
+            return {"pid": os.getpid(),
+                    "counters": [[n, list(l), v] for (n, l), v in self._counters.items()],
+                    "gauges":   [[n, list(l), v] for (n, l), v in self._gauges.items()],
+                    "hists":    [[n, list(l), list(h)] for (n, l), h in self._hists.items()]}
+
+    # ── multi-process ──
+    def _ensure_flusher(self):
+        if self._flusher_pid == os.getpid() or not METRICS_DIR:
+            return
+        self._flusher_pid = os.getpid()      # also re-arms after a fork
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            if self._dirty:
+                self.flush()
+
+    def flush(self):
+        try:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            self._dirty = False
+            path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+            tmp = f"{path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"[Metrics] flush failed: {e}")
+
+    def _collect(self):
+        snaps = [self.snapshot()]
+        if METRICS_DIR and os.path.isdir(METRICS_DIR):
+            for fn in os.listdir(METRICS_DIR):
+                if not fn.endswith(".json") or fn == f"{os.getpid()}.json":
+                    continue
+                try:
+                    with open(os.path.join(METRICS_DIR, fn)) as f:
+                        snap = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                if not _pid_alive(snap.get("pid")):
+                    snap["gauges"] = []
+                snaps.append(snap)
+        counters, gauges, hists = {}, {}, {}
+        for snap in snaps:
+            for n, l, v in snap["counters"]:
+                k = (n, tuple(map(tuple, l)))
+                counters[k] = counters.get(k, 0) + v
+            for n, l, v in snap["gauges"]:
+                k = (n, tuple(map(tuple, l)))
+                gauges[k] = gauges.get(k, 0) + v
+            for n, l, h in snap["hists"]:
+                k = (n, tuple(map(tuple, l)))
+                cur = hists.setdefault(k, [0] * len(h))
+                for i, v in enumerate(h):
+                    cur[i] += v
+        return counters, gauges, hists
+
+    def render(self):
+        """Prometheus text exposition (version 0.0.4) merged across workers."""
+        counters, gauges, hists = self._collect()
+        series = {}                  # name -> [(labels, lines)]
+        for (n, l), v in list(counters.items()) + list(gauges.items()):
+            series.setdefault(n, []).append((l, [f"{n}{_fmt_labels(l)} {_fmt_num(v)}"]))
+        for (n, l), h in hists.items():
+            lines, cum = [], 0
+            for le, c in zip(LATENCY_BUCKETS, h):
+                cum += c
+                lines.append(f"{n}_bucket{_fmt_labels(l + (('le', _fmt_num(le)),))} {cum}")
+            lines.append(f"{n}_bucket{_fmt_labels(l + (('le', '+Inf'),))} {h[-1]}")
+            lines.append(f"{n}_sum{_fmt_labels(l)} {_fmt_num(h[-2])}")
+            lines.append(f"{n}_count{_fmt_labels(l)} {h[-1]}")
+            series.setdefault(n, []).append((l, lines))
+        out = []
+        for n in sorted(series):
+            kind, text = _METRIC_HELP.get(n, ("untyped", n))
+            out += [f"# HELP {n} {text}", f"# TYPE {n} {kind}"]
+            for _, lines in sorted(series[n], key=lambda x: x[0]):
+                out += lines
+        return "\n".join(out) + "\n"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(int(pid), 0)
+        return True
+    except (OSError, TypeError, ValueError):
+        return False
+
+
+def _fmt_labels(labels):
+    if not labels:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels) + "}"
+
+
+def _fmt_num(v):
+    return repr(float(v)) if isinstance(v, float) and not float(v).is_integer() else str(int(v))
+
+
+metrics = _Metrics()
+
+
+@app.before_request
+def _metrics_start_timer():
+    from flask import g
+    g._metrics_t0 = time.perf_counter()
+
+
+@app.after_request
+def _metrics_observe_request(response):
+    from flask import g
+    t0 = getattr(g, "_metrics_t0", None)
+    if t0 is not None and request.endpoint != "metrics_endpoint":
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe("jobhunt_http_request_duration_seconds", time.perf_counter() - t0,
+                        {"route": route, "method": request.method, "status": response.status_code})
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus scrape endpoint (all gunicorn workers merged)."""
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+# ─── TRACING ─────────────────────────────────────────────────────────────────
+# Nested spans for the long agent flows: pipeline → stage → job → upstream
+# call. start_trace() opens a root span; span() adds a child of the innermost
+# open span on the current thread and is a no-op when no trace is active, so
+# instrumented helpers cost nothing on ordinary requests. Work handed to a
+# thread pool keeps its parent via traced(). Finished traces are kept in
+# memory and written to TRACE_DIR/<trace_id>.json (newest TRACE_KEEP) so any
+# worker can serve them at /api/traces/<id> — as JSON, a waterfall, or OTLP.
+
+import secrets
+import contextlib
+
+TRACE_DIR = os.environ.get("TRACE_DIR") or os.path.join(tempfile.gettempdir(), "jobhunt_traces")
+TRACE_KEEP = int(os.environ.get("TRACE_KEEP", "50"))
+TRACE_MAX_SPANS = int(os.environ.get("TRACE_MAX_SPANS", "5000"))
+
+_trace_local = threading.local()
+_recent_traces = {}                  # trace_id -> trace dict, insertion ordered
+_recent_traces_lock = threading.Lock()
+
+
+class _Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns",
+                 "attrs", "events", "status", "error", "is_stage")
+
+    def __init__(self, trace, name, parent, kind, attrs):
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attrs = {k: v for k, v in attrs.items() if v is not None}
+        self.events = []
+        self.status = "ok"
+        self.error = None
+        self.is_stage = False
+
+    def set(self, **attrs):
+        self.attrs.update({k: v for k, v in attrs.items() if v is not None})
+        return self
+
+    def event(self, name, **attrs):
+        self.events.append({"time_ns": time.time_ns(), "name": str(name)[:300], "attrs": attrs})
+
+    def fail(self, error):
+        self.status = "error"
+        self.error = str(error)[:500]
+
+    def finish(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self.trace.add(self)
+
+    def to_dict(self):
+        return {"span_id": self.span_id, "parent_id": self.parent_id, "name": self.name,
+                "kind": self.kind, "start_ns": self.start_ns, "end_ns": self.end_ns,
+                "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+                "attrs": self.attrs, "events": self.events, "status": self.status, "error": self.error}
+
+
+class _NullSpan:
+    """Stands in for a span when no trace is active."""
+    def set(self, **attrs):
+        return self
+
+    def event(self, name, **attrs):
+        pass
+
+    def fail(self, error):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Trace:
+    def __init__(self, name):
+        self.trace_id = secrets.token_hex(16)
+        self.name = name
+        self._lock = threading.Lock()
+        self.spans = []
+        self.dropped = 0
+
+    def add(self, sp):
+        with self._lock:
+            if len(self.spans) < TRACE_MAX_SPANS:
+                self.spans.append(sp)
+            else:
+                self.dropped += 1
+
+    def to_dict(self, root):
+        with self._lock:
+            spans = sorted((s.to_dict() for s in self.spans), key=lambda s: s["start_ns"])
+        return {"trace_id": self.trace_id, "name": self.name, "pid": os.getpid(),
+                "start_ns": root.start_ns, "end_ns": root.end_ns,
+                "duration_ms": round((root.end_ns - root.start_ns) / 1e6, 3),
+                "status": root.status, "attrs": root.attrs,
+                "span_count": len(spans), "dropped_spans": self.dropped, "spans": spans}
+
+
+def _span_stack():
+    st = getattr(_trace_local, "stack", None)
+    if st is None:
+        st = _trace_local.stack = []
+    return st
+
+
+def current_span():
+    st = _span_stack()
+    return st[-1] if st else None
+
+
+@contextlib.contextmanager
+def _open_span(sp):
+    st = _span_stack()
+    depth = len(st)
+    st.append(sp)
+    try:
+        yield sp
+    except BaseException as e:
+        sp.fail(f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        while len(st) > depth:          # also closes stages left open inside sp
+            st.pop().finish()
+
+
+@contextlib.contextmanager
+def span(name, kind="internal", **attrs):
+    """Child of the current span; a no-op outside a trace."""
+    parent = current_span()
+    if parent is None:
+        yield _NULL_SPAN
+        return
+    with _open_span(_Span(parent.trace, name, parent, kind, attrs)) as sp:
+        yield sp
+
+
+@contextlib.contextmanager
+def start_trace(name, **attrs):
+    """Root span of a new trace, stored when it ends. Inside an existing trace
+    it is just a child span, so agent_run() traces on its own or as a stage."""
+    if current_span() is not None:
+        with span(name, **attrs) as sp:
+            yield sp
+        return
+    root = _Span(_Trace(name), name, None, "internal", attrs)
+    root.attrs["trace_id"] = root.trace.trace_id
+    try:
+        with profiled(name), _open_span(root) as sp:
+            yield sp
+    finally:
+        _store_trace(root.trace.to_dict(root))
+
+
+def trace_stage(name, **attrs):
+    """Sequential stage marker for long flat functions: ends the previous
+    stage (if the innermost span is one) and opens the next as a sibling.
+    The last stage is closed when its enclosing span ends."""
+    st = _span_stack()
+    if not st:
+        return _NULL_SPAN
+    if st[-1].is_stage:
+        st.pop().finish()
+    parent = st[-1]
+    sp = _Span(parent.trace, name, parent, "internal", attrs)
+    sp.is_stage = True
+    st.append(sp)
+    return sp
+
+
+def trace_event(name, **attrs):
+    sp = current_span()
+    if sp is not None:
+        sp.event(name, **attrs)
+
+
+def traced(fn, name=None, **attrs):
+    """Wrap fn for a worker thread so it runs under the caller's current span
+    (inside a child span `name`, if given)."""
+    parent = current_span()
+    if parent is None:
+        return fn
+
+    def run(*args, **kwargs):
+        st = _span_stack()
+        depth = len(st)
+        st.append(parent)
+        try:
+            if name is None:
+                return fn(*args, **kwargs)
+            with span(name, **attrs):
+                return fn(*args, **kwargs)
+        finally:
+            del st[depth:]
+    return run
+
+
+def _store_trace(data):
+    with _recent_traces_lock:
+        _recent_traces[data["trace_id"]] = data
+        while len(_recent_traces) > TRACE_KEEP:
+            _recent_traces.pop(next(iter(_recent_traces)))
+    if not TRACE_DIR:
+        return
+    try:
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        path = os.path.join(TRACE_DIR, f"{data['trace_id']}.json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(data, f, default=str)
+        os.replace(f"{path}.tmp", path)
+        files = sorted((e for e in os.scandir(TRACE_DIR) if e.name.endswith(".json")),
+                       key=lambda e: e.stat().st_mtime, reverse=True)
+        for e in files[TRACE_KEEP:]:
+            os.remove(e.path)
+    except OSError as e:
+        print(f"[Trace] could not persist {data['trace_id']}: {e}")
+    print(f"[Trace] {data['name']} {data['trace_id']} — {data['span_count']} spans, {data['duration_ms']:.0f}ms")
+
+
+def _load_trace(trace_id):
+    if not re.fullmatch(r"[0-9a-f]{32}", trace_id or ""):
+        return None
+    with _recent_traces_lock:
+        if trace_id in _recent_traces:
+            return _recent_traces[trace_id]
+    try:
+        with open(os.path.join(TRACE_DIR, f"{trace_id}.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _list_traces():
+    found = {}
+    if TRACE_DIR and os.path.isdir(TRACE_DIR):
+        for e in os.scandir(TRACE_DIR):
+            if not e.name.endswith(".json"):
+                continue
+            try:
+                with open(e.path) as f:
+                    found[e.name[:-5]] = json.load(f)
+            except (OSError, ValueError):
+                continue
+    with _recent_traces_lock:
+        found.update(_recent_traces)
+    keys = ("trace_id", "name", "start_ns", "duration_ms", "status", "span_count", "attrs")
+    return sorted(({k: t.get(k) for k in keys} for t in found.values()),
+                  key=lambda t: t["start_ns"] or 0, reverse=True)
+
+
+def _otlp_value(v):
+    if isinstance(v, bool):
+        return {"boolValue": v}
+    if isinstance(v, int):
+        return {"intValue": str(v)}
+    if isinstance(v, float):
+        return {"doubleValue": v}
+    if isinstance(v, (list, tuple)):
+        return {"arrayValue": {"values": [_otlp_value(x) for x in v]}}
+    return {"stringValue": str(v)}
+
+
+def _otlp_attrs(attrs):
+    return [{"key": k, "value": _otlp_value(v)} for k, v in (attrs or {}).items()]
+
+
+def trace_to_otlp(data):
+    """OTLP/JSON ExportTraceServiceRequest — POST it to any collector's /v1/traces."""
+    kinds = {"internal": 1, "server": 2, "client": 3}
+    spans = []
+    for s in data["spans"]:
+        otlp = {
+            "traceId": data["trace_id"], "spanId": s["span_id"], "name": s["name"],
+            "kind": kinds.get(s["kind"], 1),
+            "startTimeUnixNano": str(s["start_ns"]), "endTimeUnixNano": str(s["end_ns"]),
+            "attributes": _otlp_attrs(s["attrs"]),
+            "events": [{"timeUnixNano": str(ev["time_ns"]), "name": ev["name"],
+                        "attributes": _otlp_attrs(ev["attrs"])} for ev in s["events"]],
+            "status": {"code": 2, "message": s["error"] or ""} if s["status"] == "error" else {"code": 1},
+        }
+        if s["parent_id"]:
+            otlp["parentSpanId"] = s["parent_id"]
+        spans.append(otlp)
+    resource = {"service.name": "job-hunt-app", "process.pid": data.get("pid", 0)}
+    return {"resourceSpans": [{"resource": {"attributes": _otlp_attrs(resource)},
+                               "scopeSpans": [{"scope": {"name": "web_main.tracing"}, "spans": spans}]}]}
+
+
+def trace_waterfall_html(data):
+    import html as _html
+    spans = data["spans"]
+    children = {}
+    for s in spans:
+        children.setdefault(s["parent_id"], []).append(s)
+    ordered = []
+
+    def walk(parent_id, depth):
+        for s in children.get(parent_id, []):
+            ordered.append((s, depth))
+            walk(s["span_id"], depth + 1)
+    walk(None, 0)
+
+    t0 = data["start_ns"]
+    total = max(data["end_ns"] - t0, 1)
+    rows = []
+    for s, depth in ordered:
+        left = (s["start_ns"] - t0) / total * 100
+        width = max((s["end_ns"] - s["start_ns"]) / total * 100, 0.15)
+        colour = "#dc2626" if s["status"] == "error" else ("#0891b2" if s["kind"] == "client" else "#4f46e5")
+        title = _html.escape(json.dumps(dict(s["attrs"], error=s["error"]) if s["error"] else s["attrs"],
+                                        default=str))
+        rows.append(
+            f"<tr title='{title}'><td style='padding-left:{8 + depth * 16}px;white-space:nowrap'>"
+            f"{_html.escape(s['name'])}</td><td class='ms'>{s['duration_ms']:.1f}</td>"
+            f"<td class='lane'><div class='bar' style='left:{left:.3f}%;width:{width:.3f}%;"
+            f"background:{colour}'></div></td></tr>")
+    return f"""<!doctype html><html><head><meta charset="utf-8"><title>{_html.escape(data['name'])}</title>
+<style>body{{font:13px -apple-system,sans-serif;margin:20px}}table{{width:100%;border-collapse:collapse}}
+td{{padding:3px 8px;border-bottom:1px solid #f3f4f6}}.ms{{text-align:right;color:#6b7280;width:80px}}
+.lane{{position:relative;width:60%}}.bar{{position:absolute;top:4px;height:12px;border-radius:2px}}</style>
+</head><body><h2>{_html.escape(data['name'])} — {data['duration_ms']:.0f} ms</h2>
+<p style="color:#6b7280">trace {data['trace_id']} · {data['span_count']} spans · status {data['status']}
+· <a href="/api/traces/{data['trace_id']}?format=otlp">OTLP JSON</a></p>
+<table><tr><th align="left">span</th><th align="right">ms</th><th></th></tr>{''.join(rows)}</table>
+</body></html>"""
+
+
+@app.route("/api/traces", methods=["GET"])
+def list_traces():
+    """Recent pipeline traces, newest first."""
+    return jsonify({"traces": _list_traces()})
+
+
+@app.route("/api/traces/<trace_id>", methods=["GET"])
+def get_trace(trace_id):
+    """One trace: ?format=json (default), waterfall (HTML) or otlp."""
+    data = _load_trace(trace_id)
+    if data is None:
+        return jsonify({"error": "Trace not found"}), 404
+    fmt = request.args.get("format", "json")
+    if fmt == "waterfall":
+        return trace_waterfall_html(data), 200, {"Content-Type": "text/html; charset=utf-8"}
+    if fmt == "otlp":
+        return jsonify(trace_to_otlp(data))
+    return jsonify(data)
+
+
+# ─── ON-DEMAND PROFILING ─────────────────────────────────────────────────────
+# Opt-in: disabled unless PROFILE_SECRET is set. POST /api/profile arms a
+# session for a target — a route rule ("/api/rank-jobs") or an agent trace
+# name ("agent.cron", or "agent" for any of them) — and the next `count`
+# matching requests/runs are captured with one of:
+#   cprofile     deterministic; results as pstats text or a binary pstats dump
+#   sample       wall-clock stack sampler (CPU, I/O and lock waits alike);
+#                results as collapsed stacks for flamegraph.pl / speedscope
+#   tracemalloc  allocation diff between start and end of each capture
+# Sessions live in the worker that armed them (gunicorn runs one by default).
+
+import sys
+import hmac
+
+PROFILE_SECRET = os.environ.get("PROFILE_SECRET", "")
+PROFILE_MODES = ("cprofile", "sample", "tracemalloc")
+PROFILE_MAX_SESSIONS = 20
+
+_profile_sessions = {}               # id -> _ProfileSession, insertion ordered
+_profile_lock = threading.Lock()
+_profiler_busy = threading.Lock()    # cProfile and tracemalloc are process-wide
+
+
+class _ProfileSession:
+    def __init__(self, target, mode, count, interval_ms, max_depth):
+        self.id = secrets.token_hex(6)
+        self.target = target
+        self.mode = mode
+        self.remaining = count
+        self.requested = count
+        self.interval = max(interval_ms, 1) / 1000
+        self.max_depth = max_depth
+        self.created = time.time()
+        self.captures = []           # [{"name", "wall_ms"}]
+        self.skipped = 0
+        self.stats = None            # pstats.Stats (cprofile)
+        self.stacks = {}             # collapsed stack -> samples (sample)
+        self.alloc = {}              # "file:line" -> [size_diff, count_diff] (tracemalloc)
+        self.peak_kb = 0
+        self._lock = threading.Lock()
+
+    def matches(self, name):
+        return self.remaining > 0 and (self.target == name or
+                                       (self.target == "agent" and name.startswith("agent.")))
+
+    def claim(self):
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+    def summary(self):
+        return {"id": self.id, "target": self.target, "mode": self.mode,
+                "requested": self.requested, "remaining": self.remaining,
+                "captures": self.captures, "skipped_busy": self.skipped,
+                "created": datetime.datetime.fromtimestamp(self.created).isoformat(timespec="seconds")}
+
+
+class _ProfileCapture:
+    """One profiled request or pipeline run; start() and stop() on the same thread."""
+
+    def __init__(self, session, name):
+        self.session = session
+        self.name = name
+        self.thread_id = threading.get_ident()
+        self._stop = threading.Event()
+
+    def start(self):
+        s = self.session
+        if s.mode in ("cprofile", "tracemalloc") and not _profiler_busy.acquire(blocking=False):
+            with s._lock:
+                s.skipped += 1
+                s.remaining += 1     # give the slot back; the next match gets it
+            return False
+        self.t0 = time.perf_counter()
+        if s.mode == "cprofile":
+            import cProfile
+            self.prof = cProfile.Profile()
+            self.prof.enable()
+        elif s.mode == "tracemalloc":
+            import tracemalloc
+            tracemalloc.start(25)
+            self.before = tracemalloc.take_snapshot()
+        else:
+            self.sampler = threading.Thread(target=self._sample, daemon=True)
+            self.sampler.start()
+        return True
+
+    def _sample(self):
+        s = self.session
+        local = {}
+        while not self._stop.wait(s.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None and len(names) < s.max_depth:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if names:
+                key = ";".join(reversed(names))
+                local[key] = local.get(key, 0) + 1
+        with s._lock:
+            for key, n in local.items():
+                s.stacks[key] = s.stacks.get(key, 0) + n
+
+    def stop(self):
+        s = self.session
+        wall_ms = round((time.perf_counter() - self.t0) * 1000, 1)
+        if s.mode == "cprofile":
+            import pstats
+            self.prof.disable()
+            _profiler_busy.release()
+            with s._lock:
+                if s.stats is None:
+                    s.stats = pstats.Stats(self.prof)
+                else:
+                    s.stats.add(self.prof)
+        elif s.mode == "tracemalloc":
+            import tracemalloc
+            after = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            _profiler_busy.release()
+            with s._lock:
+                s.peak_kb = max(s.peak_kb, round(peak / 1024, 1))
+                for st in after.compare_to(self.before, "lineno")[:200]:
+                    frame = st.traceback[0]
+                    key = f"{frame.filename}:{frame.lineno}"
+                    cur = s.alloc.setdefault(key, [0, 0])
+                    cur[0] += st.size_diff
+                    cur[1] += st.count_diff
+        else:
+            self._stop.set()
+            self.sampler.join()
+        with s._lock:
+            s.captures.append({"name": self.name, "wall_ms": wall_ms})
+        print(f"[Profile] {s.id} captured {self.name} ({s.mode}, {wall_ms:.0f}ms)")
+
+
+def _profile_capture_for(name):
+    """Started capture for `name` if an armed session wants it, else None."""
+    if not _profile_sessions:
+        return None
+    with _profile_lock:
+        session = next((s for s in _profile_sessions.values() if s.matches(name)), None)
+    if session is None or not session.claim():
+        return None
+    cap = _ProfileCapture(session, name)
+    return cap if cap.start() else None
+
+
+@contextlib.contextmanager
+def profiled(name):
+    cap = _profile_capture_for(name)
+    try:
+        yield cap
+    finally:
+        if cap is not None:
+            cap.stop()
+
+
+@app.before_request
+def _profile_start_request():
+    if _profile_sessions and request.url_rule is not None:
+        from flask import g
+        g._profile_capture = _profile_capture_for(request.url_rule.rule)
+
+
+@app.teardown_request
+def _profile_stop_request(exc=None):
+    from flask import g
+    cap = g.pop("_profile_capture", None)
+    if cap is not None:
+        cap.stop()
+
+
+def _profile_authorized():
+    supplied = (request.headers.get("X-Profile-Secret") or request.args.get("secret")
+                or (request.get_json(silent=True) or {}).get("secret") or "")
+    return bool(PROFILE_SECRET) and hmac.compare_digest(str(supplied), PROFILE_SECRET)
+
+
+@app.route("/api/profile", methods=["GET", "POST"])
+def profile_sessions():
+    """POST {target, mode, count, interval_ms} arms a session; GET lists them."""
+    if not _profile_authorized():
+        return jsonify({"error": "Not found"}), 404
+    if request.method == "GET":
+        with _profile_lock:
+            return jsonify({"sessions": [s.summary() for s in _profile_sessions.values()]})
+    data = request.get_json(silent=True) or {}
+    target = (data.get("target") or "").strip()
+    mode = data.get("mode", "sample")
+    if not target or mode not in PROFILE_MODES:
+        return jsonify({"error": f"target required; mode must be one of {', '.join(PROFILE_MODES)}"}), 400
+    session = _ProfileSession(target, mode, count=max(1, min(int(data.get("count", 1)), 100)),
+                              interval_ms=float(data.get("interval_ms", 5)),
+                              max_depth=int(data.get("max_depth", 64)))
+    with _profile_lock:
+        _profile_sessions[session.id] = session
+        while len(_profile_sessions) > PROFILE_MAX_SESSIONS:
+            _profile_sessions.pop(next(iter(_profile_sessions)))
+    print(f"[Profile] armed {session.id}: {mode} x{session.requested} on {target}")
+    return jsonify(session.summary())
+
+
+@app.route("/api/profile/<session_id>", methods=["GET", "DELETE"])
+def profile_result(session_id):
+    """Results: ?format=text|pstats (cprofile), collapsed (sample), json (any)."""
+    if not _profile_authorized():
+        return jsonify({"error": "Not found"}), 404
+    with _profile_lock:
+        session = (_profile_sessions.pop(session_id, None) if request.method == "DELETE"
+                   else _profile_sessions.get(session_id))
+    if session is None:
+        return jsonify({"error": "Profile session not found"}), 404
+    if request.method == "DELETE":
+        return jsonify({"deleted": session_id})
+
+    fmt = request.args.get("format") or {"cprofile": "text", "sample": "collapsed"}.get(session.mode, "json")
+    with session._lock:
+        if fmt == "pstats" and session.stats is not None:
+            import marshal
+            return marshal.dumps(session.stats.stats), 200, {
+                "Content-Type": "application/octet-stream",
+                "Content-Disposition": f"attachment; filename=profile_{session.id}.pstats"}
+        if fmt == "text" and session.stats is not None:
+            import io
+            buf = io.StringIO()
+            session.stats.stream = buf
+            session.stats.sort_stats(request.args.get("sort", "cumulative")).print_stats(
+                int(request.args.get("limit", 60)))
+            return buf.getvalue(), 200, {"Content-Type": "text/plain; charset=utf-8"}
+        if fmt == "collapsed":
+            lines = [f"{k} {v}" for k, v in sorted(session.stacks.items(), key=lambda kv: -kv[1])]
+            return "\n".join(lines) + "\n", 200, {"Content-Type": "text/plain; charset=utf-8"}
+        out = session.summary()
+        if session.mode == "tracemalloc":
+            top = sorted(session.alloc.items(), key=lambda kv: -abs(kv[1][0]))[:int(request.args.get("limit", 30))]
+            out["peak_kb"] = session.peak_kb
+            out["top_allocations"] = [{"where": k, "size_diff_kb": round(v[0] / 1024, 1), "count_diff": v[1]}
+                                      for k, v in top]
+        elif session.mode == "sample":
+            out["samples"] = sum(session.stacks.values())
+        return jsonify(out)
+
+
+# ─── LOCAL SQLITE STORE ──────────────────────────────────────────────────────
+# One small SQLite file (LOCAL_DB_PATH) for state every gunicorn worker on the
+# box must share but that doesn't belong in Supabase. Features register their
+# tables with _local_db_schema(); _local_db() hands each thread its own
+# autocommit connection in WAL mode with every registered schema applied.
+
+import sqlite3
+
+LOCAL_DB_PATH = os.environ.get("LOCAL_DB_PATH") or os.path.join(BASE_DIR, "jobhunt_local.db")
+
+_local_db_ddl = []
+_local_db_tls = threading.local()
+
+
+def _local_db_schema(ddl):
+    _local_db_ddl.append(ddl)
+
+
+def _local_db():
+    tls = _local_db_tls
+    if getattr(tls, "pid", None) != os.getpid():     # new thread, or forked worker
+        conn = sqlite3.connect(LOCAL_DB_PATH, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        tls.conn, tls.pid, tls.applied = conn, os.getpid(), 0
+    if tls.applied < len(_local_db_ddl):
+        for ddl in _local_db_ddl[tls.applied:]:
+            tls.conn.executescript(ddl)
+        tls.applied = len(_local_db_ddl)
+    return tls.conn
+
+
+# ─── UPSTREAM CIRCUIT BREAKERS ───────────────────────────────────────────────
+# One breaker per upstream (Groq per model, Supabase, Apify, Firecrawl, MCF,
+# LinkedIn). LinkedIn has two: linkedin_guest for anonymous job-page and
+# search scraping, which routinely draws 999/429, and linkedin_voyager for
+# the cookie-authenticated API, so a throttled discovery run doesn't cut off
+# saved-jobs sync, fetch-jd or the JD backfill. After
+# CIRCUIT_FAILURE_THRESHOLD consecutive failures — or a single 429 that tells
+# us when to come back — the breaker opens and calls fail immediately with
+# UpstreamUnavailable instead of waiting out timeouts.
+# Once the cooldown (or the upstream's Retry-After) has passed, one probe
+# request is let through; success closes the breaker, failure re-opens it
+# with a doubled cooldown.
+
+import re
+from email.utils import parsedate_to_datetime
+
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "3"))
+CIRCUIT_COOLDOWN = float(os.environ.get("CIRCUIT_COOLDOWN", "15"))
+CIRCUIT_MAX_COOLDOWN = float(os.environ.get("CIRCUIT_MAX_COOLDOWN", "300"))
+_CIRCUIT_FAILURE_STATUSES = {429, 500, 502, 503, 504, 999}   # 999 = LinkedIn "go away"
+
+
+class UpstreamUnavailable(Exception):
+    """Raised instead of calling an upstream whose breaker is open."""
+    def __init__(self, upstream, retry_in):
+        self.upstream = upstream
+        self.retry_in = max(0, int(retry_in))
+        super().__init__(f"{upstream} unavailable (circuit open, retry in {self.retry_in}s)")
+
+
+class _CircuitBreaker:
+    def __init__(self, name):
+        self.name = name
+        self.state = "closed"            # closed | open | half_open
+        self.failures = 0                # consecutive failures while closed
+        self.trips = 0                   # consecutive opens, drives the backoff
+        self.open_until = 0.0
+        self.last_error = None
+        self.total_failures = 0
+        self.rejected = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def retry_in(self):
+        return max(0.0, self.open_until - time.time())
+
+    def available(self):
+        """Peek without claiming the half-open probe slot."""
+        with self._lock:
+            return self.state == "closed" or (time.time() >= self.open_until and not self._probing)
+
+    def before_call(self):
+        with self._lock:
+            if self.state == "closed":
+                return
+            if time.time() >= self.open_until and not self._probing:
+                self.state = "half_open"
+                self._probing = True
+                print(f"[Circuit] {self.name} half-open — probing")
+                return
+            self.rejected += 1
+            raise UpstreamUnavailable(self.name, self.retry_in())
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                print(f"[Circuit] {self.name} closed")
+            self.state, self.failures, self.trips, self._probing = "closed", 0, 0, False
+
+    def release_probe(self):
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self, error, retry_after=None):
+        with self._lock:
+            self.failures += 1
+            self.total_failures += 1
+            self.last_error = str(error)[:200]
+            if self.state == "closed" and self.failures < CIRCUIT_FAILURE_THRESHOLD and retry_after is None:
+                return
+            cooldown = min(CIRCUIT_MAX_COOLDOWN, CIRCUIT_COOLDOWN * (2 ** self.trips))
+            if retry_after is not None:
+                cooldown = min(CIRCUIT_MAX_COOLDOWN, max(retry_after, 1.0))
+            self.trips += 1
+            self.state, self.failures, self._probing = "open", 0, False
+            self.open_until = time.time() + cooldown
+            print(f"[Circuit] {self.name} open for {cooldown:.0f}s ({self.last_error})")
+
+    def snapshot(self):
+        with self._lock:
+            state = self.state
+            if state == "open" and time.time() >= self.open_until:
+                state = "half_open"
+            return {"state": state, "retry_in": round(self.retry_in(), 1),
+                    "consecutive_failures": self.failures, "trips": self.trips,
+                    "total_failures": self.total_failures, "rejected": self.rejected,
+                    "last_error": self.last_error}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def _breaker(upstream):
+    with _breakers_lock:
+        if upstream not in _breakers:
+            _breakers[upstream] = _CircuitBreaker(upstream)
+        return _breakers[upstream]
+
+
+def circuit_states():
+    """Breaker state per upstream (for /api/health)."""
+    with _breakers_lock:
+        names = sorted(_breakers)
+    return {n: _breaker(n).snapshot() for n in names}
+
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+def _parse_duration(value):
+    """Seconds from '12', '7.66s', '2m59.56s', '1h2m' or '250ms'."""
+    value = (value or "").strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(n) * scale[u] for n, u in parts)
+
+
+def _retry_after_seconds(resp):
+    """How long the upstream asked us to back off, from Retry-After or the
+    x-ratelimit-reset family (Groq sends durations, others epoch seconds)."""
+    h = resp.headers or {}
+    ra = h.get("Retry-After")
+    if ra:
+        secs = _parse_duration(ra)
+        if secs is None:
+            try:
+                secs = parsedate_to_datetime(ra).timestamp() - time.time()
+            except (TypeError, ValueError):
+                secs = None
+        if secs is not None:
+            return max(0.0, secs)
+    resets = []
+    for name in ("x-ratelimit-reset", "x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+        secs = _parse_duration(h.get(name, ""))
+        if secs is None:
+            continue
+        if secs > 1e9:                   # absolute epoch timestamp
+            secs -= time.time()
+        resets.append(max(0.0, secs))
+    if not resets:
+        return None
+    # Only the limit that was actually hit matters; the smallest non-zero
+    # reset is the earliest moment a retry can succeed.
+    nonzero = [r for r in resets if r > 0]
+    return min(nonzero) if nonzero else 0.0
+
+
+def _upstream_request(upstream, method, url, **kwargs):
+    """http_requests.request() guarded by the upstream's circuit breaker.
+    Raises UpstreamUnavailable while the breaker is open; otherwise returns
+    the response as-is (callers keep their own status handling). Pass
+    session= to reuse a requests.Session's connection pool."""
+    with span(f"{method.upper()} {upstream}", kind="client", upstream=upstream,
+              url=url.split("?")[0]) as sp:
+        br = _breaker(upstream)
+        try:
+            br.before_call()
+        except UpstreamUnavailable:
+            metrics.inc("jobhunt_upstream_rejected_total", {"upstream": upstream})
+            raise
+        t0 = time.perf_counter()
+        client = kwargs.pop("session", None) or http_requests
+        try:
+            resp = client.request(method, url, **kwargs)
+        except (http_requests.ConnectionError, http_requests.Timeout) as e:
+            br.record_failure(f"{type(e).__name__}: {e}")
+            metrics.observe("jobhunt_upstream_request_duration_seconds", time.perf_counter() - t0,
+                            {"upstream": upstream, "status": type(e).__name__})
+            raise
+        except Exception:
+            br.release_probe()              # our bug, not the upstream's
+            raise
+        metrics.observe("jobhunt_upstream_request_duration_seconds", time.perf_counter() - t0,
+                        {"upstream": upstream, "status": resp.status_code})
+        sp.set(status_code=resp.status_code)
+        if resp.status_code in _CIRCUIT_FAILURE_STATUSES:
+            retry_after = _retry_after_seconds(resp) if resp.status_code == 429 else None
+            br.record_failure(f"HTTP {resp.status_code}", retry_after)
+            sp.fail(f"HTTP {resp.status_code}")
+        else:
+            br.record_success()
+        return resp
+
+
 # ---------------------------------------------------------------------------
 #  Lightweight Supabase REST wrapper (replaces supabase-py SDK)
 #  Uses PostgREST endpoints directly so any API key format works.
@@ -86,10 +1132,19 @@ class _QueryBuilder:
         self._params[column] = f"gt.{value}"
         return self
 
+    def gte(self, column, value):
+        self._params[column] = f"gte.{value}"
+        return self
+
     def lt(self, column, value):
         self._params[column] = f"lt.{value}"
         return self
 
+    def in_(self, column, values):
+        quoted = ",".join('"' + str(v).replace("\\", "\\\\").replace('"', '\\"') + '"' for v in values)
+        self._params[column] = f"in.({quoted})"
+        return self
+
     # --- modifiers ---
     def order(self, column, desc=True):
         direction = "desc" if desc else "asc"
@@ -101,9 +1156,10 @@ class _QueryBuilder:
         return self
 
     # --- mutations ---
-    def upsert(self, data, on_conflict=None):
+    def upsert(self, data, on_conflict=None, ignore_duplicates=False):
         self._method = "POST"
-        self._headers["Prefer"] = "resolution=merge-duplicates,return=representation"
+        resolution = "ignore-duplicates" if ignore_duplicates else "merge-duplicates"
+        self._headers["Prefer"] = f"resolution={resolution},return=representation"
         if on_conflict:
             self._params["on_conflict"] = on_conflict
         self._body = data
@@ -139,7 +1195,8 @@ class _QueryBuilder:
         if self._body is not None:
             headers["Content-Type"] = "application/json"
 
-        resp = http_requests.request(
+        resp = _upstream_request(
+            "supabase",
             method=self._method,
             url=self._url,
             headers=headers,
@@ -202,56 +1259,657 @@ def get_supabase():
         return None
 
 
-def call_claude(prompt, max_tokens=4096, model=None):
-    """Call GROQ API (OpenAI-compatible). Tries llama-3.3-70b-versatile first,
-    falls back to llama-3.1-8b-instant if unavailable."""
+# ─── TOKEN BUDGET ────────────────────────────────────────────────────────────
+# Prompts are measured locally before they are sent so call_claude can pick a
+# max_tokens that fits the model's context window and the remaining
+# tokens-per-minute budget (Groq counts the requested max_tokens against TPM,
+# so over-asking burns rate limit for nothing). JDs are trimmed by dropping
+# boilerplate sections rather than slicing at an arbitrary character count.
+
+import re
+import hashlib
+import threading
+from collections import deque
+
+GROQ_MODEL_LIMITS = {
+    "llama-3.3-70b-versatile": {"context": 131072, "max_output": 32768, "tpm": 12000},
+    "llama-3.1-8b-instant":    {"context": 131072, "max_output": 8192,  "tpm": 6000},
+}
+_DEFAULT_MODEL_LIMITS = {"context": 8192, "max_output": 4096, "tpm": 6000}
+MIN_COMPLETION_TOKENS = 256
+GROQ_TPM_MAX_WAIT = float(os.environ.get("GROQ_TPM_MAX_WAIT", "20"))
+
+_TOKEN_RE = re.compile(r"'(?:s|t|re|ve|m|ll|d)\b| ?[^\W\d_]+| ?\d{1,3}| ?[^\w\s]+|\s+", re.UNICODE)
+_tiktoken_enc = None
+_tpm_window = {}                 # model -> deque([ts, tokens])
+_route_token_stats = {}          # route -> usage counters (estimated vs actual)
+_route_latencies = {}            # route -> deque of recent latencies (ms)
+_tok_lock = threading.Lock()
+
+
+def _model_limits(model):
+    """Context / output / TPM limits for a model; GROQ_TPM_<MODEL> etc. override."""
+    limits = dict(GROQ_MODEL_LIMITS.get(model, _DEFAULT_MODEL_LIMITS))
+    slug = re.sub(r"[^A-Z0-9]+", "_", model.upper()).strip("_")
+    for key in ("context", "max_output", "tpm"):
+        env = os.environ.get(f"GROQ_{key.upper()}_{slug}")
+        if env:
+            limits[key] = int(env)
+    return limits
+
+
+def _estimate_tokens(text):
+    """
+    Local prompt token count. Uses tiktoken (cl100k, close to the Llama 3
+    vocabulary) when installed, otherwise a regex pre-tokenizer that mimics
+    BPE splitting: words ≈ 1 token per 4 letters, digits in groups of 3,
+    punctuation runs ≈ 1 token per 2 chars, spaces folded into the next word.
+    """
+    global _tiktoken_enc
+    if not text:
+        return 0
+    if _tiktoken_enc is None:
+        try:
+            import tiktoken
+            _tiktoken_enc = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _tiktoken_enc = False
+    if _tiktoken_enc:
+        return len(_tiktoken_enc.encode(text, disallowed_special=()))
+    n = 0
+    for piece in _TOKEN_RE.findall(text):
+        p = piece.lstrip(" ")
+        if not p:
+            n += 1 if "\n" in piece else 0
+        elif p[0].isalpha():
+            n += -(-len(p) // 4) if p.isascii() else len(p.encode("utf-8")) // 2 or 1
+        elif p[0].isdigit():
+            n += 1
+        elif p[0].isspace():
+            n += 1
+        else:
+            n += -(-len(p.encode("utf-8")) // 2)
+    return n
+
+
+def _tpm_used(model, now=None):
+    now = now or time.time()
+    q = _tpm_window.get(model)
+    if not q:
+        return 0
+    while q and now - q[0][0] > 60:
+        q.popleft()
+    return sum(e[1] for e in q)
+
+
+def _plan_max_tokens(model, prompt_tokens, requested):
+    """Largest max_tokens (≤ requested) that fits context and the TPM budget for `model`."""
+    lim = _model_limits(model)
+    with _tok_lock:
+        tpm_room = lim["tpm"] - _tpm_used(model) - prompt_tokens
+    ctx_room = lim["context"] - prompt_tokens - 64
+    return min(requested, lim["max_output"], ctx_room, tpm_room)
+
+
+def _wait_for_tpm(model, prompt_tokens, need):
+    """Block (up to GROQ_TPM_MAX_WAIT s) until the 60 s window has room for prompt + need."""
+    deadline = time.time() + GROQ_TPM_MAX_WAIT
+    while time.time() < deadline:
+        if _plan_max_tokens(model, prompt_tokens, need) >= need:
+            return True
+        time.sleep(1)
+    return False
+
+
+def _tpm_reserve(model, tokens):
+    entry = [time.time(), tokens]
+    with _tok_lock:
+        _tpm_window.setdefault(model, deque()).append(entry)
+    return entry
+
+
+def _route_stats_entry(route):
+    return _route_token_stats.setdefault(route, {
+        "calls": 0, "est_prompt_tokens": 0, "prompt_tokens": 0, "completion_tokens": 0,
+        "max_tokens_requested": 0, "truncated": 0, "models": {},
+        "fallbacks": 0, "failures": 0, "latency_ms_total": 0,
+    })
+
+
+def _record_route_usage(route, model, est_prompt, max_tokens, usage, finish, latency_ms=0, fallback=False,
+                        job_id=None):
+    sp = current_span()
+    if sp is not None:
+        sp.set(model=model, finish=finish, fallback=fallback,
+               prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens"))
+    metrics.inc("jobhunt_llm_requests_total", {"route": route, "model": model, "finish": finish})
+    for kind in ("prompt", "completion"):
+        if usage.get(f"{kind}_tokens"):
+            metrics.inc("jobhunt_llm_tokens_total", {"route": route, "model": model, "kind": kind},
+                        usage[f"{kind}_tokens"])
+    with _tok_lock:
+        st = _route_stats_entry(route)
+        st["calls"] += 1
+        st["fallbacks"] += 1 if fallback else 0
+        st["latency_ms_total"] += latency_ms
+        _route_latencies.setdefault(route, deque(maxlen=200)).append(latency_ms)
+        st["est_prompt_tokens"] += est_prompt
+        st["prompt_tokens"] += usage.get("prompt_tokens", 0) or 0
+        st["completion_tokens"] += usage.get("completion_tokens", 0) or 0
+        st["max_tokens_requested"] += max_tokens
+        st["truncated"] += 1 if finish == "length" else 0
+        st["models"][model] = st["models"].get(model, 0) + 1
+    _ledger_record(route, model, job_id, usage, latency_ms, finish=finish)
+
+
+def _record_route_failure(route, job_id=None):
+    with _tok_lock:
+        _route_stats_entry(route)["failures"] += 1
+    _ledger_record(route, None, job_id, finish="error")
+
+
+# ── LLM usage ledger ──
+# One row per LLM call in the local SQLite store (kept LLM_LEDGER_DAYS days),
+# aggregated by /api/llm/usage. cache is "miss" for a real Groq call and
+# "coalesced" when single-flight answered from an identical in-flight call.
+
+LLM_LEDGER_DAYS = int(os.environ.get("LLM_LEDGER_DAYS", "90"))
+
+_local_db_schema("""
+CREATE TABLE IF NOT EXISTS llm_ledger (
+    ts                REAL    NOT NULL,
+    day               TEXT    NOT NULL,
+    route             TEXT    NOT NULL,
+    job_id            TEXT,
+    model             TEXT,
+    prompt_tokens     INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    latency_ms        INTEGER NOT NULL DEFAULT 0,
+    cache             TEXT    NOT NULL DEFAULT 'miss',
+    finish            TEXT
+);
+CREATE INDEX IF NOT EXISTS llm_ledger_day ON llm_ledger (day);
+""")
+
+_ledger_pruned_day = None
+
+
+def _current_llm_job():
+    """Job id for the ledger: the innermost traced job span, else the request's jobId."""
+    for sp in reversed(_span_stack()):
+        if sp.attrs.get("job_id"):
+            return str(sp.attrs["job_id"])
+    from flask import has_request_context
+    if has_request_context():
+        data = request.get_json(silent=True)
+        if isinstance(data, dict) and data.get("jobId"):
+            return str(data["jobId"])
+    return None
+
+
+def _ledger_record(route, model, job_id, usage=None, latency_ms=0, cache="miss", finish=None):
+    global _ledger_pruned_day
+    usage = usage or {}
+    now = time.time()
+    day = time.strftime("%Y-%m-%d", time.gmtime(now))
+    try:
+        db = _local_db()
+        db.execute("INSERT INTO llm_ledger (ts, day, route, job_id, model, prompt_tokens, completion_tokens,"
+                   " latency_ms, cache, finish) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                   (now, day, route, job_id, model, usage.get("prompt_tokens") or 0,
+                    usage.get("completion_tokens") or 0, int(latency_ms), cache, finish))
+        if _ledger_pruned_day != day:
+            _ledger_pruned_day = day
+            db.execute("DELETE FROM llm_ledger WHERE ts < ?", (now - LLM_LEDGER_DAYS * 86400,))
+    except sqlite3.Error as e:
+        print(f"[Ledger] write failed: {e}")
+
+
+_LEDGER_GROUPS = ("day", "route", "model", "job_id", "cache", "finish")
+
+
+def llm_usage_report(days=7, group_by=("day", "route", "model")):
+    """Ledger rows for the last `days` days aggregated over `group_by` columns."""
+    group_by = [g for g in group_by if g in _LEDGER_GROUPS] or ["route"]
+    cols = ", ".join(group_by)
+    since = time.time() - days * 86400
+    rows = _local_db().execute(f"""
+        SELECT {cols},
+               COUNT(*)                                     AS calls,
+               SUM(finish = 'error')                        AS errors,
+               SUM(cache = 'coalesced')                     AS coalesced,
+               SUM(finish = 'length')                       AS truncated,
+               SUM(prompt_tokens)                           AS prompt_tokens,
+               SUM(completion_tokens)                       AS completion_tokens,
+               SUM(prompt_tokens + completion_tokens)       AS total_tokens,
+               COUNT(DISTINCT job_id)                       AS jobs,
+               ROUND(AVG(CASE WHEN cache = 'miss' AND finish != 'error' THEN latency_ms END)) AS avg_latency_ms,
+               MAX(latency_ms)                              AS max_latency_ms
+        FROM llm_ledger WHERE ts >= ?
+        GROUP BY {cols} ORDER BY {cols}""", (since,)).fetchall()
+    out = [dict(r) for r in rows]
+    grand = sum(r["total_tokens"] or 0 for r in out) or 1
+    for r in out:
+        r["token_share"] = round((r["total_tokens"] or 0) / grand, 4)
+        real = r["calls"] - r["coalesced"] - r["errors"]
+        r["tokens_per_call"] = round((r["total_tokens"] or 0) / real) if real > 0 else 0
+    return {"days": days, "group_by": group_by, "total_tokens": grand if out else 0, "rows": out}
+
+
+def route_token_stats():
+    """Per-route token usage (estimated vs actual), latency and fallback rate (for /api/llm/stats)."""
+    out = {}
+    with _tok_lock:
+        for route, st in _route_token_stats.items():
+            calls = st["calls"] or 1
+            lat = sorted(_route_latencies.get(route) or [0])
+            out[route] = dict(st, models=dict(st["models"]),
+                              avg_prompt_tokens=round(st["prompt_tokens"] / calls),
+                              avg_completion_tokens=round(st["completion_tokens"] / calls),
+                              estimate_ratio=round(st["est_prompt_tokens"] / st["prompt_tokens"], 3) if st["prompt_tokens"] else None,
+                              fallback_rate=round(st["fallbacks"] / calls, 3),
+                              latency_ms_p50=lat[len(lat) // 2],
+                              latency_ms_p95=lat[min(len(lat) - 1, int(len(lat) * 0.95))],
+                              chain=_route_config(route)["models"])
+    return out
+
+
+_JD_LOW_VALUE = re.compile(
+    r"(equal (employment )?opportunit|\beeo\b|diversity|inclusion|accommodation|"
+    r"benefits|perks|what we offer|we offer|why (join|work)|our offer|life at|"
+    r"about us|about the company|who we are|our (story|company|mission)|company overview|"
+    r"how to apply|application process|to apply|privacy|data protection|personal data)", re.I)
+_JD_HIGH_VALUE = re.compile(
+    r"(responsibilit|requirement|qualification|what you('ll| will)|you will|your role|the role|"
+    r"about the (role|job|position)|skills|experience|must have|nice to have|preferred|key duties|what we('re| are) looking)", re.I)
+_JD_BOILERPLATE_SENTENCE = re.compile(
+    r"(equal opportunity employer|without regard to|race, colou?r|sexual orientation|gender identity|"
+    r"protected veteran|reasonable accommodation|personal data|privacy (notice|policy)|"
+    r"only shortlisted candidates|we regret that only|ea licen[cs]e|registration no\.?)", re.I)
+
+
+def _is_jd_header(line):
+    s = line.strip().strip("*#•-: ").strip()
+    if not s or len(s) > 60 or s.endswith("."):
+        return False
+    return line.strip().endswith(":") or s.isupper() or len(s.split()) <= 6 and bool(
+        _JD_LOW_VALUE.search(s) or _JD_HIGH_VALUE.search(s))
+
+
+def _trim_jd(jd, max_tokens):
+    """
+    Fit a JD into `max_tokens`: drop low-value sections (EEO, benefits,
+    about-us, how-to-apply) and boilerplate sentences first, then cut at a
+    sentence boundary if it is still too long.
+    """
+    if not jd:
+        return ""
+    kept, skipping = [], False
+    for line in jd.splitlines():
+        if _is_jd_header(line):
+            skipping = bool(_JD_LOW_VALUE.search(line)) and not _JD_HIGH_VALUE.search(line)
+            if skipping:
+                continue
+        if skipping:
+            continue
+        if _JD_BOILERPLATE_SENTENCE.search(line):
+            sentences = re.split(r"(?<=[.!?])\s+", line)
+            line = " ".join(x for x in sentences if not _JD_BOILERPLATE_SENTENCE.search(x))
+            if not line.strip():
+                continue
+        kept.append(line.rstrip())
+    text = re.sub(r"\n{3,}", "\n\n", "\n".join(kept)).strip()
+
+    total = _estimate_tokens(text)
+    if total <= max_tokens:
+        return text
+    # Too long — cut near the proportional position, then back off to a sentence end
+    cut = int(len(text) * max_tokens / total)
+    while cut > 0:
+        head = text[:cut]
+        m = max(head.rfind(". "), head.rfind(".\n"), head.rfind("\n"), head.rfind("! "), head.rfind("? "))
+        head = head[:m + 1] if m > len(head) // 2 else head
+        if _estimate_tokens(head) <= max_tokens:
+            return head.rstrip()
+        cut = int(cut * 0.9)
+    return ""
+
+
+# ─── REQUEST COALESCING (single-flight) ──────────────────────────────────────
+# Identical upstream calls that overlap in time (UI double-submits, an agent
+# run racing a manual run) share one in-flight call: the first caller does the
+# work, later callers with the same key wait and receive the same result.
+
+class _SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}          # key -> {"event", "result", "error", "waiters"}
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = {"event": threading.Event(), "result": None, "error": None, "waiters": 0}
+                self._calls[key] = call
+                leader = True
+                self.executed += 1
+            else:
+                call["waiters"] += 1
+                leader = False
+                self.coalesced += 1
+        metrics.inc("jobhunt_cache_requests_total",
+                    {"cache": f"singleflight_{self.name}", "result": "miss" if leader else "hit"})
+        if not leader:
+            call["event"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+        try:
+            call["result"] = fn()
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call["event"].set()
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._calls)
+        return {"executed": self.executed, "coalesced": self.coalesced, "in_flight": in_flight}
+
+
+_llm_flight   = _SingleFlight("llm")
+_intel_flight = _SingleFlight("company_intel")
+_jd_flight    = _SingleFlight("fetch_jd")
+
+
+# ─── MODEL ROUTING ───────────────────────────────────────────────────────────
+# Each call site names a route; the route picks the model chain, default
+# max_tokens and timeout. Cheap structured tasks (scoring, extraction, short
+# emails) go to the fast 8B model first so 70B quota is left for resumes,
+# cover letters and interview turns. Override a chain with
+# LLM_ROUTE_<ROUTE>_MODELS="model-a,model-b".
+
+GROQ_70B = "llama-3.3-70b-versatile"
+GROQ_8B  = "llama-3.1-8b-instant"
+
+LLM_ROUTES = {
+    "resume":            {"models": [GROQ_70B, GROQ_8B], "max_tokens": 8192, "timeout": 120},
+    "cover":             {"models": [GROQ_70B, GROQ_8B], "max_tokens": 1024, "timeout": 60},
+    "interview_turn":    {"models": [GROQ_70B, GROQ_8B], "max_tokens": 1024, "timeout": 45},
+    "interview_prep":    {"models": [GROQ_70B, GROQ_8B], "max_tokens": 4096, "timeout": 90},
+    "interview_summary": {"models": [GROQ_70B, GROQ_8B], "max_tokens": 2048, "timeout": 90},
+    "interview_compact": {"models": [GROQ_8B, GROQ_70B], "max_tokens": 512,  "timeout": 30},
+    "intel":             {"models": [GROQ_8B, GROQ_70B], "max_tokens": 1536, "timeout": 45},
+    "score":             {"models": [GROQ_8B, GROQ_70B], "max_tokens": 256,  "timeout": 30},
+    "batch_score":       {"models": [GROQ_8B, GROQ_70B], "max_tokens": 2048, "timeout": 60},
+    "parse_resume":      {"models": [GROQ_8B, GROQ_70B], "max_tokens": 2048, "timeout": 60},
+    "followup":          {"models": [GROQ_8B, GROQ_70B], "max_tokens": 512,  "timeout": 30},
+    "speed_kit":         {"models": [GROQ_8B, GROQ_70B], "max_tokens": 512,  "timeout": 30},
+    "generic":           {"models": [GROQ_70B, GROQ_8B], "max_tokens": 4096, "timeout": 120},
+    "default":           {"models": [GROQ_70B, GROQ_8B], "max_tokens": 4096, "timeout": 120},
+}
+
+
+def _route_config(route):
+    cfg = dict(LLM_ROUTES.get(route) or LLM_ROUTES["default"])
+    env = os.environ.get(f"LLM_ROUTE_{route.upper()}_MODELS", "")
+    if env.strip():
+        cfg["models"] = [m.strip() for m in env.split(",") if m.strip()]
+    return cfg
+
+
+def _completion_budget(m, is_last, prompt_tokens, max_tokens):
+    """max_tokens to request from model `m`, or None to skip to the next model."""
+    # Smallest completion worth sending: a quarter of what the caller asked for
+    floor = min(max_tokens, max(MIN_COMPLETION_TOKENS, max_tokens // 4))
+    budget = _plan_max_tokens(m, prompt_tokens, max_tokens)
+    if budget >= floor:
+        return budget
+    if prompt_tokens + floor > _model_limits(m)["context"]:
+        print(f"[Groq] Prompt (~{prompt_tokens} tokens) exceeds {m} context, skipping")
+        return None
+    if not is_last:
+        print(f"[Groq] TPM budget low on {m} (~{budget} tokens free), trying next model...")
+        return None
+    # Last model — wait for the rolling TPM window rather than provoke a 429
+    _wait_for_tpm(m, prompt_tokens, floor)
+    return max(_plan_max_tokens(m, prompt_tokens, max_tokens), floor)
+
+
+def call_claude(prompt, max_tokens=None, model=None, route="default", stream=False, job_id=None):
+    """Call GROQ API (OpenAI-compatible). The model chain, default max_tokens
+    and timeout come from LLM_ROUTES[route]; later models are fallbacks.
+    max_tokens is an upper bound — it is shrunk to fit the model's context and
+    the remaining TPM budget. Usage is recorded per route for /api/llm/stats
+    and per call (with job_id, if known) in the usage ledger.
+    With stream=True returns a generator of text chunks instead (see
+    _call_claude_stream)."""
+    job_id = job_id or _current_llm_job()
+    if stream:
+        return _call_claude_stream(prompt, max_tokens, model, route, job_id)
     if not GROQ_API_KEY:
         return "Error: GROQ_API_KEY not set. Add it in Render → Environment Variables."
 
-    MODELS = [model] if model else ["llama-3.3-70b-versatile", "llama-3.1-8b-instant"]
+    key = hashlib.sha1(f"{route}|{model}|{max_tokens}|{prompt}".encode("utf-8")).hexdigest()
+    led = []
+    started = time.time()
 
-    for m in MODELS:
+    def lead():
+        led.append(True)
+        return _call_claude_once(prompt, max_tokens, model, route, job_id)
+
+    with span(f"llm {route}", route=route):
+        result = _llm_flight.do(key, lead)
+    if not led:
+        _ledger_record(route, None, job_id, latency_ms=(time.time() - started) * 1000,
+                       cache="coalesced", finish="coalesced")
+    return result
+
+
+def _groq_exhausted_message(models):
+    waits = [_breaker(f"groq:{m}").retry_in() for m in models if not _breaker(f"groq:{m}").available()]
+    if len(waits) == len(models):
+        return f"Error: Groq unavailable (circuit open, retry in {int(min(waits))}s)"
+    return "Error: All Groq models failed — check API key and quota"
+
+
+def _call_claude_once(prompt, max_tokens, model, route, job_id=None):
+    cfg = _route_config(route)
+    MODELS = [model] if model else cfg["models"]
+    max_tokens = max_tokens or cfg["max_tokens"]
+    prompt_tokens = _estimate_tokens(prompt)
+
+    for i, m in enumerate(MODELS):
+        if not _breaker(f"groq:{m}").available():
+            print(f"[Groq] circuit open for {m}, skipping")
+            continue
+        budget = _completion_budget(m, i == len(MODELS) - 1, prompt_tokens, max_tokens)
+        if budget is None:
+            continue
+        reservation = _tpm_reserve(m, prompt_tokens + budget)
+        started = time.time()
         try:
-            res = http_requests.post(
-                "https://api.groq.com/openai/v1/chat/completions",
+            res = _upstream_request(
+                f"groq:{m}", "POST",
+                f"{GROQ_API_BASE}/openai/v1/chat/completions",
                 headers={
                     "Authorization": f"Bearer {GROQ_API_KEY}",
                     "Content-Type": "application/json"
                 },
                 json={
                     "model": m,
-                    "max_tokens": max_tokens,
+                    "max_tokens": budget,
                     "temperature": 0.3,
                     "messages": [{"role": "user", "content": prompt}]
                 },
-                timeout=120
+                timeout=cfg["timeout"]
             )
-            print(f"[Groq] model={m} HTTP {res.status_code}, response length: {len(res.text)}")
+            print(f"[Groq] model={m} route={route} HTTP {res.status_code}, response length: {len(res.text)}")
             if res.status_code == 429:
+                reservation[1] = 0
                 print(f"[Groq] Rate limit on {m}, trying next model...")
                 continue
             if res.status_code != 200:
+                reservation[1] = 0
                 print(f"[Groq] HTTP {res.status_code} on {m}: {res.text[:300]}")
                 # Try next model on 4xx (model may be unavailable)
                 if res.status_code in (400, 404, 422):
                     continue
+                _record_route_failure(route, job_id)
                 return f"Error: Groq HTTP {res.status_code}: {res.text[:300]}"
             data = res.json()
             if "error" in data:
+                reservation[1] = 0
                 err_msg = data["error"].get("message", str(data["error"]))
                 print(f"[Groq] API error on {m}: {err_msg}")
                 continue  # try next model
             content = data["choices"][0]["message"]["content"]
             finish = data["choices"][0].get("finish_reason", "unknown")
-            print(f"[Groq] model={m} finish_reason={finish}, content length={len(content)}")
+            usage = data.get("usage") or {}
+            reservation[1] = usage.get("total_tokens") or reservation[1]
+            _record_route_usage(route, m, prompt_tokens, budget, usage, finish,
+                                latency_ms=int((time.time() - started) * 1000), fallback=i > 0, job_id=job_id)
+            print(f"[Groq] model={m} finish_reason={finish}, content length={len(content)}, "
+                  f"tokens est={prompt_tokens} prompt={usage.get('prompt_tokens')} completion={usage.get('completion_tokens')}/{budget}")
             if finish == "length":
-                print("[Groq] WARNING: response truncated — increase max_tokens or reduce prompt")
+                print(f"[Groq] WARNING: response truncated on route={route} (max_tokens={budget})")
             return content
         except Exception as e:
+            reservation[1] = 0
             print(f"[Groq] Exception on {m}: {e}")
             continue
 
-    return "Error: All Groq models failed — check API key and quota"
+    _record_route_failure(route, job_id)
+    return _groq_exhausted_message(MODELS)
+
+
+def _call_claude_stream(prompt, max_tokens=None, model=None, route="default", job_id=None):
+    """
+    Streaming variant of call_claude: yields content chunks as Groq produces
+    them (OpenAI-style SSE). Model fallback only happens before the first
+    chunk; errors are yielded as a single "Error: ..." chunk.
+    """
+    if not GROQ_API_KEY:
+        yield "Error: GROQ_API_KEY not set. Add it in Render → Environment Variables."
+        return
+
+    cfg = _route_config(route)
+    MODELS = [model] if model else cfg["models"]
+    max_tokens = max_tokens or cfg["max_tokens"]
+    prompt_tokens = _estimate_tokens(prompt)
+
+    for i, m in enumerate(MODELS):
+        if not _breaker(f"groq:{m}").available():
+            print(f"[Groq] circuit open for {m}, skipping")
+            continue
+        budget = _completion_budget(m, i == len(MODELS) - 1, prompt_tokens, max_tokens)
+        if budget is None:
+            continue
+        reservation = _tpm_reserve(m, prompt_tokens + budget)
+        started = time.time()
+        try:
+            res = _upstream_request(
+                f"groq:{m}", "POST",
+                f"{GROQ_API_BASE}/openai/v1/chat/completions",
+                headers={
+                    "Authorization": f"Bearer {GROQ_API_KEY}",
+                    "Content-Type": "application/json"
+                },
+                json={
+                    "model": m,
+                    "max_tokens": budget,
+                    "temperature": 0.3,
+                    "stream": True,
+                    "messages": [{"role": "user", "content": prompt}]
+                },
+                timeout=cfg["timeout"],
+                stream=True,
+            )
+            print(f"[Groq] stream model={m} route={route} HTTP {res.status_code}")
+            if res.status_code == 429:
+                res.close()
+                reservation[1] = 0
+                print(f"[Groq] Rate limit on {m}, trying next model...")
+                continue
+            if res.status_code != 200:
+                reservation[1] = 0
+                body = res.text[:300]
+                print(f"[Groq] HTTP {res.status_code} on {m}: {body}")
+                if res.status_code in (400, 404, 422):
+                    continue
+                _record_route_failure(route, job_id)
+                yield f"Error: Groq HTTP {res.status_code}: {body}"
+                return
+        except Exception as e:
+            reservation[1] = 0
+            print(f"[Groq] Exception on {m}: {e}")
+            continue
+
+        # Committed to this model — relay chunks as they arrive
+        finish, usage, n_chars = "unknown", {}, 0
+        try:
+            for line in res.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                payload = line[5:].strip()
+                if payload == "[DONE]":
+                    break
+                evt = json.loads(payload)
+                choice = (evt.get("choices") or [{}])[0]
+                delta = (choice.get("delta") or {}).get("content")
+                if delta:
+                    n_chars += len(delta)
+                    yield delta
+                if choice.get("finish_reason"):
+                    finish = choice["finish_reason"]
+                usage = (evt.get("x_groq") or {}).get("usage") or evt.get("usage") or usage
+        except Exception as e:
+            print(f"[Groq] Stream interrupted on {m}: {e}")
+            yield f"\n\nError: stream interrupted ({e})"
+        finally:
+            res.close()
+            reservation[1] = usage.get("total_tokens") or reservation[1]
+            _record_route_usage(route, m, prompt_tokens, budget, usage, finish,
+                                latency_ms=int((time.time() - started) * 1000), fallback=i > 0, job_id=job_id)
+            print(f"[Groq] stream model={m} finish_reason={finish}, content length={n_chars}")
+        return
+
+    _record_route_failure(route, job_id)
+    yield _groq_exhausted_message(MODELS)
+
+
+def _sse_llm_response(chunks, finalize):
+    """
+    Relay LLM chunks to the browser as Server-Sent Events:
+      event: chunk  data: {"text": "..."}   (repeated)
+      event: done   data: finalize(full_text)   (post-processed result)
+    """
+    from flask import Response, stream_with_context
+
+    def events():
+        parts = []
+        for chunk in chunks:
+            parts.append(chunk)
+            yield f"event: chunk\ndata: {json.dumps({'text': chunk})}\n\n"
+        try:
+            final = finalize("".join(parts))
+        except Exception as e:
+            final = {"error": str(e)}
+        yield f"event: done\ndata: {json.dumps(final)}\n\n"
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def _wants_stream(data):
+    return bool(data.get("stream")) or request.args.get("stream") in ("1", "true")
 
 PROFILE = {
     "name": "Amretha Karthikeyan",
@@ -430,9 +2088,7 @@ def save_profile():
 def load_profile():
     """Load the active profile (custom or default)."""
     profile = get_active_profile()
-    is_default = (profile.get("name") == DEFAULT_PROFILE.get("name") and
-                  profile.get("email") == DEFAULT_PROFILE.get("email"))
-    return jsonify({"profile": profile, "is_default": is_default})
+    return jsonify({"profile": profile, "is_default": _is_default_profile(profile)})
 
 
 @app.route("/api/profile/reset", methods=["POST"])
@@ -499,7 +2155,7 @@ Return ONLY valid JSON with this exact structure (no markdown, no extra text):
 If a field is not found in the resume, use empty string "" or empty array [].
 Extract ALL experience entries, education, and skills mentioned."""
 
-    result = call_claude(prompt)
+    result = call_claude(prompt, route="parse_resume")
     try:
         import re
         clean = re.sub(r'```json|```', '', result).strip()
@@ -519,121 +2175,33 @@ def is_ai_role(jd, role_type):
     return any(t in text for t in ai_terms)
 
 
-# ─── ROUTES ───────────────────────────────────────────────
-
-@app.route("/", methods=["GET", "HEAD"])
-@app.route("/index.html")
-def index():
-    try:
-        return render_template("index.html")
-    except Exception as e:
-        app.logger.error(f"Template error: {e}")
-        return f"<h2>App is running!</h2><p>Template error: {e}</p><p>BASE_DIR: {BASE_DIR}</p>", 500
-
-def _inject_ai_projects(resume_text):
-    """Always inject exactly ONE AI & Personal Projects section right after PROFESSIONAL SUMMARY.
-    This highlights AI specialisation early — before Skills and Experience.
-    Strips any AI-generated version first, then inserts our fixed canonical block."""
-    import re as _re
-
-    PROJECTS = (
-        "\nAI & PERSONAL PROJECTS:\n"
-        "AI Trade Analysis Platform & Job Hunt Automation App | Python, Flask, Claude API, Supabase, Render | 2025\n"
-        "Live: https://stock-monitor-8ak6.onrender.com | https://job-hunt-app-r7my.onrender.com\n"
-        "- Built a job-hunt automation platform end-to-end — identified that the standard job application process had a "
-        "critical drop-off problem (complex forms, no personalisation), so replaced the intake flow with a conversational "
-        "chatbot interface that reduced user friction and kept engagement alive; platform generates tailored ATS-optimised "
-        "resumes, scores job fit via AI ranking, and tracks 400+ applications via Kanban board\n"
-        "- Applied product and conversion thinking throughout: defined the user funnel (awareness → engagement → action), "
-        "A/B tested chatbot vs form intake for profile collection, and used Claude API (Anthropic) for AI-powered "
-        "document generation — shipped full-stack from zero to live product independently using Python, Flask, Supabase, and Render"
-    )
+# ─── PROMPT TEMPLATE REGISTRY ────────────────────────────────────────────────
+# Every resume / cover letter / scoring prompt is built from a registered
+# template: a STATIC prefix (instructions, candidate master data, format and
+# bullet rules) compiled once per profile version, followed by a short
+# DYNAMIC tail (target role, company, JD). Keeping the static block first and
+# byte-identical across calls means one copy of the master data to maintain
+# and a stable prompt prefix for the provider's prompt cache.
 
-    # Strip ALL existing AI projects blocks (AI-generated or previously injected)
-    for pattern in [
-        r'\n+AI & PERSONAL PROJECTS:.*?(?=\nSKILL SET|\nCORE SKILLS|\nSKILLS|\nPROFESSIONAL EXPERIENCE|\nACADEMIC QUALIFICATION|\nEDUCATION|\Z)',
-        r'\n+PERSONAL PROJECTS:.*?(?=\nSKILL SET|\nCORE SKILLS|\nSKILLS|\nPROFESSIONAL EXPERIENCE|\nACADEMIC QUALIFICATION|\nEDUCATION|\Z)',
-        r'\n+AI PROJECTS:.*?(?=\nSKILL SET|\nCORE SKILLS|\nSKILLS|\nPROFESSIONAL EXPERIENCE|\nACADEMIC QUALIFICATION|\nEDUCATION|\Z)',
-    ]:
-        resume_text = _re.sub(pattern, '', resume_text, flags=_re.DOTALL | _re.IGNORECASE)
-
-    # Insert RIGHT AFTER the PROFESSIONAL SUMMARY block (before SKILL SET / CORE SKILLS)
-    # Find end of summary block = the line before SKILL SET or CORE SKILLS
-    for next_section in ['SKILL SET:', 'SKILL SET', 'CORE SKILLS:', 'CORE SKILLS', 'SKILLS:']:
-        idx = resume_text.find(next_section)
-        if idx != -1:
-            resume_text = resume_text[:idx].rstrip() + PROJECTS + '\n\n' + resume_text[idx:]
-            return resume_text
+import threading
 
-    # Fallback: insert before PROFESSIONAL EXPERIENCE
-    for next_section in ['PROFESSIONAL EXPERIENCE:', 'PROFESSIONAL EXPERIENCE']:
-        idx = resume_text.find(next_section)
-        if idx != -1:
-            resume_text = resume_text[:idx].rstrip() + PROJECTS + '\n\n' + resume_text[idx:]
-            return resume_text
+_prompt_prefix_cache = {}        # (template, profile_version) -> compiled prefix
+_prompt_token_stats  = {}        # template -> {"calls", "static_tokens", "dynamic_tokens", "max_total"}
+_prompt_stats_lock   = threading.Lock()
 
-    # Last fallback: before education
-    for marker in ['ACADEMIC QUALIFICATION:', 'ACADEMIC QUALIFICATION', 'EDUCATION & CERTIFICATIONS:', 'EDUCATION:']:
-        idx = resume_text.find(marker)
-        if idx != -1:
-            resume_text = resume_text[:idx].rstrip() + PROJECTS + '\n\n' + resume_text[idx:]
-            return resume_text
 
-    return resume_text.rstrip() + PROJECTS
+def _is_default_profile(P):
+    return P.get("name") == DEFAULT_PROFILE.get("name") and P.get("email") == DEFAULT_PROFILE.get("email")
 
 
-@app.route("/api/tailor-resume", methods=["POST"])
-def tailor_resume():
-    data = request.json
-    jd = data.get("jd", "")
-    role_type = data.get("roleType", "Business Analyst")
-    matched_keywords = data.get("matchedKeywords", [])   # from rank_jobs scoring
-    ai_role = is_ai_role(jd, role_type)
-    P = get_active_profile()
-    framing = build_product_framing(P)
+def _profile_version(P):
+    """Short stable hash of the profile — compiled prefixes are keyed on it."""
+    return hashlib.sha1(json.dumps(P, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:12]
 
-    # Build keyword line for prompt — use pre-extracted keywords if available
-    if matched_keywords:
-        kw_line = f"PRE-EXTRACTED JD KEYWORDS (already matched against candidate profile — use ALL of these verbatim in resume): {', '.join(matched_keywords)}"
-    else:
-        kw_line = "Extract keywords from the JD above and weave them throughout the resume."
 
-    # Build structured profile text (easier for LLM than JSON)
-    exp_text = ""
-    for exp in P.get('experience', []):
-        exp_text += f"\n--- {exp.get('role','')} at {exp.get('company','')} ({exp.get('period','')}) ---\n"
-        for b in exp.get('bullets', []):
-            exp_text += f"  - {b}\n"
-        for a in exp.get('achievements', []):
-            exp_text += f"  Achievement: {a}\n"
-
-    skills_text = ', '.join(P.get('skills', []))
-    edu_text = '\n'.join([f"  - {e.get('degree','')} — {e.get('school','')} ({e.get('period','')})" for e in P.get('education', [])])
-    proj_text = ""
-    for proj in P.get('projects', []):
-        proj_text += f"\n  Project: {proj.get('title','')} ({proj.get('period','')}) — {proj.get('tech','')}\n"
-        proj_text += f"  URL: {proj.get('url','')}\n"
-        for b in proj.get('bullets', []):
-            proj_text += f"  - {b}\n"
-
-    num_exp = len(P.get('experience', []))
-
-    prompt = f"""You are an expert ATS resume writer. Write a COMPLETE 2-page resume for {P.get('name','')} targeting: {role_type} at a company matching this JD.
-
-JOB DESCRIPTION:
-{jd}
-
-{kw_line}
-
-===== CANDIDATE MASTER DATA (use ALL of this) =====
-Name: {P.get('name','')}
-Phone: {P.get('mobile','')}
-Email: {P.get('email','')}
-LinkedIn: {P.get('linkedin','')}
-Address: {P.get('address','')}
-Certification: SAFe 6.0 Product Owner/Product Management
-
-HEADLINE OPTIONS (pick most relevant to JD):
+# Hand-curated master data for the default profile: richer bullet pools than
+# the structured PROFILE dict (grouped by the kind of JD they suit).
+_DEFAULT_MASTER_DATA = """HEADLINE OPTIONS (pick most relevant to JD):
 - Business Analyst Lead | Product Owner | Sales & Operations Excellence
 - Lead Business Analyst / Enterprise Product Owner
 - Digital Product Manager | Product Owner (AI & Data Platforms)
@@ -696,67 +2264,9 @@ Available bullets (pick 2-3 most relevant — use SEO/CRO bullet when JD mention
 - Delivered 30% sales increase and improved organic search ranking through strategic backend SEO optimisation and Brand Referral Bonus programme — leveraged TikTok ads and optimised product imagery to capitalise on the 75% of shoppers who rely on visual content for purchase decisions
 - Built real-time quality monitoring dashboards in Power BI (pulling from SQL Server and Excel) — ops team used them daily to catch defects earlier, cutting quality issues by 20% in 6 months
 - Translated 40+ business requirements into functional and non-functional specs across 3 product teams — zero spec-related rework in UAT, 95% stakeholder sign-off rate on first review
-- Analysed operational data using Tableau and Power BI to identify 3 bottlenecks in fulfilment workflow — fixes increased operational efficiency by 15% in one quarter
-
-EDUCATION:
-Master of Science Engineering Business Management, Coventry University, UK (Jul 2019 – Nov 2020)
-Bachelor of Engineering Electronics & Communication Engineering, Anna University, India (Jul 2012 – Jun 2016)
-SAFe 6.0 certified Product Owner/Product Management
-===================================================
-
-OUTPUT FORMAT RULES — FOLLOW EXACTLY:
-1. First line: Amretha Karthikeyan  (just the name, nothing else)
-2. Line 2: #02-321 153 Gangsa Road, Singapore-670153
-3. Line 3: Mobile: +65-90256503, email: amretha.ammu@gmail.com
-4. Line 4: https://www.linkedin.com/in/amretha-nishanth-534b39101/
-5. Line 5: [Most relevant headline from options above]
-6. Blank line
-7. PROFESSIONAL SUMMARY:
-8. [4 sentences — blend the most relevant summary option above with JD keywords. RULES FOR SUMMARY: write like a real person talking about their work, not a job posting. Use first-person implied tone (no "I" but sounds human). Every sentence must contain a real number or specific fact. Sentence 1: role + years + where (KPMG Singapore). Sentence 2: AI projects with URLs as differentiator. Sentence 3: 2 specific metrics from experience (25% defect reduction, 30 man-days, 5% profit). Sentence 4: SAFe cert + what you're targeting. BANNED in summary: leveraged, spearheaded, transformative, innovative, dynamic, results-driven, passionate, cross-functional synergies, stakeholder value, drive operational alignment, scalable solutions, proven track record]
-9. Blank line
-10. SKILL SET:
-11. Data visualization tools: Tableau, Power BI[+ JD tools]
-12. Programming: PSQL, Python basics[+ JD languages]
-13. Others: [all relevant skills + JD keywords, comma separated]
-14. Certification: Scaled Agile Framework 6.0 Product Owner/Product Management
-15. Blank line
-16. PROFESSIONAL EXPERIENCE:
-17. KPMG, Singapore  Feb 2021 – Present
-18. [Most relevant job title — no slashes at start/end]
-19. - [bullet 1]
-20. - [bullet 2] ... (6-8 bullets)
-21. Key Achievements:
-22. - [achievement 1]
-23. - [achievement 2]
-24. - [achievement 3]
-25. Blank line
-26. J.P. Morgan  Oct 2023 – Jan 2024
-27. Asset Management Virtual Internship
-28. - [3-4 bullets]
-29. Blank line
-30. Amazon Inc, India  Mar 2018 – Mar 2019
-31. Business Analyst
-32. - [2-3 bullets]
-33. Blank line
-34. ACADEMIC QUALIFICATION:
-35. Master of Science Engineering Business Management  Jul 2019 – Nov 2020
-36. Coventry University, UK
-37. Bachelor of Engineering  Jul 2012 – Jun 2016
-38. Electronics & Communication Engineering, Anna University, India
-39. Certification: Scaled Agile Framework 6.0 Product Owner/Product Management
+- Analysed operational data using Tableau and Power BI to identify 3 bottlenecks in fulfilment workflow — fixes increased operational efficiency by 15% in one quarter"""
 
-CRITICAL RULES:
-- Plain text ONLY. No **, no #, no ```, no markdown
-- Section headers in ALL CAPS exactly as shown
-- Bullets use "- " prefix
-- Job titles on their own line, no slashes before or after
-- Target 700-850 words total (fills 2 pages properly)
-- Weave in at least 12 exact keyword phrases from the JD
-- Do NOT write "HEADER" anywhere — start with the candidate name
-- Do NOT mention the target company name (e.g. Revolut, any specific company) anywhere in the resume — language must be generic and transferable
-- Do NOT add any closing paragraphs, cover-letter-style text, or "overall I believe..." summaries after the ACADEMIC QUALIFICATION section
-
-BULLET QUALITY RULES — THIS IS THE MOST IMPORTANT SECTION:
+_BULLET_QUALITY_RULES = """BULLET QUALITY RULES — THIS IS THE MOST IMPORTANT SECTION:
 Every bullet must follow this exact formula: [Strong action verb] + [specific thing done] + [real number/% result] + [business impact]
 Example of what a bullet MUST look like: "Reduced loan processing defects by 25% by designing end-to-end test scenarios on Loan IQ, preventing $2M in potential rework costs"
 Example of what a bullet must NEVER look like: "Spearheaded the development of innovative customer-centric solutions leveraging cross-functional collaboration to drive transformative outcomes"
@@ -770,54 +2280,383 @@ EVERY bullet must:
 - Answer "so what?" — what was the real business impact
 - Sound like something a real person said, not an AI writing template"""
 
-    result = call_claude(prompt, max_tokens=8192)
-    result = _inject_ai_projects(result)
-    return jsonify({"result": result, "isAiRole": ai_role})
+_SCORING_RULES = """SCORING RULES:
+- Score 1-10 based on fit with the candidate's profile
+- +2 for in-house product/tech companies (Grab, Sea, Airwallex, Stripe, GovTech, startups), -2 for consulting firms (KPMG, Deloitte, Accenture, Big4) — max 4/10 for consulting roles
+- Score 0 if "no visa sponsorship" detected
+- Score 1-2 MAX for pure software engineering/developer roles (e.g. Software Engineer, Frontend Developer, Backend Engineer, DevOps, SRE) — these are NOT a match for BA/PM/PO profiles
+- Score 1-2 MAX for roles requiring 8+ years when candidate has ~5 years
+- Heavily penalise roles that don't match the candidate's core domain (business analysis, product management, digital transformation)
+- Labels: 🔥 Strong Match (9-10), ✅ Good Fit (7-8), 🟡 Possible (5-6), ❌ Weak Fit (1-4)
+- Priority: Apply Today, Apply This Week, Lower Priority, Skip"""
+
+
+def _master_data_block(P):
+    """Candidate master data — curated pools for the default profile, else built from the profile."""
+    lines = [
+        "===== CANDIDATE MASTER DATA (use ALL of this) =====",
+        f"Name: {P.get('name','')}",
+        f"Phone: {P.get('mobile','')}",
+        f"Email: {P.get('email','')}",
+        f"LinkedIn: {P.get('linkedin','')}",
+        f"Address: {P.get('address','')}",
+        f"Certification: {P.get('certification','')}",
+        "",
+    ]
+    if _is_default_profile(P):
+        lines.append(_DEFAULT_MASTER_DATA)
+    else:
+        lines.append(f"HEADLINE: {P.get('headline','')}")
+        lines.append(f"SUMMARY: {P.get('summary','')}")
+        lines.append("")
+        lines.append(f"SKILLS POOL (use all relevant + add JD keywords): {', '.join(P.get('skills', []))}")
+        lines.append("")
+        lines.append("EXPERIENCE — USE ALL BULLETS BELOW, SELECT MOST JD-RELEVANT ONES:")
+        for exp in P.get('experience', []):
+            lines.append(f"\n{exp.get('company','')} | {exp.get('period','')} | {exp.get('role','')}")
+            lines.extend(f"- {b}" for b in exp.get('bullets', []))
+            if exp.get('achievements'):
+                lines.append("Key Achievements:")
+                lines.extend(f"- {a}" for a in exp.get('achievements', []))
+        if P.get('projects'):
+            lines.append("\nPROJECTS:")
+            for proj in P.get('projects', []):
+                lines.append(f"{proj.get('title','')} ({proj.get('period','')}) — {proj.get('tech','')} — {proj.get('url','')}")
+                lines.extend(f"- {b}" for b in proj.get('bullets', []))
+    lines.append("")
+    lines.append("EDUCATION:")
+    lines.extend(f"{e.get('degree','')}, {e.get('school','')} ({e.get('period','')})" for e in P.get('education', []))
+    lines.append("===================================================")
+    return "\n".join(lines)
+
+
+def _resume_format_block(P):
+    """OUTPUT FORMAT section — header lines and experience skeleton derived from the profile."""
+    exp_skeleton = []
+    for i, exp in enumerate(P.get('experience', [])):
+        exp_skeleton.append(f"{exp.get('company','')}  {exp.get('period','')}")
+        if i == 0:
+            exp_skeleton.append("[Most relevant job title — no slashes at start/end]")
+            exp_skeleton.append("- [6-8 bullets]")
+            if exp.get('achievements') or _is_default_profile(P):
+                exp_skeleton.append("Key Achievements:")
+                exp_skeleton.append("- [3 achievements]")
+        else:
+            exp_skeleton.append(exp.get('role', '[job title]'))
+            exp_skeleton.append("- [3-4 bullets]" if i == 1 else "- [2-3 bullets]")
+        exp_skeleton.append("[blank line]")
+    edu_skeleton = []
+    for e in P.get('education', []):
+        edu_skeleton.append(f"{e.get('degree','')}  {e.get('period','')}")
+        edu_skeleton.append(e.get('school', ''))
+    if P.get('certification'):
+        edu_skeleton.append(f"Certification: {P['certification']}")
 
-@app.route("/api/cover-letter", methods=["POST"])
-def cover_letter():
+    if _is_default_profile(P):
+        skills_skeleton = ("Data visualization tools: Tableau, Power BI[+ JD tools]\n"
+                           "Programming: PSQL, Python basics[+ JD languages]\n"
+                           "Others: [all relevant skills + JD keywords, comma separated]")
+        metrics_hint = " (25% defect reduction, 30 man-days, 5% profit)"
+    else:
+        skills_skeleton = ("Tools: [tools from skills pool + JD tools]\n"
+                           "Others: [all relevant skills + JD keywords, comma separated]")
+        metrics_hint = ""
+    current = (P.get('experience') or [{}])[0].get('company', '')
+
+    return f"""OUTPUT FORMAT RULES — FOLLOW EXACTLY, plain text only:
+Line 1: {P.get('name','')}  (just the name, nothing else)
+Line 2: {P.get('address','')}
+Line 3: Mobile: {P.get('mobile','')}, email: {P.get('email','')}
+Line 4: {P.get('linkedin','')}
+Line 5: [Most relevant headline from options above]
+[blank line]
+PROFESSIONAL SUMMARY:
+[4 sentences — blend the most relevant summary material above with JD keywords. Write like a real person talking about their work, not a job posting. Every sentence must contain a real number or specific fact. Sentence 1: role + years + where ({current}). Sentence 2: AI projects with URLs as differentiator. Sentence 3: 2 specific metrics from experience{metrics_hint}. Sentence 4: certification + what you're targeting. BANNED in summary: leveraged, spearheaded, transformative, innovative, dynamic, results-driven, passionate, cross-functional synergies, stakeholder value, drive operational alignment, scalable solutions, proven track record]
+[blank line]
+SKILL SET:
+{skills_skeleton}
+Certification: {P.get('certification','')}
+[blank line]
+PROFESSIONAL EXPERIENCE:
+{chr(10).join(exp_skeleton)}
+ACADEMIC QUALIFICATION:
+{chr(10).join(edu_skeleton)}
+
+CRITICAL RULES:
+- Plain text ONLY. No **, no #, no ```, no markdown
+- Section headers in ALL CAPS exactly as shown
+- Bullets use "- " prefix
+- Job titles on their own line, no slashes before or after
+- Target 750-850 words total (fills 2 pages properly)
+- Weave in at least 12 exact keyword phrases from the JD
+- Do NOT write "HEADER" anywhere — start with the candidate name
+- Do NOT write an AI & Personal Projects section — it is added automatically
+- Do NOT mention the target company name anywhere in the resume — language must be generic and transferable
+- Do NOT add any closing paragraphs, cover-letter-style text, or "overall I believe..." summaries after the ACADEMIC QUALIFICATION section"""
+
+
+def _candidate_brief(P):
+    """Short candidate line used by the scoring prompts."""
+    return (f"{P.get('name', 'Candidate')} — {P.get('headline', 'Professional')}\n"
+            f"Summary: {P.get('summary', '')[:200]}\n"
+            f"Skills: {', '.join(P.get('skills', [])[:10])}\n"
+            f"Certification: {P.get('certification', '')}\n"
+            f"Target: In-house product roles (NOT consulting).")
+
+
+def _build_resume_prefix(P):
+    return f"""You are an expert ATS resume writer. Write a COMPLETE 2-page resume for {P.get('name','')} targeting the role and job description given at the end of this prompt.
+{build_product_framing(P)}
+{_master_data_block(P)}
+
+{_resume_format_block(P)}
+
+{_BULLET_QUALITY_RULES}
+"""
+
+
+def _build_cover_letter_prefix(P):
+    achievements = [a for exp in P.get('experience', []) for a in exp.get('achievements', [])]
+    if P.get('certification'):
+        achievements.append(f"Certified: {P['certification']}")
+    if P.get('aiProjectUrl'):
+        achievements.append(f"Personal Project: {P['aiProjectUrl']}")
+    achievements_text = "\n".join(f"- {a}" for a in achievements)
+    return f"""Write a professional 300-350 word cover letter for {P.get('name','')} applying to the role and company given at the end of this prompt.
+{build_product_framing(P)}
+KEY ACHIEVEMENTS:
+{achievements_text}
+
+Rules: Plain text only. No bold, no headers, no bullet points. Start with 'Dear Hiring Manager,' on its own line.
+
+Write a compelling cover letter that:
+1. Opens with a confident hook referencing the specific role and company
+2. Highlights the strongest metrics above in context of what the JD requires
+3. Uses the DIFFERENTIATOR given below
+4. Shows genuine enthusiasm for the company — reference what they do
+5. Ends with a clear call to action
+
+Exactly 300-350 words. No consulting jargon. Never use [URL], [Company], or any placeholder text — always use the actual values.
+"""
+
+
+def _build_score_prefix(P):
+    return f"""You are a career coach for the Singapore tech job market.
+
+CANDIDATE:
+{_candidate_brief(P)}
+
+{_SCORING_RULES}
+"""
+
+
+def _build_batch_score_prefix(P):
+    return _build_score_prefix(P) + """
+Return ONLY a JSON array (no markdown), one object per job:
+[{"idx": 0, "score": 8, "label": "✅ Good Fit", "reason": "Two sentences.", "priority": "Apply This Week"}]
+Use idx starting from 0 and score every single job listed.
+"""
+
+
+PROMPT_TEMPLATES = {
+    "resume": {
+        "prefix": _build_resume_prefix,
+        "tail": "TARGET ROLE: {role}\n{ai_line}\n{kw_line}\n\nJOB DESCRIPTION:\n{jd}",
+    },
+    "cover_letter": {
+        "prefix": _build_cover_letter_prefix,
+        "tail": "ROLE: {role}\nCOMPANY: {company}\n{company_brief}DIFFERENTIATOR: {differentiator}\n\nJOB DESCRIPTION:\n{jd}",
+    },
+    "score": {
+        "prefix": _build_score_prefix,
+        "tail": ('JOB:\nTitle: {role}\nCompany: {company}\nJD: {jd}\n\n'
+                 'Return ONLY valid JSON, no markdown:\n'
+                 '{{"score": 8, "label": "✅ Good Fit", "reason": "Two sentence reason.", "priority": "Apply This Week"}}'),
+    },
+    "batch_score": {
+        "prefix": _build_batch_score_prefix,
+        "tail": "JOBS ({count}):\n{jobs}",
+    },
+}
+
+
+def get_prompt_prefix(name, P):
+    """Compiled static prefix for a template — built once per profile version."""
+    key = (name, _profile_version(P))
+    prefix = _prompt_prefix_cache.get(key)
+    metrics.inc("jobhunt_cache_requests_total", {"cache": "prompt_prefix", "result": "miss" if prefix is None else "hit"})
+    if prefix is None:
+        prefix = PROMPT_TEMPLATES[name]["prefix"](P)
+        if len(_prompt_prefix_cache) > 64:
+            _prompt_prefix_cache.clear()
+        _prompt_prefix_cache[key] = prefix
+    return prefix
+
+
+def build_prompt(name, P, **fields):
+    """Static prefix + JD-dependent tail for template `name`; records token counts."""
+    prefix = get_prompt_prefix(name, P)
+    tail = PROMPT_TEMPLATES[name]["tail"].format(**fields)
+    static_tokens, dynamic_tokens = _estimate_tokens(prefix), _estimate_tokens(tail)
+    with _prompt_stats_lock:
+        st = _prompt_token_stats.setdefault(name, {"calls": 0, "static_tokens": 0, "dynamic_tokens": 0, "max_total": 0})
+        st["calls"] += 1
+        st["static_tokens"] = static_tokens
+        st["dynamic_tokens"] += dynamic_tokens
+        st["max_total"] = max(st["max_total"], static_tokens + dynamic_tokens)
+    return prefix + "\n" + tail
+
+
+def resume_prompt_fields(role, jd, matched_keywords=None, ai_role=False, P=None):
+    """Dynamic fields for the "resume" template."""
+    P = P or {}
+    kw_line = (f"PRE-EXTRACTED JD KEYWORDS (already matched against candidate profile — use ALL of these verbatim in resume): {', '.join(matched_keywords)}"
+               if matched_keywords else
+               "Extract keywords from the JD below and weave them throughout the resume.")
+    ai_line = (f"AI ROLE: Lean on the AI projects ({P.get('aiProjectUrl','')}) and AI skills as a key differentiator."
+               if ai_role else "")
+    return {"role": role, "jd": jd, "kw_line": kw_line, "ai_line": ai_line}
+
+
+def cover_letter_prompt_fields(role, company, jd, ai_role=False, P=None):
+    """Dynamic fields for the "cover_letter" template."""
+    P = P or {}
+    proj_url = P.get('aiProjectUrl') or 'https://stock-monitor-8ak6.onrender.com'
+    differentiator = (f"AI ROLE — mention the live AI project at {proj_url} as proof of hands-on AI product development. Write the full URL exactly — never write [URL] or any placeholder."
+                      if ai_role else
+                      "Bridge consulting delivery to product ownership with specific JD alignment.")
+    return {"role": role, "company": company, "jd": jd, "differentiator": differentiator,
+            "company_brief": _company_brief_block(company, 400)}
+
+
+@app.route("/api/llm/stats", methods=["GET"])
+def llm_stats():
+    """Prompt template sizes, per-route estimated vs actual tokens, current TPM usage."""
+    P = get_active_profile()
+    templates = {}
+    for name in PROMPT_TEMPLATES:
+        st = dict(_prompt_token_stats.get(name, {}))
+        st["static_tokens"] = _estimate_tokens(get_prompt_prefix(name, P))
+        calls = st.get("calls", 0)
+        st["avg_dynamic_tokens"] = round(st.get("dynamic_tokens", 0) / calls) if calls else 0
+        templates[name] = st
+    return jsonify({"profile_version": _profile_version(P), "prompt_templates": templates,
+                    "routes": route_token_stats(),
+                    "single_flight": {f.name: f.stats() for f in (_llm_flight, _intel_flight, _jd_flight)},
+                    "scoring": scoring_stats(),
+                    "tpm_window": {m: _tpm_used(m) for m in GROQ_MODEL_LIMITS}})
+
+
+@app.route("/api/llm/usage", methods=["GET"])
+def llm_usage():
+    """LLM usage ledger aggregated over ?days= (default 7) by ?group=day,route,model."""
+    try:
+        days = max(1, min(int(request.args.get("days", 7)), LLM_LEDGER_DAYS))
+        group_by = [g.strip() for g in request.args.get("group", "day,route,model").split(",")]
+        return jsonify(llm_usage_report(days, group_by))
+    except (ValueError, sqlite3.Error) as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# ─── ROUTES ───────────────────────────────────────────────
+
+@app.route("/", methods=["GET", "HEAD"])
+@app.route("/index.html")
+def index():
+    try:
+        return render_template("index.html")
+    except Exception as e:
+        app.logger.error(f"Template error: {e}")
+        return f"<h2>App is running!</h2><p>Template error: {e}</p><p>BASE_DIR: {BASE_DIR}</p>", 500
+
+def _inject_ai_projects(resume_text):
+    """Always inject exactly ONE AI & Personal Projects section right after PROFESSIONAL SUMMARY.
+    This highlights AI specialisation early — before Skills and Experience.
+    Strips any AI-generated version first, then inserts our fixed canonical block."""
+    import re as _re
+
+    PROJECTS = (
+        "\nAI & PERSONAL PROJECTS:\n"
+        "AI Trade Analysis Platform & Job Hunt Automation App | Python, Flask, Claude API, Supabase, Render | 2025\n"
+        "Live: https://stock-monitor-8ak6.onrender.com | https://job-hunt-app-r7my.onrender.com\n"
+        "- Built a job-hunt automation platform end-to-end — identified that the standard job application process had a "
+        "critical drop-off problem (complex forms, no personalisation), so replaced the intake flow with a conversational "
+        "chatbot interface that reduced user friction and kept engagement alive; platform generates tailored ATS-optimised "
+        "resumes, scores job fit via AI ranking, and tracks 400+ applications via Kanban board\n"
+        "- Applied product and conversion thinking throughout: defined the user funnel (awareness → engagement → action), "
+        "A/B tested chatbot vs form intake for profile collection, and used Claude API (Anthropic) for AI-powered "
+        "document generation — shipped full-stack from zero to live product independently using Python, Flask, Supabase, and Render"
+    )
+
+    # Strip ALL existing AI projects blocks (AI-generated or previously injected)
+    for pattern in [
+        r'\n+AI & PERSONAL PROJECTS:.*?(?=\nSKILL SET|\nCORE SKILLS|\nSKILLS|\nPROFESSIONAL EXPERIENCE|\nACADEMIC QUALIFICATION|\nEDUCATION|\Z)',
+        r'\n+PERSONAL PROJECTS:.*?(?=\nSKILL SET|\nCORE SKILLS|\nSKILLS|\nPROFESSIONAL EXPERIENCE|\nACADEMIC QUALIFICATION|\nEDUCATION|\Z)',
+        r'\n+AI PROJECTS:.*?(?=\nSKILL SET|\nCORE SKILLS|\nSKILLS|\nPROFESSIONAL EXPERIENCE|\nACADEMIC QUALIFICATION|\nEDUCATION|\Z)',
+    ]:
+        resume_text = _re.sub(pattern, '', resume_text, flags=_re.DOTALL | _re.IGNORECASE)
+
+    # Insert RIGHT AFTER the PROFESSIONAL SUMMARY block (before SKILL SET / CORE SKILLS)
+    # Find end of summary block = the line before SKILL SET or CORE SKILLS
+    for next_section in ['SKILL SET:', 'SKILL SET', 'CORE SKILLS:', 'CORE SKILLS', 'SKILLS:']:
+        idx = resume_text.find(next_section)
+        if idx != -1:
+            resume_text = resume_text[:idx].rstrip() + PROJECTS + '\n\n' + resume_text[idx:]
+            return resume_text
+
+    # Fallback: insert before PROFESSIONAL EXPERIENCE
+    for next_section in ['PROFESSIONAL EXPERIENCE:', 'PROFESSIONAL EXPERIENCE']:
+        idx = resume_text.find(next_section)
+        if idx != -1:
+            resume_text = resume_text[:idx].rstrip() + PROJECTS + '\n\n' + resume_text[idx:]
+            return resume_text
+
+    # Last fallback: before education
+    for marker in ['ACADEMIC QUALIFICATION:', 'ACADEMIC QUALIFICATION', 'EDUCATION & CERTIFICATIONS:', 'EDUCATION:']:
+        idx = resume_text.find(marker)
+        if idx != -1:
+            resume_text = resume_text[:idx].rstrip() + PROJECTS + '\n\n' + resume_text[idx:]
+            return resume_text
+
+    return resume_text.rstrip() + PROJECTS
+
+
+@app.route("/api/tailor-resume", methods=["POST"])
+def tailor_resume():
     data = request.json
     jd = data.get("jd", "")
     role_type = data.get("roleType", "Business Analyst")
-    company = data.get("company", "the company")
+    matched_keywords = data.get("matchedKeywords", [])   # from rank_jobs scoring
     ai_role = is_ai_role(jd, role_type)
-
     P = get_active_profile()
-    framing = build_product_framing(P)
-    # Build achievements from profile experience
-    achievements_text = ""
-    for exp in P.get('experience', []):
-        for ach in exp.get('achievements', []):
-            achievements_text += f"- {ach}\n"
-    if P.get('certification'):
-        achievements_text += f"- Certified: {P['certification']}\n"
-    if P.get('aiProjectUrl'):
-        achievements_text += f"- Personal Project: {P.get('aiProjectUrl','')}\n"
 
-    proj_url = P.get('aiProjectUrl', 'https://stock-monitor-8ak6.onrender.com')
-    prompt = f"""Write a professional 300-350 word cover letter for {P['name']} applying to {role_type} at {company}.
-{framing}
+    prompt = build_prompt("resume", P, **resume_prompt_fields(role_type, _trim_jd(jd, 1500), matched_keywords, ai_role, P))
 
-KEY ACHIEVEMENTS:
-{achievements_text}
-
-JOB DESCRIPTION:
-{jd}
+    if _wants_stream(data):
+        return _sse_llm_response(
+            call_claude(prompt, route="resume", stream=True),
+            lambda text: {"result": _inject_ai_projects(text), "isAiRole": ai_role})
 
-{"IMPORTANT — AI ROLE: Mention the live project at " + proj_url + " as proof of hands-on AI product development. Write the full URL exactly — never write [URL] or any placeholder." if ai_role else ""}
+    result = call_claude(prompt, route="resume")
+    result = _inject_ai_projects(result)
+    return jsonify({"result": result, "isAiRole": ai_role})
 
-Rules: Plain text only. No bold, no headers, no bullet points. Start with 'Dear Hiring Manager,' on its own line.
+@app.route("/api/cover-letter", methods=["POST"])
+def cover_letter():
+    data = request.json
+    jd = data.get("jd", "")
+    role_type = data.get("roleType", "Business Analyst")
+    company = data.get("company", "the company")
+    ai_role = is_ai_role(jd, role_type)
 
-Write a compelling cover letter that:
-1. Opens with a confident hook referencing the specific role and company
-2. Highlights KPMG metrics (5% value, 30 man-days) in context of what JD requires
-3. {"Mentions live AI project with full URL " + proj_url + " as key differentiator" if ai_role else "Bridges consulting delivery to product ownership with specific JD alignment"}
-4. Shows genuine enthusiasm for {company} — reference what they do
-5. Ends with a clear call to action
+    P = get_active_profile()
+    prompt = build_prompt("cover_letter", P, **cover_letter_prompt_fields(role_type, company, _trim_jd(jd, 1500), ai_role, P))
 
-Exactly 300-350 words. No consulting jargon. Never use [URL], [Company], or any placeholder text — always use the actual values."""
+    if _wants_stream(data):
+        return _sse_llm_response(call_claude(prompt, route="cover", stream=True),
+                                 lambda text: {"result": text})
 
-    result = call_claude(prompt)
+    result = call_claude(prompt, route="cover")
     return jsonify({"result": result})
 
 @app.route("/api/interview-prep", methods=["POST"])
@@ -845,8 +2684,8 @@ CANDIDATE:
 - Certified: {P.get('certification','')}
 - Skills: {skills_str}
 {('- Project: ' + proj_url) if proj_url else ''}
-{"JD: " + jd if jd else ""}
-
+{"JD: " + _trim_jd(jd, 1000) if jd else ""}
+{_company_brief_block(company)}
 Create prep with these EXACT sections:
 
 ## 5 Behavioral Questions with STAR Answers
@@ -864,17 +2703,215 @@ Product-minded questions that signal ownership thinking.
 ## Salary Negotiation Tip
 Specific tip based on the candidate's certifications and experience level."""
 
-    result = call_claude(prompt)
+    if _wants_stream(data):
+        return _sse_llm_response(call_claude(prompt, route="interview_prep", stream=True),
+                                 lambda text: {"result": text})
+
+    result = call_claude(prompt, route="interview_prep")
     return jsonify({"result": result})
 
 
 # ─── INTERACTIVE AI INTERVIEW COACH ─────────────────────────────────────────
 
-# In-memory session store (per-server; for multi-server use Redis/Supabase)
-_interview_sessions = {}
+# Interview sessions live in a bounded, expiring store. The default SQLite
+# backend (the shared local store) lets /api/interview/respond land on any
+# gunicorn worker; INTERVIEW_SESSION_BACKEND=memory keeps them per process.
+# Sessions idle for INTERVIEW_SESSION_TTL seconds expire, and beyond
+# INTERVIEW_SESSION_MAX the least recently used are evicted. Sessions are
+# stored as zlib-compressed JSON; get() returns a copy, so put() it back.
+
+import zlib
+from collections import OrderedDict
+
+INTERVIEW_SESSION_BACKEND = os.environ.get("INTERVIEW_SESSION_BACKEND", "sqlite")
+INTERVIEW_SESSION_TTL     = int(os.environ.get("INTERVIEW_SESSION_TTL", str(2 * 3600)))
+INTERVIEW_SESSION_MAX     = int(os.environ.get("INTERVIEW_SESSION_MAX", "200"))
+
+
+def _pack_session(session):
+    return zlib.compress(json.dumps(session, separators=(",", ":")).encode("utf-8"), 6)
+
+
+def _unpack_session(blob):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+class _MemorySessionStore:
+    def __init__(self, ttl, max_items):
+        self.ttl, self.max_items = ttl, max_items
+        self._items = OrderedDict()          # id -> (blob, last access), LRU first
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        now = time.time()
+        with self._lock:
+            item = self._items.get(sid)
+            if item is None:
+                return None
+            if now - item[1] > self.ttl:
+                del self._items[sid]
+                return None
+            self._items[sid] = (item[0], now)
+            self._items.move_to_end(sid)
+        return _unpack_session(item[0])
+
+    def put(self, sid, session):
+        blob = _pack_session(session)
+        with self._lock:
+            self._items[sid] = (blob, time.time())
+            self._items.move_to_end(sid)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._items.pop(sid, None)
+
+    def stats(self):
+        with self._lock:
+            return {"backend": "memory", "sessions": len(self._items),
+                    "bytes": sum(len(b) for b, _ in self._items.values())}
+
+
+_local_db_schema("""
+CREATE TABLE IF NOT EXISTS interview_sessions (
+    id       TEXT PRIMARY KEY,
+    data     BLOB NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS interview_sessions_accessed ON interview_sessions (accessed);
+""")
+
+
+class _SQLiteSessionStore:
+    def __init__(self, ttl, max_items):
+        self.ttl, self.max_items = ttl, max_items
+
+    def get(self, sid):
+        now = time.time()
+        db = _local_db()
+        row = db.execute("SELECT data, accessed FROM interview_sessions WHERE id = ?", (sid,)).fetchone()
+        if row is None:
+            return None
+        if now - row["accessed"] > self.ttl:
+            db.execute("DELETE FROM interview_sessions WHERE id = ?", (sid,))
+            return None
+        db.execute("UPDATE interview_sessions SET accessed = ? WHERE id = ?", (now, sid))
+        return _unpack_session(row["data"])
+
+    def put(self, sid, session):
+        now = time.time()
+        db = _local_db()
+        db.execute("INSERT INTO interview_sessions (id, data, accessed) VALUES (?, ?, ?) "
+                   "ON CONFLICT(id) DO UPDATE SET data = excluded.data, accessed = excluded.accessed",
+                   (sid, _pack_session(session), now))
+        db.execute("DELETE FROM interview_sessions WHERE accessed < ?", (now - self.ttl,))
+        db.execute("DELETE FROM interview_sessions WHERE id IN (SELECT id FROM interview_sessions "
+                   "ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.max_items,))
+
+    def delete(self, sid):
+        _local_db().execute("DELETE FROM interview_sessions WHERE id = ?", (sid,))
+
+    def stats(self):
+        row = _local_db().execute("SELECT COUNT(*) AS n, COALESCE(SUM(LENGTH(data)), 0) AS bytes "
+                                  "FROM interview_sessions").fetchone()
+        return {"backend": "sqlite", "sessions": row["n"], "bytes": row["bytes"]}
+
+
+_interview_store = (_MemorySessionStore if INTERVIEW_SESSION_BACKEND == "memory" else _SQLiteSessionStore)(
+    INTERVIEW_SESSION_TTL, INTERVIEW_SESSION_MAX)
+
+
+# ── Rolling interview context ──
+# Each turn's prompt is the system prompt, a running summary of older turns,
+# the score table, and only the last INTERVIEW_KEEP_TURNS exchanges verbatim,
+# so prompt size stays flat however long the interview runs. Folding is
+# incremental: each older exchange becomes one digest line; when the digest
+# outgrows INTERVIEW_SUMMARY_TOKENS it is condensed by the LLM (or, failing
+# that, its oldest lines are dropped). session["messages"] keeps the full
+# transcript for interview_end.
+
+INTERVIEW_KEEP_TURNS     = int(os.environ.get("INTERVIEW_KEEP_TURNS", "3"))
+INTERVIEW_SUMMARY_TOKENS = int(os.environ.get("INTERVIEW_SUMMARY_TOKENS", "450"))
+
+_NEXT_QUESTION_RE = re.compile(r"\*{0,2}Next Question:?\*{0,2}:?\s*(.+)", re.I | re.S)
+
+
+def _gist(text, limit):
+    text = re.sub(r"\s+", " ", (text or "").replace("**", "")).strip()
+    return text if len(text) <= limit else text[:limit].rsplit(" ", 1)[0] + "…"
+
+
+def _interview_question(message):
+    """The question an interviewer message asks (its "Next Question:" part, else its last '?' sentence)."""
+    m = _NEXT_QUESTION_RE.search(message or "")
+    if m:
+        return m.group(1)
+    asks = [s for s in re.split(r"(?<=[.?!])\s+", message or "") if s.rstrip().endswith("?")]
+    return asks[-1] if asks else message
+
+
+def _compact_interview_summary(session):
+    lines = session["summary_lines"]
+    prompt = (f"These are running notes from a mock interview for {session['role']} at {session['company']}.\n"
+              f"Condense them to at most {INTERVIEW_SUMMARY_TOKENS // 2} words. Keep: topics and competencies "
+              "already covered, concrete claims the candidate made (projects, metrics, tools), and recurring "
+              "strengths and weaknesses. Plain sentences, no headings.\n\nNOTES:\n" + "\n".join(lines))
+    condensed = call_claude(prompt, route="interview_compact").strip()
+    if condensed and not condensed.startswith(("Error:", "API error:")):
+        session["summary_lines"] = [f"Earlier (condensed): {_gist(condensed, INTERVIEW_SUMMARY_TOKENS * 4)}"]
+        return
+    while len(lines) > 1 and _estimate_tokens("\n".join(lines)) > INTERVIEW_SUMMARY_TOKENS:
+        lines.pop(0)
+
+
+def _fold_interview_turns(session):
+    """Fold exchanges older than the last INTERVIEW_KEEP_TURNS into the running summary."""
+    msgs = session["messages"]
+    lines = session.setdefault("summary_lines", [])
+    folded = session.get("folded", 0)
+    keep_from = max(0, len(msgs) - 2 * INTERVIEW_KEEP_TURNS - 1)
+    while folded + 1 < keep_from:
+        question, answer = msgs[folded], msgs[folded + 1]
+        n = folded // 2 + 1
+        score = dict(session.get("score_table", [])).get(n)
+        lines.append(f"Q{n}: {_gist(_interview_question(question['content']), 160)} | "
+                     f"A{n}: {_gist(answer['content'], 220)}" + (f" | {score}/10" if score else ""))
+        folded += 2
+    session["folded"] = folded
+    if _estimate_tokens("\n".join(lines)) > INTERVIEW_SUMMARY_TOKENS:
+        _compact_interview_summary(session)
+
+
+def _interview_turn_prompt(session):
+    if session.get("company_intel") is None:
+        intel = cached_company_intel(session["company"])
+        if intel is not None:
+            session["company_intel"] = intel
+            ctx = _intel_context(intel)
+            if ctx:
+                session["system_prompt"] += "\n" + ctx
+    _fold_interview_turns(session)
+    parts = [session["system_prompt"]]
+    if session.get("summary_lines"):
+        parts.append("EARLIER IN THIS INTERVIEW (summarised):\n" + "\n".join(session["summary_lines"]))
+    if session.get("score_table"):
+        parts.append("SCORES SO FAR: " + ", ".join(f"A{n} {s}/10" for n, s in session["score_table"]))
+    recent = "RECENT CONVERSATION:\n"
+    for msg in session["messages"][session.get("folded", 0):]:
+        prefix = "INTERVIEWER" if msg["role"] == "assistant" else "CANDIDATE"
+        recent += f"\n{prefix}: {msg['content']}\n"
+    parts.append(recent)
+    return "\n\n".join(parts) + "\nINTERVIEWER (now respond with score, feedback, and next question):"
+
 
 def _scrape_company_intel(company):
-    """Try to gather company interview intelligence from public sources."""
+    """Try to gather company interview intelligence from public sources.
+    Concurrent lookups for the same company share one scrape."""
+    return _intel_flight.do((company or "").strip().lower(), lambda: _scrape_company_intel_once(company))
+
+
+def _scrape_company_intel_once(company):
     intel = {"glassdoor": None, "general": None}
     try:
         import requests as http_req
@@ -906,6 +2943,292 @@ def _scrape_company_intel(company):
     return intel
 
 
+# ── Company intel cache ──
+# Scrapes run on a small background pool and land in a per-company TTL cache
+# shared by interview_start (which never waits for them), later interview
+# turns (which merge the intel in once it has arrived) and
+# /api/interview/company-intel (which scrapes while its LLM call runs).
+
+from concurrent.futures import ThreadPoolExecutor
+
+INTEL_CACHE_TTL       = int(os.environ.get("INTEL_CACHE_TTL", str(24 * 3600)))
+INTEL_CACHE_EMPTY_TTL = int(os.environ.get("INTEL_CACHE_EMPTY_TTL", "1800"))   # retry empty scrapes sooner
+INTEL_CACHE_MAX       = 256
+
+_intel_cache   = OrderedDict()       # company key -> (expires_at, intel), LRU first
+_intel_pending = {}                  # company key -> Future
+_intel_lock    = threading.Lock()
+_intel_pool    = ThreadPoolExecutor(max_workers=2, thread_name_prefix="intel")
+
+
+def _intel_key(company):
+    return (company or "").strip().lower()
+
+
+def cached_company_intel(company):
+    key = _intel_key(company)
+    with _intel_lock:
+        item = _intel_cache.get(key)
+        if item is None or item[0] < time.time():
+            return None
+        _intel_cache.move_to_end(key)
+        return item[1]
+
+
+def _refresh_company_intel(company):
+    key = _intel_key(company)
+    try:
+        intel = company_knowledge_get(company, "snippets")
+        if intel is None:
+            intel = _scrape_company_intel(company)
+            ttl = INTEL_CACHE_TTL if intel.get("glassdoor") or intel.get("general") else INTEL_CACHE_EMPTY_TTL
+            company_knowledge_put(company, "snippets", intel, ttl)
+        else:
+            ttl = INTEL_CACHE_TTL
+        with _intel_lock:
+            _intel_cache[key] = (time.time() + ttl, intel)
+            _intel_cache.move_to_end(key)
+            while len(_intel_cache) > INTEL_CACHE_MAX:
+                _intel_cache.popitem(last=False)
+        return intel
+    finally:
+        with _intel_lock:
+            _intel_pending.pop(key, None)
+
+
+def prefetch_company_intel(company):
+    """Cached intel for `company`, or None once a background scrape is on its way."""
+    intel = cached_company_intel(company)
+    key = _intel_key(company)
+    if intel is not None or not key:
+        return intel
+    with _intel_lock:
+        if key not in _intel_pending:
+            _intel_pending[key] = _intel_pool.submit(_refresh_company_intel, company)
+    return None
+
+
+def get_company_intel(company, timeout=10):
+    """Cached intel, waiting up to `timeout` s for an in-flight (or new) scrape."""
+    intel = prefetch_company_intel(company)
+    if intel is not None:
+        return intel
+    with _intel_lock:
+        fut = _intel_pending.get(_intel_key(company))
+    try:
+        return fut.result(timeout=timeout) if fut else cached_company_intel(company) or {}
+    except Exception:
+        return {"glassdoor": None, "general": None}
+
+
+def _intel_context(intel):
+    if not (intel or {}).get("glassdoor"):
+        return ""
+    return "\nCompany interview intelligence (from web research):\n" + "\n".join(
+        f"- {s}" for s in intel["glassdoor"][:3])
+
+
+# ─── COMPANY KNOWLEDGE STORE ─────────────────────────────────────────────────
+# Per-company facts that several routes would otherwise ask the LLM (or Google)
+# for again and again, kept in the shared local store under a normalized
+# company name. Each entry has a kind and its own TTL:
+#   brief         LLM company brief (products, culture, interview process)
+#   snippets      scraped interview snippets (see the intel cache above)
+#   intel:<role>  /api/interview/company-intel answer for that role
+#   why:<role>    /api/speed-kit "why this company" answer for that role
+# precompute_company_knowledge() fills these in the background for companies
+# with jobs scored >= COMPANY_PRECOMPUTE_MIN_SCORE, so those routes answer from
+# the store; JD-specific routes (interview-prep, cover letter) reuse the brief.
+
+COMPANY_KNOWLEDGE_TTL = {
+    "brief":    int(os.environ.get("COMPANY_BRIEF_TTL", str(14 * 86400))),
+    "snippets": INTEL_CACHE_TTL,
+    "intel":    int(os.environ.get("COMPANY_INTEL_TTL", str(7 * 86400))),
+    "why":      int(os.environ.get("COMPANY_WHY_TTL", str(14 * 86400))),
+}
+COMPANY_PRECOMPUTE_MIN_SCORE = int(os.environ.get("COMPANY_PRECOMPUTE_MIN_SCORE", "7"))
+COMPANY_PRECOMPUTE_MAX       = int(os.environ.get("COMPANY_PRECOMPUTE_MAX", "15"))   # companies per run
+
+_local_db_schema("""
+CREATE TABLE IF NOT EXISTS company_knowledge (
+    company_key TEXT NOT NULL,
+    kind        TEXT NOT NULL,
+    company     TEXT NOT NULL,
+    data        TEXT NOT NULL,
+    fetched     REAL NOT NULL,
+    expires     REAL NOT NULL,
+    PRIMARY KEY (company_key, kind)
+);
+""")
+
+# Only trailing words are stripped: legal suffixes, then the location words
+# directly before them ("... (Singapore) Pte. Ltd."). Location words elsewhere
+# are part of the name — "Singapore Airlines" is not "Airlines Co".
+_COMPANY_LEGAL_TAIL_RE = re.compile(
+    r"(?:\s+&)?(?:\s+(?:pte|private|ltd|limited|inc|incorporated|llc|llp|plc|corp|corporation|co|company|"
+    r"holdings))+$")
+_COMPANY_PLACE_TAIL_RE = re.compile(r"(?:\s+(?:singapore|sg|asia pacific|apac))+$")
+_company_flight = _SingleFlight("company_knowledge")
+_precompute_lock = threading.Lock()
+
+
+def _company_key(company):
+    """'DBS Bank (Singapore) Pte. Ltd.' and 'dbs bank' share one key."""
+    key = re.sub(r"[^\w\s&]", " ", (company or "").lower())
+    key = re.sub(r"\s+", " ", key).strip()
+    while True:
+        stripped = _COMPANY_LEGAL_TAIL_RE.sub("", key)
+        if stripped == key:
+            return key
+        key = _COMPANY_PLACE_TAIL_RE.sub("", stripped)
+
+
+def _role_key(role):
+    return re.sub(r"\s+", " ", (role or "").lower()).strip()[:80]
+
+
+def company_knowledge_get(company, kind):
+    key = _company_key(company)
+    if not key:
+        return None
+    try:
+        row = _local_db().execute("SELECT data FROM company_knowledge WHERE company_key = ? AND kind = ? "
+                                  "AND expires > ?", (key, kind, time.time())).fetchone()
+    except sqlite3.Error as e:
+        print(f"[Companies] read failed: {e}")
+        return None
+    metrics.inc("jobhunt_cache_requests_total", {"cache": "company_knowledge", "result": "hit" if row else "miss"})
+    return json.loads(row["data"]) if row else None
+
+
+def company_knowledge_put(company, kind, value, ttl=None):
+    key = _company_key(company)
+    if not key:
+        return
+    ttl = ttl or COMPANY_KNOWLEDGE_TTL.get(kind.split(":")[0], 86400)
+    now = time.time()
+    try:
+        _local_db().execute(
+            "INSERT INTO company_knowledge (company_key, kind, company, data, fetched, expires) "
+            "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(company_key, kind) DO UPDATE SET "
+            "company = excluded.company, data = excluded.data, fetched = excluded.fetched, expires = excluded.expires",
+            (key, kind, company.strip(), json.dumps(value), now, now + ttl))
+    except sqlite3.Error as e:
+        print(f"[Companies] write failed: {e}")
+
+
+def company_knowledge(company, kind, compute):
+    """Stored value, else compute() — stored unless it is an error string."""
+    value = company_knowledge_get(company, kind)
+    if value is not None:
+        return value
+
+    def fill():
+        value = compute()
+        if value and not (isinstance(value, str) and value.startswith(("Error:", "API error:"))):
+            company_knowledge_put(company, kind, value)
+        return value
+    return _company_flight.do(f"{_company_key(company)}|{kind}", fill)
+
+
+def _company_brief_prompt(company):
+    return f"""Write a compact, factual brief about the company "{company}" for a job candidate preparing applications and interviews in Singapore.
+Cover in at most 150 words, as plain sentences under these labels:
+What they do: products, customers, market.
+Culture & values: what they say they look for.
+Interview process: typical stages, if known.
+Recent developments: notable news or launches.
+If you are not sure about something, say so briefly rather than inventing details."""
+
+
+def company_brief(company, compute=False):
+    """Cached LLM brief for `company`; generated on a miss only when compute=True."""
+    if compute:
+        return company_knowledge(company, "brief",
+                                 lambda: call_claude(_company_brief_prompt(company), route="intel").strip())
+    return company_knowledge_get(company, "brief")
+
+
+def _company_brief_block(company, limit=700):
+    brief = company_brief(company)
+    return f"COMPANY BRIEF ({company}):\n{_gist(brief, limit)}\n" if brief else ""
+
+
+def precompute_company_knowledge(jobs, limit=None):
+    """Fill the store for companies of high-scoring jobs, best-scored first."""
+    limit = limit or COMPANY_PRECOMPUTE_MAX
+    by_company = {}
+    for j in jobs:
+        score = j.get("aiScore") or 0
+        key = _company_key(j.get("company"))
+        if score < COMPANY_PRECOMPUTE_MIN_SCORE or not key:
+            continue
+        entry = by_company.setdefault(key, {"company": j["company"].strip(), "score": 0, "roles": []})
+        entry["score"] = max(entry["score"], score)
+        if j.get("role") and _role_key(j["role"]) not in map(_role_key, entry["roles"]):
+            entry["roles"].append(j["role"])
+    todo = sorted(by_company.values(), key=lambda e: -e["score"])[:limit]
+    done = 0
+    with start_trace("companies.precompute", companies=len(todo)):
+        for entry in todo:
+            company = entry["company"]
+            with span("company", company=company, roles=len(entry["roles"])):
+                prefetch_company_intel(company)
+                company_brief(company, compute=True)
+                for role in entry["roles"][:2]:
+                    company_knowledge(company, f"intel:{_role_key(role)}",
+                                      lambda: call_claude(_company_intel_prompt(company, role), route="intel"))
+                    company_knowledge(company, f"why:{_role_key(role)}",
+                                      lambda: call_claude(_speed_kit_prompt(company, role), route="speed_kit"))
+            done += 1
+    print(f"[Companies] Precomputed knowledge for {done} companies")
+    return done
+
+
+def start_company_precompute(jobs):
+    """Run precompute_company_knowledge in a background thread (one run at a time)."""
+    if not _precompute_lock.acquire(blocking=False):
+        return False
+
+    def run():
+        try:
+            precompute_company_knowledge(jobs)
+        except Exception as e:
+            print(f"[Companies] Precompute error: {e}")
+        finally:
+            _precompute_lock.release()
+    threading.Thread(target=run, daemon=True).start()
+    return True
+
+
+@app.route("/api/companies", methods=["GET"])
+def list_company_knowledge():
+    """What the company knowledge store holds (fresh entries only)."""
+    rows = _local_db().execute("SELECT company_key, company, kind, fetched, expires FROM company_knowledge "
+                               "WHERE expires > ? ORDER BY company_key, kind", (time.time(),)).fetchall()
+    out = {}
+    for r in rows:
+        c = out.setdefault(r["company_key"], {"company": r["company"], "kinds": {}})
+        c["kinds"][r["kind"]] = {"fetched": datetime.datetime.fromtimestamp(r["fetched"]).isoformat(timespec="seconds"),
+                                 "expires": datetime.datetime.fromtimestamp(r["expires"]).isoformat(timespec="seconds")}
+    return jsonify({"companies": out, "precompute_running": _precompute_lock.locked()})
+
+
+@app.route("/api/companies/precompute", methods=["POST"])
+def company_precompute_route():
+    """Precompute company knowledge for every tracked job scored >= COMPANY_PRECOMPUTE_MIN_SCORE."""
+    sb = get_supabase()
+    if not sb:
+        return jsonify({"error": "Supabase not configured"}), 500
+    try:
+        jobs = [j for j in (sb.table("jobs").select("company,role,aiScore").execute().data or [])
+                if (j.get("aiScore") or 0) >= COMPANY_PRECOMPUTE_MIN_SCORE]
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    started = start_company_precompute(jobs)
+    return jsonify({"status": "started" if started else "already_running", "jobs": len(jobs)})
+
+
 @app.route("/api/interview/start", methods=["POST"])
 def interview_start():
     """Start an interactive interview session."""
@@ -956,13 +3279,13 @@ After each answer, evaluate their structured thinking.""",
 Transition naturally between types like a real interviewer.""",
     }
 
-    # Try to get company intel
-    company_intel = _scrape_company_intel(company)
-    intel_context = ""
-    if company_intel.get("glassdoor"):
-        intel_context = f"\nCompany interview intelligence (from web research):\n" + "\n".join(f"- {s}" for s in company_intel["glassdoor"][:3])
+    # Company intel: use it if cached, otherwise it is scraped in the background
+    # and merged into a later turn (see _interview_turn_prompt)
+    company_intel = prefetch_company_intel(company)
+    intel_context = _intel_context(company_intel)
 
-    session_id = f"session_{id(data)}_{__import__('time').time()}"
+    session_id = f"session_{secrets.token_urlsafe(16)}"
+    jd_block = f"JOB DESCRIPTION:\n{_trim_jd(jd, 250)}" if jd else ""
 
     system_prompt = f"""You are an expert AI interview coach conducting a realistic mock interview.
 You are interviewing a candidate for the role of **{role}** at **{company}**.
@@ -970,7 +3293,7 @@ You are interviewing a candidate for the role of **{role}** at **{company}**.
 CANDIDATE PROFILE:
 {candidate_info}
 
-{"JOB DESCRIPTION:\n" + jd[:1000] if jd else ""}
+{jd_block}
 {intel_context}
 
 INTERVIEW TYPE: {interview_type}
@@ -999,10 +3322,10 @@ RULES:
 Start the interview now. Welcome the candidate warmly, mention the role and company, and ask your first question.
 Keep the welcome to 2 sentences max, then ask the question."""
 
-    first_response = call_claude(first_msg_prompt)
+    first_response = call_claude(first_msg_prompt, route="interview_turn")
 
     # Store session
-    _interview_sessions[session_id] = {
+    _interview_store.put(session_id, {
         "system_prompt": system_prompt,
         "messages": [
             {"role": "assistant", "content": first_response}
@@ -1013,7 +3336,7 @@ Keep the welcome to 2 sentences max, then ask the question."""
         "scores": [],
         "started_at": __import__('time').time(),
         "company_intel": company_intel,
-    }
+    })
 
     return jsonify({
         "session_id": session_id,
@@ -1029,39 +3352,40 @@ def interview_respond():
     session_id = data.get("session_id", "")
     answer = data.get("answer", "").strip()
 
-    if not session_id or session_id not in _interview_sessions:
+    session = _interview_store.get(session_id) if session_id else None
+    if session is None:
         return jsonify({"error": "Invalid or expired session"}), 400
     if not answer:
         return jsonify({"error": "Please provide an answer"}), 400
 
-    session = _interview_sessions[session_id]
     session["messages"].append({"role": "user", "content": answer})
+    conversation = _interview_turn_prompt(session)
 
-    # Build conversation for Claude
-    conversation = session["system_prompt"] + "\n\n"
-    conversation += "CONVERSATION SO FAR:\n"
-    for msg in session["messages"]:
-        prefix = "INTERVIEWER" if msg["role"] == "assistant" else "CANDIDATE"
-        conversation += f"\n{prefix}: {msg['content']}\n"
-
-    conversation += "\nINTERVIEWER (now respond with score, feedback, and next question):"
+    def finish_turn(response):
+        session["messages"].append({"role": "assistant", "content": response})
 
-    response = call_claude(conversation)
-
-    session["messages"].append({"role": "assistant", "content": response})
+        # Extract score if present
+        import re
+        score_match = re.search(r'\*?\*?Score:\s*(\d+)/10', response)
+        if score_match:
+            session["scores"].append(int(score_match.group(1)))
+            answer_no = sum(1 for m in session["messages"] if m["role"] == "user")
+            session.setdefault("score_table", []).append([answer_no, int(score_match.group(1))])
+        _interview_store.put(session_id, session)
+
+        return {
+            "message": response,
+            "question_count": sum(1 for m in session["messages"] if m["role"] == "assistant"),
+            "answer_count": sum(1 for m in session["messages"] if m["role"] == "user"),
+            "avg_score": round(sum(session["scores"]) / len(session["scores"]), 1) if session["scores"] else None,
+        }
 
-    # Extract score if present
-    import re
-    score_match = re.search(r'\*?\*?Score:\s*(\d+)/10', response)
-    if score_match:
-        session["scores"].append(int(score_match.group(1)))
+    if _wants_stream(data):
+        return _sse_llm_response(call_claude(conversation, route="interview_turn", stream=True),
+                                 finish_turn)
 
-    return jsonify({
-        "message": response,
-        "question_count": sum(1 for m in session["messages"] if m["role"] == "assistant"),
-        "answer_count": sum(1 for m in session["messages"] if m["role"] == "user"),
-        "avg_score": round(sum(session["scores"]) / len(session["scores"]), 1) if session["scores"] else None,
-    })
+    response = call_claude(conversation, route="interview_turn")
+    return jsonify(finish_turn(response))
 
 
 @app.route("/api/interview/end", methods=["POST"])
@@ -1070,11 +3394,10 @@ def interview_end():
     data = request.json or {}
     session_id = data.get("session_id", "")
 
-    if not session_id or session_id not in _interview_sessions:
+    session = _interview_store.get(session_id) if session_id else None
+    if session is None:
         return jsonify({"error": "Invalid or expired session"}), 400
 
-    session = _interview_sessions[session_id]
-
     # Build full transcript
     transcript = ""
     for msg in session["messages"]:
@@ -1112,7 +3435,7 @@ Take their weakest answer and rewrite it as an ideal response.
 
 Be specific, reference their actual answers, and be constructive."""
 
-    summary = call_claude(summary_prompt)
+    summary = call_claude(summary_prompt, route="interview_summary")
 
     # Clean up session
     result = {
@@ -1124,7 +3447,7 @@ Be specific, reference their actual answers, and be constructive."""
         "duration_seconds": int(__import__('time').time() - session["started_at"]),
     }
 
-    del _interview_sessions[session_id]
+    _interview_store.delete(session_id)
     return jsonify(result)
 
 
@@ -1138,10 +3461,21 @@ def interview_company_intel():
     if not company:
         return jsonify({"error": "Company name required"}), 400
 
-    intel = _scrape_company_intel(company)
+    prefetch_company_intel(company)     # scrape in the background while the LLM answers
+
+    # Also ask AI for company-specific insights (precomputed for high-scoring jobs)
+    ai_intel = company_knowledge(company, f"intel:{_role_key(role)}",
+                                 lambda: call_claude(_company_intel_prompt(company, role), route="intel"))
+    intel = get_company_intel(company)
+
+    return jsonify({
+        "ai_intel": ai_intel,
+        "web_snippets": intel.get("glassdoor", []),
+    })
+
 
-    # Also ask AI for company-specific insights
-    prompt = f"""Provide interview intelligence for {role or 'a candidate'} interviewing at {company}:
+def _company_intel_prompt(company, role):
+    return f"""Provide interview intelligence for {role or 'a candidate'} interviewing at {company}:
 
 ## Company Overview
 Brief company description, culture, and values (2-3 sentences).
@@ -1163,13 +3497,6 @@ What {company} looks for in candidates — culture signals to demonstrate.
 
 Be specific to {company}. If you don't have specific info, provide educated guidance based on the company's industry and size."""
 
-    ai_intel = call_claude(prompt)
-
-    return jsonify({
-        "ai_intel": ai_intel,
-        "web_snippets": intel.get("glassdoor", []),
-    })
-
 
 @app.route("/api/full-kit", methods=["POST"])
 def full_kit():
@@ -1181,20 +3508,17 @@ def full_kit():
     ai_role = is_ai_role(jd, role_type)
 
     P = get_active_profile()
-    framing = build_product_framing(P)
-    profile_str = json.dumps({k: v for k, v in P.items()}, indent=2)
-    proj_url = P.get('aiProjectUrl', '')
 
-    resume_prompt = f"Write ATS-optimised resume for {P['name']} applying to {role} at {company} ({role_type}). {framing} Profile: {profile_str}. JD: {jd}. {'AI role: feature project ' + proj_url + ' prominently.' if ai_role else ''} ATS rules: mirror exact JD keywords, use standard section headers (Professional Summary, Core Skills, Professional Experience, Education), include metrics in every bullet, single-column format, no tables."
-    cover_prompt = f"Write 300-word cover letter for {P['name']} for {role} at {company}. Profile: {profile_str}. {'Mention project: ' + proj_url if ai_role else ''} Mirror key phrases from JD: {jd[:500]}. Product language, no consulting jargon. Reference company name and role at least twice."
-    prep_prompt = f"Give top 5 interview questions for {role_type} at {company} with brief model answers for {P['name']}. Profile summary: {P.get('summary','')}. JD context: {jd[:500]}. Include STAR-format answers with real metrics."
+    resume_prompt = build_prompt("resume", P, **resume_prompt_fields(f"{role} ({role_type})", _trim_jd(jd, 1500), None, ai_role, P))
+    cover_prompt = build_prompt("cover_letter", P, **cover_letter_prompt_fields(role, company, _trim_jd(jd, 750), ai_role, P))
+    prep_prompt = f"Give top 5 interview questions for {role_type} at {company} with brief model answers for {P['name']}. Profile summary: {P.get('summary','')}. JD context: {_trim_jd(jd, 125)}. Include STAR-format answers with real metrics."
 
     import concurrent.futures
     with concurrent.futures.ThreadPoolExecutor() as executor:
-        r_future = executor.submit(call_claude, resume_prompt)
-        c_future = executor.submit(call_claude, cover_prompt)
-        p_future = executor.submit(call_claude, prep_prompt)
-        resume = r_future.result()
+        r_future = executor.submit(call_claude, resume_prompt, 8192, route="resume")
+        c_future = executor.submit(call_claude, cover_prompt, 1024, route="cover")
+        p_future = executor.submit(call_claude, prep_prompt, route="interview_prep")
+        resume = _inject_ai_projects(r_future.result())
         cover = c_future.result()
         prep = p_future.result()
 
@@ -1211,28 +3535,34 @@ def follow_up():
 Include: subject line, brief message referencing the role, continued interest, offer to provide more info.
 Under 80 words. Ready to copy-paste. Professional and confident."""
 
-    result = call_claude(prompt)
+    result = call_claude(prompt, route="followup")
     return jsonify({"result": result})
 
 @app.route("/api/speed-kit", methods=["POST"])
 def speed_kit():
     data = request.json
-    company = data.get("company", "this company")
+    company = (data.get("company") or "").strip()
     role = data.get("role", "this role")
 
-    prompt = f"""Write a genuine 3-sentence "Why do you want to work at {company}?" answer for Amretha Karthikeyan, a SAFe 6.0 PO/Lead BA transitioning from KPMG to an in-house {role} role. Be specific to {company}'s product/market. Sound like a product person who wants to build. No consulting language."""
-
-    result = call_claude(prompt)
+    if not company:     # a generic answer must not be stored under some company's key
+        result = call_claude(_speed_kit_prompt("this company", role), route="speed_kit")
+    else:
+        result = company_knowledge(company, f"why:{_role_key(role)}",
+                                   lambda: call_claude(_speed_kit_prompt(company, role), route="speed_kit"))
     return jsonify({"result": result})
 
 
+def _speed_kit_prompt(company, role):
+    return f"""Write a genuine 3-sentence "Why do you want to work at {company}?" answer for Amretha Karthikeyan, a SAFe 6.0 PO/Lead BA transitioning from KPMG to an in-house {role} role. Be specific to {company}'s product/market. Sound like a product person who wants to build. No consulting language."""
+
+
 @app.route("/api/generic", methods=["POST"])
 def generic():
     data = request.json
     prompt = data.get("prompt", "")
     system = data.get("systemPrompt", "")
     full_prompt = f"{system}\n\n{prompt}" if system else prompt
-    result = call_claude(full_prompt)
+    result = call_claude(full_prompt, route="generic")
     return jsonify({"result": result})
 
 
@@ -1256,7 +3586,9 @@ def health_check():
         "supabase_key_prefix": (SUPABASE_KEY[:20] + "...") if SUPABASE_KEY else "empty",
         "supabase_status": sb_status,
         "supabase_error": _supabase_error,
-        "supabase_url_preview": (SUPABASE_URL[:40] + "...") if SUPABASE_URL else "empty"
+        "supabase_url_preview": (SUPABASE_URL[:40] + "...") if SUPABASE_URL else "empty",
+        "circuits": circuit_states(),
+        "linkedin_session": _linkedin.snapshot(),
     })
 
 
@@ -1273,6 +3605,45 @@ def get_jobs():
         return jsonify({"error": str(e), "jobs": []}), 200
 
 
+def _job_row(j):
+    """Whitelist of job fields persisted to Supabase."""
+    row = {
+        "id":               str(j.get("id", "")),
+        "role":             j.get("role", ""),
+        "company":          j.get("company", ""),
+        "status":           j.get("status", "saved"),
+        "url":              j.get("url", ""),
+        "linkedInId":       j.get("linkedInId", ""),
+        "jd":               (j.get("jd") or "")[:8000],
+        "roleType":         j.get("roleType", ""),
+        "source":           j.get("source", ""),
+        "salary":           j.get("salary", ""),
+        "location":         j.get("location", ""),
+        "dateApplied":      j.get("dateApplied", ""),
+        "datePosted":       j.get("datePosted", ""),
+        "companyLogo":      j.get("companyLogo", ""),
+        "aiScore":          float(j["aiScore"]) if j.get("aiScore") is not None else None,
+        "aiLabel":          j.get("aiLabel", ""),
+        "aiReason":         j.get("aiReason", ""),
+        "aiPriority":       j.get("aiPriority", ""),
+        "matchedKeywords":  j.get("matchedKeywords") or [],
+        "jdOnlyKeywords":   j.get("jdOnlyKeywords") or [],
+        "notes":            j.get("notes", ""),
+        "checklist":        j.get("checklist") or {},
+        "resume_variant":   j.get("resume_variant", ""),
+        "resume_filename":  j.get("resume_filename", ""),
+        "cover_filename":   j.get("cover_filename", ""),
+        "resume_generated_at": j.get("resume_generated_at", ""),
+    }
+    # Only include large binary fields if explicitly present & non-empty
+    # Prevents lightweight sync from clearing existing docs
+    if j.get("resume_docx_b64"):
+        row["resume_docx_b64"] = j["resume_docx_b64"][:500000]
+    if j.get("cover_docx_b64"):
+        row["cover_docx_b64"] = j["cover_docx_b64"][:500000]
+    return row
+
+
 @app.route("/api/jobs/upsert", methods=["POST"])
 def upsert_jobs():
     """Save/update jobs to Supabase. Upserts by job id."""
@@ -1284,46 +3655,7 @@ def upsert_jobs():
     if not jobs:
         return jsonify({"ok": True, "count": 0})
     try:
-        # Whitelist fields we want to persist
-        # Only include resume/cover docx if they're actually sent (to avoid
-        # overwriting existing docs when the frontend syncs lightweight payloads)
-        def clean(j):
-            row = {
-                "id":               str(j.get("id", "")),
-                "role":             j.get("role", ""),
-                "company":          j.get("company", ""),
-                "status":           j.get("status", "saved"),
-                "url":              j.get("url", ""),
-                "linkedInId":       j.get("linkedInId", ""),
-                "jd":               (j.get("jd") or "")[:8000],
-                "roleType":         j.get("roleType", ""),
-                "source":           j.get("source", ""),
-                "salary":           j.get("salary", ""),
-                "location":         j.get("location", ""),
-                "dateApplied":      j.get("dateApplied", ""),
-                "datePosted":       j.get("datePosted", ""),
-                "companyLogo":      j.get("companyLogo", ""),
-                "aiScore":          float(j["aiScore"]) if j.get("aiScore") is not None else None,
-                "aiLabel":          j.get("aiLabel", ""),
-                "aiReason":         j.get("aiReason", ""),
-                "aiPriority":       j.get("aiPriority", ""),
-                "matchedKeywords":  j.get("matchedKeywords") or [],
-                "jdOnlyKeywords":   j.get("jdOnlyKeywords") or [],
-                "notes":            j.get("notes", ""),
-                "checklist":        j.get("checklist") or {},
-                "resume_variant":   j.get("resume_variant", ""),
-                "resume_filename":  j.get("resume_filename", ""),
-                "cover_filename":   j.get("cover_filename", ""),
-                "resume_generated_at": j.get("resume_generated_at", ""),
-            }
-            # Only include large binary fields if explicitly present & non-empty
-            # Prevents lightweight sync from clearing existing docs
-            if j.get("resume_docx_b64"):
-                row["resume_docx_b64"] = j["resume_docx_b64"][:500000]
-            if j.get("cover_docx_b64"):
-                row["cover_docx_b64"] = j["cover_docx_b64"][:500000]
-            return row
-        cleaned = [clean(j) for j in jobs if j.get("id")]
+        cleaned = [_job_row(j) for j in jobs if j.get("id")]
         # Batch upsert for reliability
         BATCH = 30
         total = 0
@@ -1367,9 +3699,10 @@ def clear_all_jobs():
         return jsonify({"error": str(e)}), 500
 
 
-def _create_docx_from_text(text, title="Document"):
+def _parse_resume_blocks(text):
     """
-    Render AI-generated resume text into a formatted .docx matching Amretha CV style.
+    Classify AI-generated resume / cover letter text into layout blocks once,
+    so every output format (docx, pdf, html, md) renders the same structure.
     Rules:
       - First non-empty line = candidate name (large, centered, bold)
       - Lines 2-5 with contact info = centered, bold
@@ -1380,18 +3713,10 @@ def _create_docx_from_text(text, title="Document"):
       - Education body text = not bold
       - Bullet lines starting with "- " = proper list bullets
       - Everything else = normal body text
+    Returns a list of {"kind": ..., "text": ...} dicts ("skill" blocks also carry
+    "label" and "value").
     """
-    from docx import Document as DocxDocument
-    from docx.shared import Pt, Inches
-    from docx.enum.text import WD_ALIGN_PARAGRAPH
-    from docx.oxml.ns import qn
-    from docx.oxml import OxmlElement
-    import io, re
-
-    FONT        = 'Times New Roman'
-    BODY_SIZE   = Pt(11)
-    HDR_SIZE    = Pt(12)
-    NAME_SIZE   = Pt(16)
+    import re
 
     SECTION_HEADERS = {
         'PROFESSIONAL SUMMARY','SUMMARY','CORE SKILLS','SKILL SET','SKILLS',
@@ -1415,48 +3740,11 @@ def _create_docx_from_text(text, title="Document"):
         'associate','intern','officer','specialist','coordinator','head',
         'senior','junior','internship','product','digital',
     ]
-
-    def add_border(p):
-        pPr = p._p.get_or_add_pPr()
-        pBdr = OxmlElement('w:pBdr')
-        bot  = OxmlElement('w:bottom')
-        bot.set(qn('w:val'),   'single')
-        bot.set(qn('w:sz'),    '6')
-        bot.set(qn('w:space'), '1')
-        bot.set(qn('w:color'), '000000')
-        pBdr.append(bot)
-        pPr.append(pBdr)
-
-    def rf(run, size=None, bold=False):
-        run.font.name = FONT
-        run.font.size = size or BODY_SIZE
-        run.bold      = bold
-
-    def plain_para(doc, text_str, bold=False, before=0, after=3):
-        p   = doc.add_paragraph()
-        run = p.add_run(text_str)
-        rf(run, bold=bold)
-        p.paragraph_format.space_before = Pt(before)
-        p.paragraph_format.space_after  = Pt(after)
-        return p
+    CONTACT_MARKERS = ['@','Mobile','+65','linkedin','http','|','#0','Road','Street','Avenue']
 
     def clean_title(s):
         return re.sub(r'^[\s/\-–|]+|[\s/\-–|]+$', '', s).strip()
 
-    doc = DocxDocument()
-    doc.styles['Normal'].font.name = FONT
-    doc.styles['Normal'].font.size = BODY_SIZE
-    for sec in doc.sections:
-        sec.top_margin    = Inches(0.6)
-        sec.bottom_margin = Inches(0.6)
-        sec.left_margin   = Inches(0.75)
-        sec.right_margin  = Inches(0.75)
-    try:
-        doc.styles['List Bullet'].font.name = FONT
-        doc.styles['List Bullet'].font.size = BODY_SIZE
-    except Exception:
-        pass
-
     lines        = [l for l in text.split('\n')]
 
     # ── HARD TRUNCATE after education section ─────────────────────────────
@@ -1474,23 +3762,20 @@ def _create_docx_from_text(text, title="Document"):
     if last_cert_line > 0:
         lines = lines[:last_cert_line + 1]
 
+    blocks       = []
+    header_count = 0      # name + contact lines emitted so far
     name_written = False
     contact_done = False
     in_exp       = False
     in_edu       = False
-    in_skills    = False
-    line_num     = 0
 
     for raw in lines:
         stripped = raw.strip()
-        line_num += 1
 
         # blank line → small spacer
         if not stripped:
             if name_written:
-                p = doc.add_paragraph()
-                p.paragraph_format.space_after  = Pt(0)
-                p.paragraph_format.space_before = Pt(0)
+                blocks.append({"kind": "spacer", "text": ""})
             continue
 
         upper = stripped.upper().rstrip(':')
@@ -1508,46 +3793,20 @@ def _create_docx_from_text(text, title="Document"):
             if stripped.upper() in ('HEADER', '[HEADER]', '**HEADER**'):
                 continue
             name_written = True
-            p   = doc.add_paragraph()
-            p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-            run = p.add_run(stripped.upper())
-            rf(run, size=NAME_SIZE, bold=True)
-            p.paragraph_format.space_after = Pt(3)
+            header_count += 1
+            blocks.append({"kind": "name", "text": stripped.upper()})
             continue
 
         # ── CONTACT / HEADLINE (first 6 non-blank lines after name) ──────
         if not contact_done:
-            non_blank = [p for p in doc.paragraphs if p.text.strip()]
-            if len(non_blank) <= 5:
-                is_contact_line = any(k in stripped for k in
-                    ['@','Mobile','+65','linkedin','http','|','#0','Road','Street','Avenue'])
-                is_headline     = ('|' in stripped or stripped.endswith('Excellence') or stripped.endswith('Owner')) and not stripped.lower().startswith('dear')
-                if is_contact_line or is_headline:
-                    p   = doc.add_paragraph()
-                    p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                    run = p.add_run(stripped)
-                    rf(run, bold=True)
-                    p.paragraph_format.space_after = Pt(2)
-                    continue
-                else:
-                    contact_done = True
-            else:
-                contact_done = True
-            if len(non_blank) <= 5:
-                is_contact_line = any(k in stripped for k in
-                    ['@','Mobile','+65','linkedin','http','|','#0','Road','Street','Avenue'])
+            if header_count <= 5:
+                is_contact_line = any(k in stripped for k in CONTACT_MARKERS)
                 is_headline     = ('|' in stripped or stripped.endswith('Excellence') or stripped.endswith('Manager') or stripped.endswith('Owner')) and not stripped.lower().startswith('dear')
                 if is_contact_line or is_headline:
-                    p   = doc.add_paragraph()
-                    p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                    run = p.add_run(stripped)
-                    rf(run, bold=True)
-                    p.paragraph_format.space_after = Pt(2)
+                    header_count += 1
+                    blocks.append({"kind": "contact", "text": stripped})
                     continue
-                else:
-                    contact_done = True
-            else:
-                contact_done = True
+            contact_done = True
 
         # ── SECTION HEADERS ──────────────────────────────────────────────
         is_section = (upper in SECTION_HEADERS or
@@ -1557,22 +3816,12 @@ def _create_docx_from_text(text, title="Document"):
         if is_section:
             in_exp    = 'EXPERIENCE' in upper
             in_edu    = upper in EDUCATION_SECTIONS
-            in_skills = 'SKILL' in upper or upper in ('CORE SKILLS',)
-            p   = doc.add_paragraph()
-            run = p.add_run(stripped.upper().rstrip(':') + ':')
-            rf(run, size=HDR_SIZE, bold=True)
-            add_border(p)
-            p.paragraph_format.space_before = Pt(8)
-            p.paragraph_format.space_after  = Pt(4)
+            blocks.append({"kind": "section", "text": stripped.upper().rstrip(':') + ':'})
             continue
 
         # ── BULLET POINTS ────────────────────────────────────────────────
         if stripped.startswith(('- ','* ','– ','• ')):
-            content = stripped[2:].strip()
-            p   = doc.add_paragraph(style='List Bullet')
-            run = p.add_run(content)
-            rf(run)
-            p.paragraph_format.space_after = Pt(2)
+            blocks.append({"kind": "bullet", "text": stripped[2:].strip()})
             continue
 
         # ── SKILL CATEGORY LINES  e.g. "Data visualization tools: Tableau, Power BI"
@@ -1582,51 +3831,649 @@ def _create_docx_from_text(text, title="Document"):
                 skill_match = cat; break
         if skill_match:
             colon = stripped.index(':')
+            blocks.append({"kind": "skill", "text": stripped,
+                           "label": stripped[:colon+1], "value": stripped[colon+1:]})
+            continue
+
+        # ── COMPANY + DATE LINE ──────────────────────────────────────────
+        is_co_date = bool(re.search(
+            r'(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec|\d{4}).{0,40}(\d{4}|Present)',
+            stripped, re.I))
+
+        # ── JOB TITLE LINE (bold plain, no bullet) ───────────────────────
+        # Must be in experience block, no year, starts with capital or slash,
+        # contains a recognisable role keyword, NOT a bullet
+        is_job_title = (
+            in_exp and
+            not is_co_date and
+            not stripped.startswith('-') and
+            len(stripped) < 100 and
+            re.match(r'^[A-Z/\-–]', stripped) and
+            any(kw in stripped.lower() for kw in JOB_TITLE_KW) and
+            not stripped.upper().rstrip(':') in SECTION_HEADERS
+        )
+
+        if is_co_date:
+            blocks.append({"kind": "co_date", "text": stripped})
+            continue
+
+        if is_job_title:
+            blocks.append({"kind": "job_title", "text": clean_title(stripped)})
+            continue
+
+        # ── EDUCATION BODY TEXT (not bold) / DEFAULT BODY TEXT ───────────
+        blocks.append({"kind": "edu" if in_edu else "body", "text": stripped})
+
+    return blocks
+
+
+def _create_docx_from_text(text, title="Document", blocks=None):
+    """
+    Render AI-generated resume text into a formatted .docx matching Amretha CV style.
+    Layout rules live in _parse_resume_blocks(); pass pre-parsed `blocks` to skip
+    re-parsing when rendering several formats from the same text.
+    """
+    from docx import Document as DocxDocument
+    from docx.shared import Pt, Inches
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    from docx.oxml.ns import qn
+    from docx.oxml import OxmlElement
+    import io
+
+    FONT        = 'Times New Roman'
+    BODY_SIZE   = Pt(11)
+    HDR_SIZE    = Pt(12)
+    NAME_SIZE   = Pt(16)
+
+    if blocks is None:
+        blocks = _parse_resume_blocks(text)
+
+    def add_border(p):
+        pPr = p._p.get_or_add_pPr()
+        pBdr = OxmlElement('w:pBdr')
+        bot  = OxmlElement('w:bottom')
+        bot.set(qn('w:val'),   'single')
+        bot.set(qn('w:sz'),    '6')
+        bot.set(qn('w:space'), '1')
+        bot.set(qn('w:color'), '000000')
+        pBdr.append(bot)
+        pPr.append(pBdr)
+
+    def rf(run, size=None, bold=False):
+        run.font.name = FONT
+        run.font.size = size or BODY_SIZE
+        run.bold      = bold
+
+    def plain_para(doc, text_str, bold=False, before=0, after=3):
+        p   = doc.add_paragraph()
+        run = p.add_run(text_str)
+        rf(run, bold=bold)
+        p.paragraph_format.space_before = Pt(before)
+        p.paragraph_format.space_after  = Pt(after)
+        return p
+
+    doc = DocxDocument()
+    doc.styles['Normal'].font.name = FONT
+    doc.styles['Normal'].font.size = BODY_SIZE
+    for sec in doc.sections:
+        sec.top_margin    = Inches(0.6)
+        sec.bottom_margin = Inches(0.6)
+        sec.left_margin   = Inches(0.75)
+        sec.right_margin  = Inches(0.75)
+    try:
+        doc.styles['List Bullet'].font.name = FONT
+        doc.styles['List Bullet'].font.size = BODY_SIZE
+    except Exception:
+        pass
+
+    for b in blocks:
+        kind = b["kind"]
+        if kind == "spacer":
+            p = doc.add_paragraph()
+            p.paragraph_format.space_after  = Pt(0)
+            p.paragraph_format.space_before = Pt(0)
+        elif kind == "name":
+            p   = doc.add_paragraph()
+            p.alignment = WD_ALIGN_PARAGRAPH.CENTER
+            run = p.add_run(b["text"])
+            rf(run, size=NAME_SIZE, bold=True)
+            p.paragraph_format.space_after = Pt(3)
+        elif kind == "contact":
+            p   = doc.add_paragraph()
+            p.alignment = WD_ALIGN_PARAGRAPH.CENTER
+            run = p.add_run(b["text"])
+            rf(run, bold=True)
+            p.paragraph_format.space_after = Pt(2)
+        elif kind == "section":
+            p   = doc.add_paragraph()
+            run = p.add_run(b["text"])
+            rf(run, size=HDR_SIZE, bold=True)
+            add_border(p)
+            p.paragraph_format.space_before = Pt(8)
+            p.paragraph_format.space_after  = Pt(4)
+        elif kind == "bullet":
+            p   = doc.add_paragraph(style='List Bullet')
+            run = p.add_run(b["text"])
+            rf(run)
+            p.paragraph_format.space_after = Pt(2)
+        elif kind == "skill":
             p   = doc.add_paragraph()
-            r1  = p.add_run(stripped[:colon+1])
+            r1  = p.add_run(b["label"])
             rf(r1, bold=True)
-            r2  = p.add_run(stripped[colon+1:])
+            r2  = p.add_run(b["value"])
             rf(r2, bold=False)
             p.paragraph_format.space_after = Pt(2)
+        elif kind == "co_date":
+            plain_para(doc, b["text"], bold=True, before=5, after=1)
+        elif kind == "job_title":
+            plain_para(doc, b["text"], bold=True, before=0, after=1)
+        else:  # "edu" / "body"
+            plain_para(doc, b["text"], bold=False, before=0, after=3)
+
+    buf = io.BytesIO()
+    doc.save(buf)
+    return buf.getvalue()
+
+
+# ═══════════════════════════════════════════════════════════════
+# MULTI-FORMAT EXPORT — docx / pdf / html / md from one parse
+# ═══════════════════════════════════════════════════════════════
+# Every generated document is parsed once by _parse_resume_blocks() and
+# rendered to all formats in the same pass. Renditions are cached on disk
+# under DOC_CACHE_DIR/<doc_key>/<kind>.<fmt> (doc_key = job id when known)
+# and served by /api/docs/<doc_key>/<kind>.<fmt>.
+# PDF uses local LibreOffice headless when installed (best fidelity),
+# otherwise a small built-in PDF writer — never an external service.
+
+import shutil
+
+DOC_CACHE_DIR    = os.environ.get("DOC_CACHE_DIR", os.path.join(BASE_DIR, "doc_cache"))
+DOC_PDF_ENGINE   = os.environ.get("DOC_PDF_ENGINE", "auto")   # auto | libreoffice | builtin
+DOC_FORMATS      = ("docx", "pdf", "html", "md")
+DOC_KINDS        = ("resume", "cover")
+DOC_MIMETYPES    = {
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "pdf":  "application/pdf",
+    "html": "text/html; charset=utf-8",
+    "md":   "text/markdown; charset=utf-8",
+}
+
+# Times-Roman advance widths (1/1000 em) for printable ASCII, from the
+# standard Adobe AFM metrics. Used for line wrapping in the built-in PDF writer.
+_TIMES_WIDTHS = [
+    250, 333, 408, 500, 500, 833, 778, 333, 333, 333, 500, 564, 250, 333, 250, 278,
+    500, 500, 500, 500, 500, 500, 500, 500, 500, 500, 278, 278, 564, 564, 564, 444,
+    921, 722, 667, 667, 722, 611, 556, 722, 722, 333, 389, 722, 611, 889, 722, 722,
+    556, 722, 667, 556, 611, 722, 722, 944, 722, 722, 611, 333, 278, 333, 469, 500,
+    333, 444, 500, 444, 500, 444, 333, 500, 500, 278, 278, 500, 278, 778, 500, 500,
+    500, 500, 333, 389, 278, 500, 500, 722, 500, 500, 444, 480, 200, 480, 541,
+]
+
+
+def _doc_key_for(job_id=None, text=""):
+    """Cache key for a document set — the job id when known, else a content hash.
+    Ids that would name a parent directory ("..", "a..b") are hashed instead."""
+    if job_id:
+        key = re.sub(r"[^A-Za-z0-9_.-]", "_", str(job_id))[:80]
+        if key.strip(".") and ".." not in key:
+            return key
+        text = str(job_id)
+    return "h_" + hashlib.sha1((text or "").encode("utf-8")).hexdigest()[:16]
+
+
+def _render_html_from_blocks(blocks, title="Document"):
+    """Standalone HTML rendition (inline CSS, Times, same hierarchy as the .docx)."""
+    import html as _html
+    esc = _html.escape
+    body = []
+    in_list = False
+    for b in blocks:
+        kind = b["kind"]
+        if kind == "bullet":
+            if not in_list:
+                body.append("<ul>")
+                in_list = True
+            body.append(f"<li>{esc(b['text'])}</li>")
             continue
+        if in_list:
+            body.append("</ul>")
+            in_list = False
+        if kind == "spacer":
+            body.append('<div class="sp"></div>')
+        elif kind == "name":
+            body.append(f"<h1>{esc(b['text'])}</h1>")
+        elif kind == "contact":
+            body.append(f'<p class="contact">{esc(b["text"])}</p>')
+        elif kind == "section":
+            body.append(f"<h2>{esc(b['text'])}</h2>")
+        elif kind == "skill":
+            body.append(f"<p><strong>{esc(b['label'])}</strong>{esc(b['value'])}</p>")
+        elif kind == "co_date":
+            body.append(f'<p class="co">{esc(b["text"])}</p>')
+        elif kind == "job_title":
+            body.append(f'<p class="jt">{esc(b["text"])}</p>')
+        else:
+            body.append(f"<p>{esc(b['text'])}</p>")
+    if in_list:
+        body.append("</ul>")
+    return f"""<!DOCTYPE html>
+<html><head>
+<meta charset="UTF-8">
+<title>{esc(title)}</title>
+<style>
+  body {{ font-family: 'Times New Roman', Times, serif; font-size: 11pt; max-width: 7in; margin: 0.6in auto; color: #000; }}
+  h1 {{ font-size: 16pt; text-align: center; margin: 0 0 3pt; }}
+  h2 {{ font-size: 12pt; border-bottom: 1px solid #000; margin: 8pt 0 4pt; }}
+  p {{ margin: 0 0 3pt; }}
+  .contact {{ text-align: center; font-weight: bold; margin-bottom: 2pt; }}
+  .co {{ font-weight: bold; margin: 5pt 0 1pt; }}
+  .jt {{ font-weight: bold; margin-bottom: 1pt; }}
+  .sp {{ height: 6pt; }}
+  ul {{ margin: 0 0 2pt; padding-left: 18pt; }}
+  li {{ margin-bottom: 2pt; }}
+</style>
+</head><body>
+{chr(10).join(body)}
+</body></html>"""
 
-        # ── COMPANY + DATE LINE ──────────────────────────────────────────
-        is_co_date = bool(re.search(
-            r'(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec|\d{4}).{0,40}(\d{4}|Present)',
-            stripped, re.I))
 
-        # ── JOB TITLE LINE (bold plain, no bullet) ───────────────────────
-        # Must be in experience block, no year, starts with capital or slash,
-        # contains a recognisable role keyword, NOT a bullet
-        is_job_title = (
-            in_exp and
-            not is_co_date and
-            not stripped.startswith('-') and
-            len(stripped) < 100 and
-            re.match(r'^[A-Z/\-–]', stripped) and
-            any(kw in stripped.lower() for kw in JOB_TITLE_KW) and
-            not stripped.upper().rstrip(':') in SECTION_HEADERS
+def _render_markdown_from_blocks(blocks):
+    """Markdown rendition — handy for previews and pasting into ATS text boxes."""
+    out = []
+    for b in blocks:
+        kind = b["kind"]
+        if kind == "spacer":
+            if out and out[-1] != "":
+                out.append("")
+        elif kind == "name":
+            out.append(f"# {b['text']}")
+        elif kind == "contact":
+            out.append(f"{b['text']}  ")
+        elif kind == "section":
+            if out and out[-1] != "":
+                out.append("")
+            out.extend([f"## {b['text'].rstrip(':')}", ""])
+        elif kind == "bullet":
+            out.append(f"- {b['text']}")
+        elif kind == "skill":
+            out.append(f"**{b['label']}**{b['value']}  ")
+        elif kind in ("co_date", "job_title"):
+            out.append(f"**{b['text']}**  ")
+        else:
+            out.append(f"{b['text']}  ")
+    return "\n".join(out).strip() + "\n"
+
+
+def _render_pdf_builtin(blocks, title="Document"):
+    """
+    Minimal pure-Python PDF writer (US Letter, Times-Roman / Times-Bold base-14
+    fonts, WinAnsi encoding). Mirrors the .docx layout: centered name/contact,
+    ruled section headers, hanging-indent bullets. No embedding, no images.
+    """
+    PAGE_W, PAGE_H = 612.0, 792.0
+    LEFT, RIGHT    = 54.0, 54.0           # 0.75in
+    TOP, BOTTOM    = 43.2, 43.2           # 0.6in
+    WIDTH          = PAGE_W - LEFT - RIGHT
+
+    def text_width(s, size, bold=False):
+        w = 0
+        for ch in s:
+            o = ord(ch)
+            w += _TIMES_WIDTHS[o - 32] if 32 <= o <= 126 else 500
+        return w * size / 1000.0 * (1.04 if bold else 1.0)
+
+    def wrap(s, size, width, bold=False):
+        words, lines, cur = s.split(), [], ""
+        for w in words:
+            cand = f"{cur} {w}" if cur else w
+            if cur and text_width(cand, size, bold) > width:
+                lines.append(cur)
+                cur = w
+            else:
+                cur = cand
+        if cur:
+            lines.append(cur)
+        return lines or [""]
+
+    def pdf_str(s):
+        raw = s.encode("cp1252", errors="replace")
+        return raw.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+    pages, ops = [], []
+    y = PAGE_H - TOP
+
+    def new_page():
+        nonlocal ops, y
+        if ops:
+            pages.append(ops)
+        ops = []
+        y = PAGE_H - TOP
+
+    def ensure(h):
+        if y - h < BOTTOM:
+            new_page()
+
+    def draw(x, size, s, bold=False):
+        font = b"/F2" if bold else b"/F1"
+        ops.append(b"BT " + font + b" %.1f Tf %.2f %.2f Td (" % (size, x, y) + pdf_str(s) + b") Tj ET")
+
+    def para(segments, size=11.0, bold=False, center=False, before=0.0, after=3.0, indent=0.0, bullet=False):
+        nonlocal y
+        leading = size * 1.18
+        text = "".join(s for s, _ in segments) if isinstance(segments, list) else segments
+        lines = wrap(text, size, WIDTH - indent, bold)
+        y -= before
+        for i, ln in enumerate(lines):
+            ensure(leading)
+            y -= size
+            if center:
+                x = LEFT + (WIDTH - text_width(ln, size, bold)) / 2
+            else:
+                x = LEFT + indent
+            if bullet and i == 0:
+                draw(LEFT + indent - 10, size, "\u2022")   # WinAnsi 0x95
+            if isinstance(segments, list) and i == 0 and segments[0][1]:
+                # bold label + regular value on the first line (skill rows)
+                label = segments[0][0]
+                if ln.startswith(label):
+                    draw(x, size, label, bold=True)
+                    draw(x + text_width(label, size, True), size, ln[len(label):])
+                else:
+                    draw(x, size, ln, bold=True)
+            else:
+                draw(x, size, ln, bold=bold)
+            y -= leading - size
+        y -= after
+
+    for b in blocks:
+        kind = b["kind"]
+        if kind == "spacer":
+            y -= 4
+        elif kind == "name":
+            para(b["text"], size=16, bold=True, center=True, after=3)
+        elif kind == "contact":
+            para(b["text"], bold=True, center=True, after=2)
+        elif kind == "section":
+            ensure(30)
+            para(b["text"], size=12, bold=True, before=8, after=0)
+            ops.append(b"0.5 w %.2f %.2f m %.2f %.2f l S" % (LEFT, y - 1, PAGE_W - RIGHT, y - 1))
+            y -= 5
+        elif kind == "bullet":
+            para(b["text"], indent=18, after=2, bullet=True)
+        elif kind == "skill":
+            para([(b["label"], True), (b["value"], False)], after=2)
+        elif kind == "co_date":
+            para(b["text"], bold=True, before=5, after=1)
+        elif kind == "job_title":
+            para(b["text"], bold=True, after=1)
+        else:
+            para(b["text"], after=3)
+    if ops or not pages:
+        pages.append(ops)
+
+    # ── Assemble objects ──
+    objs = []   # index i → object number i+1
+    def add(obj_bytes):
+        objs.append(obj_bytes)
+        return len(objs)
+
+    catalog_id = add(b"")   # placeholder, filled below
+    pages_id   = add(b"")
+    f1 = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Times-Roman /Encoding /WinAnsiEncoding >>")
+    f2 = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Times-Bold /Encoding /WinAnsiEncoding >>")
+    kids = []
+    for page_ops in pages:
+        stream = b"\n".join(page_ops)
+        content_id = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_id = add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] " % (pages_id, PAGE_W, PAGE_H) +
+            b"/Resources << /Font << /F1 %d 0 R /F2 %d 0 R >> >> /Contents %d 0 R >>" % (f1, f2, content_id)
         )
+        kids.append(page_id)
+    objs[catalog_id - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id
+    objs[pages_id - 1] = (b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % k for k in kids) +
+                          b"] /Count %d >>" % len(kids))
+    info_id = add(b"<< /Title (" + pdf_str(title) + b") /Producer (job-hunt-app) >>")
+
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for i, body in enumerate(objs, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + body + b"\nendobj\n"
+    xref_pos = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objs) + 1)
+    for off in offsets:
+        out += b"%010d 00000 n \n" % off
+    out += (b"trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+            % (len(objs) + 1, catalog_id, info_id, xref_pos))
+    return bytes(out)
+
+
+def _libreoffice_binary():
+    return shutil.which("soffice") or shutil.which("libreoffice")
+
+
+def _render_pdf_libreoffice(docx_bytes):
+    """Convert .docx → PDF with local LibreOffice headless. Returns bytes or None."""
+    import subprocess, tempfile, uuid as _uuid
+    binary = _libreoffice_binary()
+    if not binary:
+        return None
+    with tempfile.TemporaryDirectory(prefix="lo_export_") as tmp:
+        src = os.path.join(tmp, "doc.docx")
+        with open(src, "wb") as f:
+            f.write(docx_bytes)
+        # Private profile dir per call so parallel conversions don't fight over the lock
+        profile = f"file://{tmp}/profile_{_uuid.uuid4().hex}"
+        try:
+            subprocess.run(
+                [binary, f"-env:UserInstallation={profile}", "--headless",
+                 "--convert-to", "pdf", "--outdir", tmp, src],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=90, check=True,
+            )
+            with open(os.path.join(tmp, "doc.pdf"), "rb") as f:
+                return f.read()
+        except Exception as e:
+            print(f"[Export] LibreOffice conversion failed: {e}")
+            return None
 
-        if is_co_date:
-            plain_para(doc, stripped, bold=True, before=5, after=1)
-            continue
 
-        if is_job_title:
-            plain_para(doc, clean_title(stripped), bold=True, before=0, after=1)
-            continue
+def _render_document_formats(text, title="Document", formats=DOC_FORMATS):
+    """Parse `text` once and render every requested format. Returns {fmt: bytes}."""
+    blocks = _parse_resume_blocks(text)
+    out = {}
+
+    def timed(fmt, render):
+        t0 = time.perf_counter()
+        result = render()
+        metrics.observe("jobhunt_doc_render_duration_seconds", time.perf_counter() - t0, {"format": fmt})
+        return result
+
+    if "docx" in formats or ("pdf" in formats and DOC_PDF_ENGINE != "builtin"):
+        out["docx"] = timed("docx", lambda: _create_docx_from_text(text, title, blocks=blocks))
+    if "html" in formats:
+        out["html"] = timed("html", lambda: _render_html_from_blocks(blocks, title).encode("utf-8"))
+    if "md" in formats:
+        out["md"] = timed("md", lambda: _render_markdown_from_blocks(blocks).encode("utf-8"))
+    if "pdf" in formats:
+        pdf = None
+        if DOC_PDF_ENGINE in ("auto", "libreoffice"):
+            pdf = timed("pdf_libreoffice", lambda: _render_pdf_libreoffice(out["docx"]))
+        out["pdf"] = pdf or timed("pdf_builtin", lambda: _render_pdf_builtin(blocks, title))
+    if "docx" not in formats:
+        out.pop("docx", None)
+    return out
+
+
+def _docx_to_text(docx_bytes):
+    """Recover plain resume text from a stored .docx (bullets → '- ' lines)."""
+    import io
+    from docx import Document as DocxDocument
+    doc = DocxDocument(io.BytesIO(docx_bytes))
+    lines = []
+    for p in doc.paragraphs:
+        t = p.text.strip()
+        style = (p.style.name if p.style is not None else "") or ""
+        lines.append(f"- {t}" if t and "List" in style else t)
+    return "\n".join(lines)
 
-        # ── EDUCATION BODY TEXT (not bold) ───────────────────────────────
-        if in_edu:
-            plain_para(doc, stripped, bold=False, before=0, after=3)
-            continue
 
-        # ── DEFAULT BODY TEXT ─────────────────────────────────────────────
-        plain_para(doc, stripped, bold=False, before=0, after=3)
+def _doc_cache_path(doc_key, kind, fmt):
+    root = os.path.abspath(DOC_CACHE_DIR)
+    path = os.path.abspath(os.path.join(root, doc_key, f"{kind}.{fmt}"))
+    if os.path.dirname(os.path.dirname(path)) != root:
+        raise ValueError(f"invalid document key {doc_key!r}")
+    return path
 
-    buf = io.BytesIO()
-    doc.save(buf)
-    return buf.getvalue()
+
+def _cache_doc_formats(doc_key, kind, rendered):
+    """Write rendered {fmt: bytes} for one document to the on-disk cache."""
+    try:
+        os.makedirs(os.path.dirname(_doc_cache_path(doc_key, kind, "docx")), exist_ok=True)
+        for fmt, data in rendered.items():
+            tmp = _doc_cache_path(doc_key, kind, fmt) + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, _doc_cache_path(doc_key, kind, fmt))
+    except Exception as e:
+        print(f"[Export] Cache write failed for {doc_key}/{kind}: {e}")
+
+
+def _render_and_cache_docs(doc_key, resume_text, cover_text, role="", company=""):
+    """
+    Single-pass render of resume + cover letter into every export format,
+    cached under doc_key. Returns {"resume": {fmt: bytes}, "cover": {fmt: bytes}}.
+    """
+    rendered = {
+        "resume": _render_document_formats(resume_text, f"Resume - {role}".strip(" -")),
+        "cover":  _render_document_formats(cover_text, f"Cover Letter - {company}".strip(" -")),
+    }
+    for kind, formats in rendered.items():
+        _cache_doc_formats(doc_key, kind, formats)
+    return rendered
+
+
+def _doc_format_urls(doc_key):
+    return {kind: {fmt: f"/api/docs/{doc_key}/{kind}.{fmt}" for fmt in DOC_FORMATS} for kind in DOC_KINDS}
+
+
+def _load_or_render_doc(doc_key, kind, fmt, job=None):
+    """Return cached bytes for doc_key/kind.fmt, rendering from the .docx if needed."""
+    path = _doc_cache_path(doc_key, kind, fmt)
+    hit = os.path.exists(path)
+    metrics.inc("jobhunt_cache_requests_total", {"cache": "doc", "result": "hit" if hit else "miss"})
+    if hit:
+        with open(path, "rb") as f:
+            return f.read()
+
+    # Cache miss — rebuild from the cached or stored .docx
+    docx_bytes = None
+    docx_path = _doc_cache_path(doc_key, kind, "docx")
+    if os.path.exists(docx_path):
+        with open(docx_path, "rb") as f:
+            docx_bytes = f.read()
+    if docx_bytes is None:
+        if job is None:
+            sb = get_supabase()
+            if not sb:
+                return None
+            rows = sb.table("jobs").select(f"id,role,company,{kind}_docx_b64").eq("id", doc_key).execute().data or []
+            job = rows[0] if rows else {}
+        b64 = job.get(f"{kind}_docx_b64")
+        if not b64:
+            return None
+        import base64
+        docx_bytes = base64.b64decode(b64)
+
+    title = f"Resume - {job.get('role', '')}" if (job and kind == "resume") else \
+            f"Cover Letter - {job.get('company', '')}" if job else kind.title()
+    rendered = _render_document_formats(_docx_to_text(docx_bytes), title.strip(" -"),
+                                        formats=tuple(f for f in DOC_FORMATS if f != "docx"))
+    rendered["docx"] = docx_bytes
+    _cache_doc_formats(doc_key, kind, rendered)
+    return rendered.get(fmt)
+
+
+@app.route("/api/docs/<doc_key>/<kind>.<fmt>", methods=["GET"])
+def download_doc(doc_key, kind, fmt):
+    """Fetch a generated document in any export format (docx, pdf, html, md)."""
+    from flask import send_file
+    import io
+
+    if kind not in DOC_KINDS or fmt not in DOC_FORMATS:
+        return jsonify({"error": f"Unknown document {kind}.{fmt}"}), 404
+    doc_key = _doc_key_for(doc_key)
+    try:
+        data = _load_or_render_doc(doc_key, kind, fmt)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    if data is None:
+        return jsonify({"error": "Document not found — generate docs first"}), 404
+
+    as_attachment = request.args.get("download", "0") in ("1", "true") or fmt == "docx"
+    return send_file(io.BytesIO(data), mimetype=DOC_MIMETYPES[fmt],
+                     as_attachment=as_attachment,
+                     download_name=f"{'Resume' if kind == 'resume' else 'CoverLetter'}_{doc_key}.{fmt}")
+
+
+@app.route("/api/docs/export-batch", methods=["POST"])
+def export_docs_batch():
+    """
+    Batch-convert stored documents for a filtered set of jobs into PDF/HTML/MD.
+    Body (all optional): {"jobIds": [...], "minScore": 7, "status": "saved", "formats": ["pdf","html"]}
+    Conversions run in parallel; results are cached and returned as URLs.
+    """
+    data = request.json or {}
+    job_ids = sorted({str(j) for j in data.get("jobIds", [])})
+    min_score = data.get("minScore")
+    status = data.get("status")
+    formats = [f for f in data.get("formats", ["pdf", "html", "md"]) if f in DOC_FORMATS]
+    if min_score is not None:
+        try:
+            min_score = float(min_score)
+        except (TypeError, ValueError):
+            return jsonify({"error": f"minScore must be a number, got {min_score!r}"}), 400
+
+    sb = get_supabase()
+    if not sb:
+        return jsonify({"error": "Supabase not configured"}), 400
+    try:
+        query = sb.table("jobs").select("id,role,company,status,aiScore,resume_docx_b64,cover_docx_b64")
+        if job_ids:
+            query = query.in_("id", job_ids)
+        if min_score is not None:
+            query = query.gte("aiScore", min_score)
+        if status:
+            query = query.eq("status", status)
+        rows = query.execute().data or []
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    selected = [j for j in rows if j.get("resume_docx_b64") or j.get("cover_docx_b64")]
+
+    def convert(job):
+        doc_key = _doc_key_for(job.get("id"))
+        done = {}
+        for kind in DOC_KINDS:
+            if not job.get(f"{kind}_docx_b64"):
+                continue
+            for fmt in formats:
+                if _load_or_render_doc(doc_key, kind, fmt, job=job) is not None:
+                    done.setdefault(kind, {})[fmt] = f"/api/docs/{doc_key}/{kind}.{fmt}"
+        return {"id": job.get("id"), "company": job.get("company", ""), "role": job.get("role", ""), "files": done}
+
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    results, errors = [], []
+    with ThreadPoolExecutor(max_workers=int(os.environ.get("DOC_EXPORT_WORKERS", "4"))) as pool:
+        futures = {pool.submit(convert, j): j for j in selected}
+        for fut in as_completed(futures):
+            try:
+                results.append(fut.result())
+            except Exception as e:
+                errors.append({"id": futures[fut].get("id"), "error": str(e)[:200]})
+
+    return jsonify({"converted": len(results), "errors": errors, "results": results,
+                    "pdf_engine": "libreoffice" if (DOC_PDF_ENGINE != "builtin" and _libreoffice_binary()) else "builtin"})
 
 
 @app.route("/api/generate-docs", methods=["POST"])
@@ -1640,12 +4487,7 @@ def generate_docs():
     jd = data.get("jd", "").strip()
     role_type = data.get("roleType", "").strip()
     matched_keywords = data.get("matchedKeywords", [])
-
-    kw_line = (
-        f"PRE-EXTRACTED JD KEYWORDS (use ALL verbatim throughout resume): {', '.join(matched_keywords)}"
-        if matched_keywords else
-        "Extract and use all keywords from the JD above throughout the resume."
-    )
+    job_id = data.get("jobId")
 
     if not role or not company:
         return jsonify({"error": "role and company are required"}), 400
@@ -1653,158 +4495,24 @@ def generate_docs():
     try:
         P = get_active_profile()
         ai_role = is_ai_role(jd, role_type)
-        framing = build_product_framing(P)
-
-        # Build structured experience text
-        exp_text_d = ""
-        for exp in P.get('experience', []):
-            exp_text_d += f"\n--- {exp.get('role','')} at {exp.get('company','')} ({exp.get('period','')}) ---\n"
-            for b in exp.get('bullets', []):
-                exp_text_d += f"  - {b}\n"
-            for a in exp.get('achievements', []):
-                exp_text_d += f"  Achievement: {a}\n"
-        skills_text_d = ', '.join(P.get('skills', []))
-        edu_text_d = '; '.join([f"{e.get('degree','')} — {e.get('school','')} ({e.get('period','')})" for e in P.get('education', [])])
 
         # Generate resume text via AI
-        resume_prompt = f"""You are an expert ATS resume writer. Write a COMPLETE 2-page resume for {P.get('name','')} targeting: {role_type or role} at {company}.
-
-JOB DESCRIPTION:
-{jd[:3000]}
-
-{kw_line}
-
-===== CANDIDATE MASTER DATA =====
-Name: {P.get('name','')} | Phone: {P.get('mobile','')} | Email: {P.get('email','')}
-LinkedIn: {P.get('linkedin','')} | Address: {P.get('address','')}
-Certification: SAFe 6.0 Product Owner/Product Management
-
-HEADLINE OPTIONS (pick most JD-relevant):
-- Business Analyst Lead | Product Owner | Sales & Operations Excellence
-- Lead Business Analyst / Enterprise Product Owner
-- Digital Product Manager | Product Owner (AI & Data Platforms)
-- Business Analyst Lead | Product Owner | Product Manager
-
-SUMMARY OPTIONS (pick and blend most relevant 2 options to JD — write in plain human language, no buzzwords, no "results-driven", no "passionate"):
-Option A (BA/Ops): 5 years at KPMG Singapore delivering digital banking programmes — caught 847 defects pre-production on Loan IQ (25% reduction), saved 30 man-days per quarter through API automation, and generated ~$340K in additional revenue by making the commercial case for scope changes. SAFe 6.0 Product Owner.
-Option B (Product/Website): Product Owner at KPMG who led end-to-end loan application digitisation for Enterprise Singapore — 80% increase in online applications through SEO optimisation and UX improvements, 30% velocity increase across 4 squads, and 99.9% uptime on go-live of core banking platform.
-Option C (AI/Conversion): Built two live AI products independently — a job-hunt platform (job-hunt-app-r7my.onrender.com) where I applied conversion thinking to replace drop-off-causing forms with a chatbot interface, and a stock monitoring app (stock-monitor-8ak6.onrender.com) using NLP and Claude API. At KPMG drove A/B testing and SEO optimisation for client-facing loan applications.
-Option D (Fintech/Growth): 5 years shipping fintech products at KPMG — owned backlog for Loan IQ platform from discovery to 3 major go-lives, ran A/B testing on loan application UX that drove 80% increase in online submissions, and saved 30 man-days quarterly through automated interest computation. JP Morgan: 10% portfolio growth for 2 clients in 3 months.
-
-SKILLS POOL:
-Data visualization tools: Tableau, Power BI
-Programming: PSQL, Python basics
-Key Modules in Masters: Financial Planning and Analysis, Operations management
-Others: Agile, SAFe 6.0, JIRA, Excel, Microsoft Project, Product Vision and road mapping, Business Analysis, Risk Mitigation & Change Management, Budget Forecasting & Variance Analysis, KPI Tracking & Dashboard Reporting, API integrations, Stakeholder Management, AI-enabled Product Integration, SEO, GEO, CRO, MVP Definition, Generative AI, LLM, Prompt Engineering
-Certification: Scaled Agile Framework 6.0 Product Owner/Product Management
-
-EXPERIENCE BULLETS POOL — pick 6-8 for KPMG (choose category based on JD), 3-4 for JPM, 2-3 for Amazon:
-
-KPMG (Feb 2021–Present) — WEBSITE/CONVERSION/SEO bullets (use when JD mentions CRO, SEO, website, growth, lead gen):
-- Led end-to-end loan process digitisation for Enterprise Singapore clients — implemented internet and intranet solutions that drove 80% increase in online loan applications through SEO optimisation and A/B testing on application conversion rates
-- Drove cross-functional alignment between Architecture and UX teams to maximise loan application conversions — eliminated slow-loading pages and friction points that were causing drop-off and blocking lead generation
-- Led change management project through gap analysis of new vs existing features, generating 5% revenue increase through stakeholder negotiation and commercial prioritisation
-- Worked on e-commerce website analysing customer engagement and drop-off patterns, resulting in 5% customer retention increase through data-driven UX iteration
-
-KPMG — PRODUCT OWNERSHIP bullets (use when JD mentions PM, PO, roadmap, backlog, agile):
-- Owned end-to-end product backlog for Loan IQ digital platform — wrote user stories, prioritised by business value, shipped 3 major releases on time across a 12-month programme
-- Led PI Planning and sprint ceremonies across 4 squads, increasing team velocity by 30% over 2 quarters by removing blockers and tightening Definition of Done
-- Built product roadmap and business cases for 6 new features on core banking platform, securing C-suite sign-off and budget extension
-- Drove data-informed product decisions by defining KPIs, tracking funnel metrics in JIRA dashboards, and running weekly reviews with engineering and design leads
-
-KPMG — DELIVERY/TECHNICAL bullets (use when JD mentions delivery, APIs, technical):
-- Designed and executed end-to-end test scenarios on Loan IQ (M&A, Trade, WCL, FA) — caught 847 defects pre-production, reducing post-launch defects by 25% and avoiding ~$2M in rework costs
-- Automated interest computation workflow via API integrations — eliminated 30 man-days of manual processing per quarter
-- Managed data migrations from 3 legacy systems to Loan IQ across $4B in loan records — hit go-live with 99.9% uptime and zero data loss
-- Supported AI-enabled solution design (NLP document parsing, automated reconciliation) reducing manual back-office effort by 30 man-days per cycle
-
-KPMG — KEY ACHIEVEMENTS:
-- Gap analysis on 23 change requests generated ~$340K additional revenue (5% of $6.8M engagement) by making the commercial case for 18 scope additions
-- Automated interest computation via API saved 30 man-days of manual work per quarter — equivalent to one FTE's monthly output
-- Led 4-squad team through sprint-to-SIT transition in 3 weeks with no delivery slip despite losing 2 team members mid-sprint
-
-J.P. Morgan (Oct 2023–Jan 2024, Asset Management Internship):
-- Analysed 5 stocks using DCF, P/E and risk-adjusted return models — recommended 2 to clients, resulting in 10% portfolio value increase over 3 months
-- Built investor profiles for 8 clients through structured discovery sessions covering investment objectives, risk appetite, and liquidity needs
-- Tracked portfolio KPIs weekly (Annual Return, Portfolio Variance, Standard Deviation) and flagged 2 positions for rebalancing before market correction
-- Helped 3 clients consolidate fragmented portfolios — reduced average fee drag by 0.4% annually
-
-Amazon (Mar 2018–Mar 2019, Business Analyst):
-- Delivered 30% sales increase and improved organic search ranking through strategic backend SEO optimisation and Brand Referral Bonus programme — leveraged TikTok ads and product imagery optimisation capitalising on 75% of shoppers who rely on visual content
-- Built real-time quality monitoring dashboards in Power BI (from SQL Server and Excel) — ops team caught defects earlier, cutting quality issues by 20% in 6 months
-- Translated 40+ requirements into functional/non-functional specs across 3 product teams — zero spec-related rework in UAT, 95% stakeholder sign-off on first review
-- Analysed operational data in Tableau and Power BI to identify 3 fulfilment bottlenecks — fixes increased operational efficiency by 15% in one quarter
-
-EDUCATION:
-Master of Science Engineering Business Management, Coventry University, UK (Jul 2019–Nov 2020)
-Bachelor of Engineering Electronics & Communication Engineering, Anna University, India (Jul 2012–Jun 2016)
-=================================
-
-OUTPUT FORMAT — FOLLOW EXACTLY, plain text only, no markdown:
-Line 1: Amretha Karthikeyan
-Line 2: #02-321 153 Gangsa Road, Singapore-670153
-Line 3: Mobile: +65-90256503, email: amretha.ammu@gmail.com
-Line 4: https://www.linkedin.com/in/amretha-nishanth-534b39101/
-Line 5: [chosen headline]
-[blank line]
-PROFESSIONAL SUMMARY:
-[4 sentences — blend the most relevant summary option above with JD keywords. RULES: write like a real person, not a job posting. Every sentence must have a real number or specific fact. Sentence 1: role + years + KPMG Singapore + one JD keyword. Sentence 2: AI projects with both URLs as key differentiator + one conversion/product metric. Sentence 3: 2-3 specific metrics from experience (choose from: 25% defect reduction, 30 man-days saved, 80% increase in online applications, 5% revenue increase, 30% velocity increase, 10% portfolio growth, 99.9% uptime). Sentence 4: SAFe cert + what you're targeting. BANNED in summary: leveraged, spearheaded, transformative, innovative, dynamic, results-driven, passionate, cross-functional synergies, stakeholder value, drive operational alignment, scalable solutions, proven track record, cross-functional project execution]
-[blank line]
-SKILL SET:
-Data visualization tools: [tools]
-Programming: [languages]
-Others: [all relevant skills + JD keywords]
-Certification: Scaled Agile Framework 6.0 Product Owner/Product Management
-[blank line]
-PROFESSIONAL EXPERIENCE:
-KPMG, Singapore  Feb 2021 – Present
-[Job title — no slashes before or after]
-- [6-8 selected bullets]
-Key Achievements:
-- [3 achievements]
-[blank line]
-J.P. Morgan  Oct 2023 – Jan 2024
-Asset Management Virtual Internship
-- [3-4 bullets]
-[blank line]
-Amazon Inc, India  Mar 2018 – Mar 2019
-Business Analyst
-- [2-3 bullets]
-[blank line]
-ACADEMIC QUALIFICATION:
-Master of Science Engineering Business Management  Jul 2019 – Nov 2020
-Coventry University, UK
-Bachelor of Engineering  Jul 2012 – Jun 2016
-Electronics & Communication Engineering, Anna University, India
-Certification: Scaled Agile Framework 6.0 Product Owner/Product Management
-
-RULES: Plain text only. ALL CAPS section headers. "- " bullets. Job titles on own line with NO slashes. Do NOT write "HEADER". Target 750-850 words. Weave in 12+ exact JD keyword phrases. Do NOT mention the target company name anywhere in the resume. Do NOT add closing paragraphs or cover-letter-style text after the education section.
-
-BULLET QUALITY — CRITICAL: Every bullet = [Action verb] + [specific thing] + [real number/%/$] + [business impact]. BANNED words: spearheaded, leveraged, transformative, innovative, synergies, holistic, robust, dynamic, customer-centric, thought leader, value-add, paradigm, ecosystem. Every bullet must sound like a real person said it, not AI. Must answer "so what?" with a real number."""
-
-        resume_text = call_claude(resume_prompt, max_tokens=8192)
+        resume_prompt = build_prompt("resume", P, **resume_prompt_fields(
+            role_type or role, _trim_jd(jd, 750), matched_keywords, ai_role, P))
+        resume_text = call_claude(resume_prompt, route="resume")
         resume_text = _inject_ai_projects(resume_text)
 
         # Generate cover letter text via AI
-        proj_url = P.get('aiProjectUrl', 'https://stock-monitor-8ak6.onrender.com')
-        cover_prompt = f"""Write a professional 300-350 word cover letter for {P['name']} applying to {role_type or role} at {company}.
-{framing}
+        cover_prompt = build_prompt("cover_letter", P, **cover_letter_prompt_fields(
+            role_type or role, company, _trim_jd(jd, 750), ai_role, P))
+        cover_text = call_claude(cover_prompt, route="cover")
 
-JOB DESCRIPTION:
-{jd[:3000]}
+        # Render .docx + pdf/html/md in one pass (cached for /api/docs/...)
+        doc_key = _doc_key_for(job_id, resume_text + cover_text)
+        rendered = _render_and_cache_docs(doc_key, resume_text, cover_text, role, company)
 
-{"AI ROLE: Mention the live AI project at " + proj_url + " as proof of hands-on AI product development. Write the full URL exactly as given — never write [URL] or placeholder text." if ai_role else ""}
-
-Rules: Plain text only. No bold, no headers, no bullet points. Start with 'Dear Hiring Manager,' on its own line. Be specific about the company and role. Include metrics: ~5% business value, 30 man-days eliminated. Reference SAFe certification. Never use placeholder text like [URL] or [Company] — always use the actual values."""
-
-        cover_text = call_claude(cover_prompt)
-
-        # Create .docx files
-        resume_bytes = _create_docx_from_text(resume_text, f"Resume - {role}")
-        cover_bytes = _create_docx_from_text(cover_text, f"Cover Letter - {company}")
-
-        resume_b64 = base64.b64encode(resume_bytes).decode()
-        cover_b64 = base64.b64encode(cover_bytes).decode()
+        resume_b64 = base64.b64encode(rendered["resume"]["docx"]).decode()
+        cover_b64 = base64.b64encode(rendered["cover"]["docx"]).decode()
 
         return jsonify({
             "resume_b64": resume_b64,
@@ -1814,6 +4522,10 @@ Rules: Plain text only. No bold, no headers, no bullet points. Start with 'Dear
             "cover_filename": f"CoverLetter_{company.replace(' ','_')}.docx",
             "resume_text": resume_text,
             "cover_text": cover_text,
+            "resume_html": rendered["resume"]["html"].decode("utf-8"),
+            "cover_html": rendered["cover"]["html"].decode("utf-8"),
+            "doc_key": doc_key,
+            "formats": _doc_format_urls(doc_key),
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -1869,7 +4581,7 @@ def import_job():
                 result["company"] = company_match.group(1).replace("-", " ").title()
 
             try:
-                resp = http_requests.get(url, headers=headers, timeout=10)
+                resp = _upstream_request("linkedin_guest", "GET", url, headers=headers, timeout=10)
                 soup = BeautifulSoup(resp.text, "lxml")
 
                 # Try various LinkedIn selectors
@@ -1965,15 +4677,18 @@ def rank_jobs():
       Singapore location    0–0.5 pt
       Visa sponsorship      0–0.5 pt  (+override to 0 if blocked)
     """
-    import re as _re
-
     data = request.json or {}
     jobs = data.get("jobs", [])
     if not jobs:
         return jsonify({"error": "No jobs provided"}), 400
 
-    P = get_active_profile()
+    rankings = _rank_jobs_for_profile(jobs, get_active_profile())
+    print(f"[rank_jobs] Scored {len(rankings)} jobs (keyword match, no AI)")
+    return jsonify({"rankings": rankings})
+
 
+def _rank_jobs_for_profile(jobs, P):
+    """Keyword/profile match scoring behind /api/rank-jobs (pure, no I/O)."""
     # ── Candidate profile text (for matching) ────────────────────────────
     profile_text = " ".join([
         P.get("summary", ""),
@@ -2227,8 +4942,7 @@ def rank_jobs():
             "jd_only_keywords": jd_only_keywords,      # keywords in JD not yet in profile
         })
 
-    print(f"[rank_jobs] Scored {len(rankings)} jobs (keyword match, no AI)")
-    return jsonify({"rankings": rankings})
+    return rankings
 
 
 @app.route("/api/fetch-jd", methods=["POST"])
@@ -2236,18 +4950,22 @@ def fetch_jd():
     """Fetch job description from any URL.
     Priority: 1) Firecrawl (best, handles JS/auth walls)
               2) LinkedIn Voyager API (if li_at cookie set)
-              3) BeautifulSoup HTML scraping (last resort)
+              3) lxml HTML scraping (last resort)
     """
-    import requests as req
-    import uuid as _uuid
-    import re as _re
-    from bs4 import BeautifulSoup
-
     data = request.json
     url = (data.get("url") or "").strip()
     if not url:
         return jsonify({"error": "No URL provided"}), 400
 
+    # Concurrent requests for the same URL (double-clicks, bulk imports) share one fetch
+    return jsonify(_jd_flight.do(url, lambda: _fetch_jd_for_url(url)))
+
+
+def _fetch_jd_for_url(url):
+    """Firecrawl → Voyager → HTML. Returns {"jd", "title", "company", "source"[, "error"]}."""
+    import requests as req
+    import re as _re
+
     jd = ""
     title = ""
     company = ""
@@ -2256,7 +4974,8 @@ def fetch_jd():
     if FIRECRAWL_API_KEY:
         try:
             print(f"[fetch-jd] Trying Firecrawl for {url}")
-            fc_resp = http_requests.post(
+            fc_resp = _upstream_request(
+                "firecrawl", "POST",
                 "https://api.firecrawl.dev/v1/scrape",
                 headers={
                     "Authorization": f"Bearer {FIRECRAWL_API_KEY}",
@@ -2299,7 +5018,7 @@ def fetch_jd():
                     jd = "\n".join(clean_lines).strip()[:6000]
                     if len(jd) > 200:
                         print(f"[fetch-jd] Firecrawl OK: {len(jd)} chars")
-                        return jsonify({"jd": jd, "title": title, "company": company, "source": "firecrawl"})
+                        return {"jd": jd, "title": title, "company": company, "source": "firecrawl"}
                     print(f"[fetch-jd] Firecrawl too short ({len(jd)}), trying fallback")
             else:
                 print(f"[fetch-jd] Firecrawl HTTP {fc_resp.status_code}: {fc_resp.text[:200]}")
@@ -2313,21 +5032,11 @@ def fetch_jd():
         m = _re.search(r"/jobs/view/(\d+)", url)
         if m:
             job_id = m.group(1)
-            li_at = _get_li_at_cookie()
-            if li_at:
-                li_at = li_at.strip().strip('"').strip("'")
-                csrf_token = f"ajax:{_uuid.uuid4()}"
-                v_headers = {
-                    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                    "Accept": "application/vnd.linkedin.normalized+json+2.1",
-                    "x-restli-protocol-version": "2.0.0",
-                    "csrf-token": csrf_token,
-                }
-                v_cookies = {"li_at": li_at, "JSESSIONID": f'"{csrf_token}"'}
-                v_url = (f"https://www.linkedin.com/voyager/api/jobs/jobPostings/{job_id}"
+            if _linkedin.ensure(allow_login=False):
+                v_url = (f"{LINKEDIN_BASE}/voyager/api/jobs/jobPostings/{job_id}"
                          f"?decorationId=com.linkedin.voyager.deco.jobs.web.shared.WebFullJobPosting-65")
                 try:
-                    vr = http_requests.get(v_url, headers=v_headers, cookies=v_cookies, timeout=15)
+                    vr = _linkedin.request("GET", v_url, allow_login=False, timeout=15)
                     if vr.status_code == 200:
                         vd = vr.json()
                         desc = vd.get("description") or vd.get("descriptionText") or {}
@@ -2339,11 +5048,11 @@ def fetch_jd():
                             company = company or comp_res.get("companyResolutionResult", {}).get("name") or ""
                         if jd:
                             print(f"[fetch-jd] Voyager OK: {len(jd)} chars")
-                            return jsonify({"jd": jd, "title": title, "company": company, "source": "voyager"})
+                            return {"jd": jd, "title": title, "company": company, "source": "voyager"}
                 except Exception as ve:
                     print(f"[fetch-jd] Voyager error: {ve}")
 
-    # ── METHOD 3: BeautifulSoup fallback ────────────────────────────────────
+    # ── METHOD 3: HTML fallback ─────────────────────────────────────────────────
     try:
         headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
@@ -2351,41 +5060,298 @@ def fetch_jd():
             "Accept-Language": "en-US,en;q=0.9",
         }
         resp = req.get(url, headers=headers, timeout=15)
-        soup = BeautifulSoup(resp.text, "html.parser")
-
-        selectors = {
-            "linkedin.com": [".description__text", ".show-more-less-html__markup", "[class*='description']", "section.description"],
-            "indeed.com":   ["#jobDescriptionText", ".jobsearch-jobDescriptionText", "[class*='description']"],
-            "mycareersfuture.gov.sg": ["[class*='job-description']", "[class*='description']", "article"],
-        }
-        matched_sels = next((v for k, v in selectors.items() if k in url), None)
-        if matched_sels:
-            for sel in matched_sels:
-                el = soup.select_one(sel)
-                if el and len(el.get_text(strip=True)) > 100:
-                    jd = el.get_text(separator="\n", strip=True)[:5000]
-                    break
-            if "linkedin.com" in url:
-                t_el = soup.select_one("h1.top-card-layout__title, h1[class*='title']")
-                if t_el: title = title or t_el.get_text(strip=True)
-                c_el = soup.select_one("a.topcard__org-name-link, [class*='company-name']")
-                if c_el: company = company or c_el.get_text(strip=True)
-        else:
-            for tag in soup.find_all(["article", "section", "div"], limit=20):
-                text = tag.get_text(strip=True)
-                if len(text) > 500 and any(kw in text.lower() for kw in ["responsibilities", "requirements", "qualifications"]):
-                    jd = text[:5000]
-                    break
+        jd, page_title, page_company = extract_jd_from_page(resp.text, url)
+        title = title or page_title
+        company = company or page_company
 
         if jd:
-            print(f"[fetch-jd] BeautifulSoup OK: {len(jd)} chars")
-            return jsonify({"jd": jd, "title": title, "company": company, "source": "html"})
+            print(f"[fetch-jd] HTML OK: {len(jd)} chars")
+            return {"jd": jd, "title": title, "company": company, "source": "html"}
     except Exception as be:
-        print(f"[fetch-jd] BeautifulSoup error: {be}")
+        print(f"[fetch-jd] HTML error: {be}")
+
+    return {"jd": "", "title": title, "company": company,
+            "error": "Could not extract JD — try adding the text manually.",
+            "source": "failed"}
+
+# ─── BOOKMARKLET QUEUE ───────────────────────────────────────────────────────
+# Jobs captured by the bookmarklet wait here until the frontend pulls them.
+# The queue and its dedup index live in the shared local store (SQLite WAL),
+# so appends from several tabs / gunicorn workers serialize on the database
+# lock instead of racing on a JSON file rewrite. Appending costs a couple of
+# primary-key lookups however long the queue is, and draining reads and
+# deletes in one transaction, so a job posted mid-drain is never lost.
+# Dedup keys (canonical URL, role|company) are remembered for
+# BOOKMARK_DEDUP_TTL seconds, including after the queue has been drained.
+
+BOOKMARK_DEDUP_TTL = int(os.environ.get("BOOKMARK_DEDUP_TTL", str(30 * 86400)))
+_LEGACY_BOOKMARK_FILE = os.path.join(BASE_DIR, "bookmarked_jobs.json")
+
+_local_db_schema("""
+CREATE TABLE IF NOT EXISTS bookmark_queue (
+    seq    INTEGER PRIMARY KEY AUTOINCREMENT,
+    job    TEXT NOT NULL,
+    queued REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bookmark_seen (
+    key   TEXT PRIMARY KEY,
+    added REAL NOT NULL
+);
+""")
+
+_bookmark_migrated = False
+_bookmark_migrate_lock = threading.Lock()
+
+
+def _bookmark_keys(job):
+    url = canonical_job_url(job.get("url"))
+    tc = f"{(job.get('role') or '').strip().lower()}|{(job.get('company') or '').strip().lower()}"
+    return ([f"url:{url}"] if url else []) + [f"tc:{tc}"]
+
+
+def _bookmark_migrate_legacy():
+    """One-time import of a leftover bookmarked_jobs.json into the queue."""
+    global _bookmark_migrated
+    with _bookmark_migrate_lock:
+        if _bookmark_migrated:
+            return
+        try:
+            if os.path.exists(_LEGACY_BOOKMARK_FILE):
+                with open(_LEGACY_BOOKMARK_FILE) as f:
+                    legacy = json.load(f)
+                os.replace(_LEGACY_BOOKMARK_FILE, _LEGACY_BOOKMARK_FILE + ".migrated")
+                print(f"[Bookmarks] migrated {len(_bookmark_append(legacy or []))} queued jobs from bookmarked_jobs.json")
+        except (OSError, ValueError) as e:
+            print(f"[Bookmarks] legacy queue not migrated: {e}")
+        _bookmark_migrated = True
+
+
+def bookmark_enqueue(jobs):
+    """Append jobs not seen recently (by URL or role|company); returns the ones added."""
+    if not _bookmark_migrated:
+        _bookmark_migrate_legacy()
+    return _bookmark_append(jobs)
+
+
+def _bookmark_append(jobs, queue=True, check_seen=True):
+    """queue=False only records the dedup keys; check_seen=False queues jobs
+    whose keys were already recorded (captures whose Supabase write failed)."""
+    db = _local_db()
+    now = time.time()
+    added = []
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        for job in jobs:
+            keys = _bookmark_keys(job)
+            marks = ",".join("?" * len(keys))
+            if check_seen and db.execute(f"SELECT 1 FROM bookmark_seen WHERE key IN ({marks}) AND added > ? LIMIT 1",
+                                         (*keys, now - BOOKMARK_DEDUP_TTL)).fetchone():
+                continue
+            if queue:
+                db.execute("INSERT INTO bookmark_queue (job, queued) VALUES (?, ?)", (json.dumps(job), now))
+            db.executemany("INSERT OR REPLACE INTO bookmark_seen (key, added) VALUES (?, ?)",
+                           [(k, now) for k in keys])
+            added.append(job)
+        db.execute("COMMIT")
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    return added
+
+
+def bookmark_drain():
+    """Remove and return every queued job, oldest first, atomically."""
+    if not _bookmark_migrated:
+        _bookmark_migrate_legacy()
+    db = _local_db()
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        rows = db.execute("SELECT seq, job FROM bookmark_queue ORDER BY seq").fetchall()
+        if rows:
+            db.execute("DELETE FROM bookmark_queue WHERE seq <= ?", (rows[-1]["seq"],))
+        db.execute("DELETE FROM bookmark_seen WHERE added < ?", (time.time() - BOOKMARK_DEDUP_TTL,))
+        db.execute("COMMIT")
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    return [json.loads(r["job"]) for r in rows]
+
+
+def bookmark_pending_count():
+    if not _bookmark_migrated:
+        _bookmark_migrate_legacy()
+    return _local_db().execute("SELECT COUNT(*) FROM bookmark_queue").fetchone()[0]
+
+
+# ─── CAPTURE INGESTION ───────────────────────────────────────────────────────
+# With Supabase configured, bulk captures skip the local queue: rows go into a
+# write-behind buffer that a background thread flushes to the jobs table in
+# batches of INGEST_BATCH (or every INGEST_FLUSH_SECONDS), and the rows that
+# were actually new are handed straight to the agent for scoring. Those runs
+# send no email/WhatsApp summary: a flush is often a single bookmarklet click.
+# Ids are derived from the canonical URL (li_<id> for LinkedIn, like the
+# frontend), and the insert ignores duplicates, so a job captured twice — or
+# already tracked under another id with the same canonical URL — is never
+# overwritten. A failed flush falls back to the bookmarklet queue so nothing
+# is dropped.
+
+import atexit
+
+INGEST_BATCH = int(os.environ.get("INGEST_BATCH", "30"))
+INGEST_FLUSH_SECONDS = float(os.environ.get("INGEST_FLUSH_SECONDS", "1"))
+INGEST_AUTO_AGENT = os.environ.get("INGEST_AUTO_AGENT", "1") != "0"
+
+_LINKEDIN_JOB_RE = re.compile(r"linkedin\.com/(?:.*/)?jobs/view/(?:[^/?#]*-)?(\d+)|linkedin\.com/.*[?&]currentJobId=(\d+)")
+
+
+# Query parameters that name the job itself (Indeed's jk/vjk, Greenhouse's
+# gh_jid); every other parameter is tracking noise and is dropped.
+_JOB_QUERY_KEYS = ("jk", "vjk", "gh_jid")
+
+
+def canonical_job_url(url):
+    """https://host/path with no fragment, trailing slash or tracking query
+    (job-identifying parameters are kept); LinkedIn search/collection/slug
+    URLs collapse to /jobs/view/<id>/."""
+    url = (url or "").strip()
+    if not url:
+        return ""
+    m = _LINKEDIN_JOB_RE.search(url)
+    if m:
+        return f"https://www.linkedin.com/jobs/view/{m.group(1) or m.group(2)}/"
+    parts = urllib.parse.urlsplit(url if "//" in url else f"https://{url}")
+    query = sorted((k, v) for k, v in urllib.parse.parse_qsl(parts.query) if k in _JOB_QUERY_KEYS)
+    return (f"https://{parts.netloc.lower()}{parts.path.rstrip('/')}"
+            + (f"?{urllib.parse.urlencode(query)}" if query else ""))
+
+
+def _capture_job_id(canon, role, company):
+    m = _LINKEDIN_JOB_RE.search(canon)
+    if m:
+        return f"li_{m.group(1) or m.group(2)}"
+    basis = canon or f"{role.strip().lower()}|{company.strip().lower()}"
+    return "bm_" + hashlib.sha1(basis.encode()).hexdigest()[:16]
+
+
+def _flush_ingest(rows):
+    """Insert buffered rows into Supabase; returns the rows that were new."""
+    sb = get_supabase()
+    if not sb:
+        _bookmark_append(rows, check_seen=False)    # ingest_captured_jobs already marked them seen
+        metrics.inc("jobhunt_ingest_jobs_total", {"result": "deferred"}, len(rows))
+        return []
+    try:
+        inserted = []
+        for i in range(0, len(rows), INGEST_BATCH):
+            batch = rows[i:i + INGEST_BATCH]
+            # Ids are deduped by the insert itself; only look up this batch's
+            # URLs to catch the same job tracked under another id.
+            urls = sorted({r["url"] for r in batch} - {""})
+            known = {j.get("url") for j in
+                     sb.table("jobs").select("url").in_("url", urls).execute().data or []} if urls else set()
+            fresh = [r for r in batch if r["url"] not in known]
+            if fresh:
+                res = sb.table("jobs").upsert(fresh, on_conflict="id", ignore_duplicates=True).execute()
+                inserted.extend(res.data or [])
+    except Exception as e:
+        print(f"[Ingest] flush of {len(rows)} jobs failed, queued locally: {e}")
+        _bookmark_append(rows, check_seen=False)
+        metrics.inc("jobhunt_ingest_jobs_total", {"result": "deferred"}, len(rows))
+        return []
+    metrics.inc("jobhunt_ingest_jobs_total", {"result": "inserted"}, len(inserted))
+    metrics.inc("jobhunt_ingest_jobs_total", {"result": "duplicate"}, len(rows) - len(inserted))
+    print(f"[Ingest] {len(inserted)} new jobs written, {len(rows) - len(inserted)} already tracked")
+    return inserted
+
+
+class _IngestBuffer:
+    """Write-behind buffer drained by one flusher thread per process."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._rows = []
+        self._pid = None
+        self._agent_inbox = []
+        self._agent_running = False
+
+    def add(self, rows):
+        with self._cond:
+            self._rows.extend(rows)
+            metrics.set("jobhunt_queue_depth", len(self._rows), {"queue": "ingest"})
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, daemon=True).start()
+            self._cond.notify_all()
+
+    def flush(self):
+        with self._cond:
+            rows, self._rows = self._rows, []
+        if not rows:
+            return
+        metrics.set("jobhunt_queue_depth", 0, {"queue": "ingest"})
+        inserted = _flush_ingest(rows)
+        if inserted and INGEST_AUTO_AGENT:
+            self._hand_off(inserted)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._rows:
+                    self._cond.wait()
+                deadline = time.monotonic() + INGEST_FLUSH_SECONDS
+                while len(self._rows) < INGEST_BATCH and time.monotonic() < deadline:
+                    self._cond.wait(deadline - time.monotonic())
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[Ingest] flusher error: {e}")
+
+    def _hand_off(self, jobs):
+        """Queue new jobs for the agent; one agent run at a time drains the inbox."""
+        with self._cond:
+            self._agent_inbox.extend(jobs)
+            if self._agent_running:
+                return
+            self._agent_running = True
+        threading.Thread(target=self._agent_loop, daemon=True).start()
+
+    def _agent_loop(self):
+        while True:
+            with self._cond:
+                jobs, self._agent_inbox = self._agent_inbox, []
+                if not jobs:
+                    self._agent_running = False
+                    return
+            try:
+                with app.app_context():
+                    agent_run(jobs, trigger="import", notify=False)
+            except Exception as e:
+                print(f"[Ingest] agent hand-off failed: {e}")
+
+
+_ingest_buffer = _IngestBuffer()
+atexit.register(_ingest_buffer.flush)
+
+
+def ingest_captured_jobs(jobs):
+    """Accept captured jobs for the jobs table; returns the ones not seen before.
+
+    Without Supabase the jobs wait in the bookmarklet queue for the frontend."""
+    if not (SUPABASE_URL and SUPABASE_KEY):
+        return bookmark_enqueue(jobs)
+    accepted = _bookmark_append(jobs, queue=False)
+    rows = []
+    for job in accepted:
+        canon = canonical_job_url(job.get("url"))
+        row = _job_row(dict(job, url=canon, status=job.get("status") or "saved",
+                            id=_capture_job_id(canon, job.get("role", ""), job.get("company", ""))))
+        if row["id"].startswith("li_"):
+            row["linkedInId"] = row["id"]
+        rows.append(row)
+    if rows:
+        _ingest_buffer.add(rows)
+    return accepted
 
-    return jsonify({"jd": "", "title": title, "company": company,
-                    "error": "Could not extract JD — try adding the text manually.",
-                    "source": "failed"}), 200
 
 @app.route("/api/bookmarklet-add", methods=["POST", "OPTIONS"])
 def bookmarklet_add():
@@ -2406,37 +5372,24 @@ def bookmarklet_add():
         resp.headers["Access-Control-Allow-Origin"] = "*"
         return resp, 400
 
-    # Store in a simple JSON file on the server
-    import json, os
-    jobs_file = os.path.join(BASE_DIR, "bookmarked_jobs.json")
-    
     try:
-        if os.path.exists(jobs_file):
-            with open(jobs_file, "r") as f:
-                saved = json.load(f)
-        else:
-            saved = []
-
         new_job = {
-            "id": int(__import__("time").time() * 1000),
+            "id": int(time.time() * 1000),
             "role": role,
             "company": company,
             "jd": data.get("jd", ""),
             "location": data.get("location", "Singapore"),
             "url": data.get("url", ""),
             "status": "wishlist",
-            "date": __import__("datetime").date.today().strftime("%d/%m/%Y"),
+            "date": datetime.date.today().strftime("%d/%m/%Y"),
             "notes": "",
             "salary": "",
             "isDemo": False,
             "fromBookmarklet": True
         }
+        duplicate = not ingest_captured_jobs([new_job])
 
-        saved.append(new_job)
-        with open(jobs_file, "w") as f:
-            json.dump(saved, f)
-
-        resp = jsonify({"success": True, "job": new_job})
+        resp = jsonify({"success": True, "duplicate": duplicate, "job": new_job})
         resp.headers["Access-Control-Allow-Origin"] = "*"
         return resp
 
@@ -2448,31 +5401,18 @@ def bookmarklet_add():
 
 @app.route("/api/pending-count", methods=["GET"])
 def pending_count():
-    """Returns how many jobs are queued — does NOT clear the file"""
-    import json, os
-    jobs_file = os.path.join(BASE_DIR, "bookmarked_jobs.json")
-    if not os.path.exists(jobs_file):
-        return jsonify({"count": 0})
+    """Returns how many jobs are queued — does NOT drain the queue"""
     try:
-        saved = json.load(open(jobs_file))
-        return jsonify({"count": len(saved)})
-    except:
+        return jsonify({"count": bookmark_pending_count()})
+    except sqlite3.Error:
         return jsonify({"count": 0})
 
 
 @app.route("/api/bookmarklet-jobs", methods=["GET"])
 def bookmarklet_jobs():
-    """Frontend calls this to pull queued jobs — clears file after sending"""
-    import json, os
-    jobs_file = os.path.join(BASE_DIR, "bookmarked_jobs.json")
-    if not os.path.exists(jobs_file):
-        return jsonify({"jobs": []})
+    """Frontend calls this to pull queued jobs — drains the queue atomically"""
     try:
-        with open(jobs_file, "r") as f:
-            saved = json.load(f)
-        with open(jobs_file, "w") as f:
-            json.dump([], f)
-        return jsonify({"jobs": saved})
+        return jsonify({"jobs": bookmark_drain()})
     except Exception as e:
         return jsonify({"jobs": [], "error": str(e)})
 
@@ -2494,54 +5434,22 @@ def bookmarklet_bulk():
         resp.headers["Access-Control-Allow-Origin"] = "*"
         return resp, 400
 
-    import json, os, time
-    from datetime import date
-
-    jobs_file = os.path.join(BASE_DIR, "bookmarked_jobs.json")
-
     try:
-        if os.path.exists(jobs_file):
-            with open(jobs_file, "r") as f:
-                saved = json.load(f)
-        else:
-            saved = []
-
-        # Avoid duplicates by URL or title+company combo
-        seen_urls = set()
-        seen_tc   = set()
-        for j in saved:
-            u = j.get("url","").split("?")[0]
-            tc = (j.get("role","").strip().lower() + "|" + j.get("company","").strip().lower())
-            if u: seen_urls.add(u)
-            seen_tc.add(tc)
-
-        added = 0
-        for job in incoming_jobs:
-            u  = job.get("url","").split("?")[0]
-            tc = (job.get("role","").strip().lower() + "|" + job.get("company","").strip().lower())
-            if (u and u in seen_urls) or tc in seen_tc:
-                continue
-            new_job = {
-                "id": int(time.time() * 1000) + added,
-                "role": job.get("role", "").strip(),
-                "company": job.get("company", "").strip(),
-                "jd": job.get("jd", ""),
-                "location": job.get("location", "Singapore"),
-                "url": job.get("url", ""),
-                "status": "wishlist",
-                "date": date.today().strftime("%d/%m/%Y"),
-                "notes": "",
-                "salary": "",
-                "isDemo": False,
-                "fromBookmarklet": True
-            }
-            saved.append(new_job)
-            if u: seen_urls.add(u)
-            seen_tc.add(tc)
-            added += 1
-
-        with open(jobs_file, "w") as f:
-            json.dump(saved, f)
+        now_ms = int(time.time() * 1000)
+        added = len(ingest_captured_jobs([{
+            "id": now_ms + i,
+            "role": job.get("role", "").strip(),
+            "company": job.get("company", "").strip(),
+            "jd": job.get("jd", ""),
+            "location": job.get("location", "Singapore"),
+            "url": job.get("url", ""),
+            "status": "wishlist",
+            "date": datetime.date.today().strftime("%d/%m/%Y"),
+            "notes": "",
+            "salary": "",
+            "isDemo": False,
+            "fromBookmarklet": True
+        } for i, job in enumerate(incoming_jobs)]))
 
         resp = jsonify({"success": True, "count": added, "total": len(incoming_jobs)})
         resp.headers["Access-Control-Allow-Origin"] = "*"
@@ -2572,38 +5480,22 @@ def capture():
     if not company:
         company = "Unknown Company"
 
-    import json, os, time
-    from datetime import date
-
-    jobs_file = os.path.join(BASE_DIR, "bookmarked_jobs.json")
-    try:
-        existing = json.load(open(jobs_file)) if os.path.exists(jobs_file) else []
-    except:
-        existing = []
-
-    # Dedup check
-    clean_url = url.split("?")[0]
-    already = any(j.get("url","").split("?")[0] == clean_url or
-                  (j.get("role","") == title and j.get("company","") == company)
-                  for j in existing)
+    already = not ingest_captured_jobs([{
+        "id": int(time.time() * 1000),
+        "role": title,
+        "company": company,
+        "location": location,
+        "url": url,
+        "jd": jd,
+        "status": "wishlist",
+        "date": datetime.date.today().strftime("%d/%m/%Y"),
+        "notes": "",
+        "salary": "",
+        "isDemo": False,
+        "fromBookmarklet": True
+    }])
 
     if not already:
-        existing.append({
-            "id": int(time.time() * 1000),
-            "role": title,
-            "company": company,
-            "location": location,
-            "url": url,
-            "jd": jd,
-            "status": "wishlist",
-            "date": date.today().strftime("%d/%m/%Y"),
-            "notes": "",
-            "salary": "",
-            "isDemo": False,
-            "fromBookmarklet": True
-        })
-        with open(jobs_file, "w") as f:
-            json.dump(existing, f)
         msg = f"✅ <strong>{title}</strong> at <strong>{company}</strong> added to your Job Tracker!"
         color = "#15803d"
     else:
@@ -2642,70 +5534,196 @@ def capture():
 
 @app.route("/capture-bulk", methods=["POST"])
 def capture_bulk():
-    import json, os, time
-    from datetime import date
-
     raw = request.form.get("jobs", "[]")
     try:
         incoming = json.loads(raw)
-    except:
+    except ValueError:
         return "Invalid data", 400
 
-    jobs_file = os.path.join(BASE_DIR, "bookmarked_jobs.json")
+    now_ms = int(time.time() * 1000)
+    added = len(ingest_captured_jobs([{
+        "id": now_ms + i,
+        "role": job.get("role","").strip(),
+        "company": job.get("company","").strip(),
+        "location": job.get("location","Singapore"),
+        "url": job.get("url",""),
+        "jd": "",
+        "status": "wishlist",
+        "roleType": job.get("roleType","Business Analyst"),
+        "priority": job.get("priority","Medium"),
+        "source": "LinkedIn",
+        "dateApplied": datetime.date.today().isoformat(),
+        "notes": "", "salary": "", "isDemo": False,
+        "fromBookmarklet": True, "checklist": {}
+    } for i, job in enumerate(incoming)]))
+
+    # Redirect back to the tracker — user lands there and clicks "Import Pending Jobs"
+    return redirect(f"/?imported={added}")
+
+
+# ═══════════════════════════════════════════════════════════════
+# JOB DISCOVERY — Scrape LinkedIn, Workable, MyCareersFuture + more
+# ═══════════════════════════════════════════════════════════════
+
+import urllib.parse
+import re as _re
+import datetime as _dt
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+# ─── HTML EXTRACTION ─────────────────────────────────────────────────────────
+# Scrapers used to build a BeautifulSoup tree with the pure-Python
+# html.parser for every job description and results page. These helpers
+# parse with lxml (libxml2, already a dependency) and query through XPath
+# compiled once at import — cssselect isn't installed, so each CSS selector
+# the scrapers used is spelled out as its XPath equivalent. node_text()
+# reproduces get_text(separator, strip=True): every text node stripped,
+# empties dropped, script/style/comment text skipped. bench_hot_paths.py
+# checks the extracted fields against the BeautifulSoup versions and times
+# both.
+
+from lxml import etree as _etree
+
+_html_parsers = threading.local()       # lxml parser objects are not thread-safe
+
+
+def _parse_html(markup):
+    """lxml root element for a page or fragment, or None if there is nothing to parse."""
+    if not markup or not markup.strip():
+        return None
+    parser = getattr(_html_parsers, "parser", None)
+    if parser is None:
+        parser = _html_parsers.parser = _etree.HTMLParser(encoding="utf-8")
     try:
-        existing = json.load(open(jobs_file)) if os.path.exists(jobs_file) else []
-    except:
-        existing = []
-
-    # Build lookup sets for both URL and title+company
-    seen_urls = set()
-    seen_tc   = set()
-    for j in existing:
-        u = j.get("url","").split("?")[0]
-        tc = (j.get("role","").strip().lower() + "|" + j.get("company","").strip().lower())
-        if u: seen_urls.add(u)
-        seen_tc.add(tc)
+        return _etree.fromstring(markup.encode("utf-8", "replace"), parser)
+    except _etree.XMLSyntaxError:
+        return None
 
-    added = 0
-    for job in incoming:
-        u  = job.get("url","").split("?")[0]
-        tc = (job.get("role","").strip().lower() + "|" + job.get("company","").strip().lower())
-        if (u and u in seen_urls) or tc in seen_tc:
-            continue
-        existing.append({
-            "id": int(time.time() * 1000) + added,
-            "role": job.get("role","").strip(),
-            "company": job.get("company","").strip(),
-            "location": job.get("location","Singapore"),
-            "url": job.get("url",""),
-            "jd": "",
-            "status": "wishlist",
-            "roleType": job.get("roleType","Business Analyst"),
-            "priority": job.get("priority","Medium"),
-            "source": "LinkedIn",
-            "dateApplied": date.today().isoformat(),
-            "notes": "", "salary": "", "isDemo": False,
-            "fromBookmarklet": True, "checklist": {}
+
+def _cls(name):
+    """XPath predicate for CSS `.name`."""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+def _xp(expr):
+    return _etree.XPath(expr, smart_strings=False)
+
+
+_TEXT_NODES = _xp("descendant-or-self::text()[not(parent::script or parent::style or parent::template)]")
+
+
+def node_text(el, separator=""):
+    """BeautifulSoup's el.get_text(separator, strip=True) for an lxml element."""
+    if el is None:
+        return ""
+    return separator.join(t for t in (s.strip() for s in _TEXT_NODES(el)) if t)
+
+
+def html_to_text(markup, separator=" "):
+    """BeautifulSoup(markup, "html.parser").get_text(separator, strip=True)."""
+    markup = markup or ""
+    if "<" not in markup and "&" not in markup:
+        return markup.strip()
+    return node_text(_parse_html(markup), separator)
+
+
+def _first(xpath, el):
+    found = xpath(el)
+    return found[0] if found else None
+
+
+# div.base-card, li.result-card, div.job-search-card
+_LI_CARDS = _xp(f"//*[(self::div and ({_cls('base-card')} or {_cls('job-search-card')}))"
+                f" or (self::li and {_cls('result-card')})]")
+# h3.base-search-card__title, h3[class*='title']
+_LI_CARD_TITLE = _xp(f"(.//h3[{_cls('base-search-card__title')} or contains(@class, 'title')])[1]")
+# h4.base-search-card__subtitle, a[class*='company']
+_LI_CARD_COMPANY = _xp(f"(.//*[(self::h4 and {_cls('base-search-card__subtitle')})"
+                       f" or (self::a and contains(@class, 'company'))])[1]")
+# a.base-card__full-link, a[class*='job-card']
+_LI_CARD_LINK = _xp(f"(.//a[{_cls('base-card__full-link')} or contains(@class, 'job-card')])[1]")
+# span.job-search-card__location
+_LI_CARD_LOCATION = _xp(f"(.//span[{_cls('job-search-card__location')}])[1]")
+_LI_CARD_TIME = _xp("(.//time)[1]")
+
+
+def linkedin_job_cards(markup, limit=None):
+    """Job cards from a LinkedIn guest/public search page: dicts with title,
+    company, href, location (None when the card has none) and datetime."""
+    root = _parse_html(markup)
+    if root is None:
+        return []
+    cards = []
+    for card in _LI_CARDS(root)[:limit]:
+        link = _first(_LI_CARD_LINK, card)
+        loc = _first(_LI_CARD_LOCATION, card)
+        time_el = _first(_LI_CARD_TIME, card)
+        cards.append({
+            "title": node_text(_first(_LI_CARD_TITLE, card)),
+            "company": node_text(_first(_LI_CARD_COMPANY, card)),
+            "href": link.get("href", "") if link is not None else "",
+            "location": node_text(loc) if loc is not None else None,
+            "datetime": time_el.get("datetime") if time_el is not None else None,
         })
-        if u: seen_urls.add(u)
-        seen_tc.add(tc)
-        added += 1
+    return cards
 
-    with open(jobs_file, "w") as f:
-        json.dump(existing, f)
 
-    # Redirect back to the tracker — user lands there and clicks "Import Pending Jobs"
-    return redirect(f"/?imported={added}")
+_LD_JSON_SCRIPTS = _xp("//script[@type='application/ld+json']")
+# a[href*='/j/'], a[href*='/view/']
+_WORKABLE_LINKS = _xp("//a[contains(@href, '/j/') or contains(@href, '/view/')]")
 
 
-# ═══════════════════════════════════════════════════════════════
-# JOB DISCOVERY — Scrape LinkedIn, Workable, MyCareersFuture + more
-# ═══════════════════════════════════════════════════════════════
+def workable_page_parts(markup):
+    """(JSON-LD script bodies, [(href, link text)]) from a Workable search page."""
+    root = _parse_html(markup)
+    if root is None:
+        return [], []
+    scripts = [s.text or "" for s in _LD_JSON_SCRIPTS(root)]
+    links = [(a.get("href", ""), node_text(a)) for a in _WORKABLE_LINKS(root)]
+    return scripts, links
 
-import urllib.parse
-import re as _re
-import datetime as _dt
-from concurrent.futures import ThreadPoolExecutor, as_completed
+
+_JD_SELECTORS = {
+    "linkedin.com": [f"//*[{_cls('description__text')}]", f"//*[{_cls('show-more-less-html__markup')}]",
+                     "//*[contains(@class, 'description')]", f"//section[{_cls('description')}]"],
+    "indeed.com":   ["//*[@id='jobDescriptionText']", f"//*[{_cls('jobsearch-jobDescriptionText')}]",
+                     "//*[contains(@class, 'description')]"],
+    "mycareersfuture.gov.sg": ["//*[contains(@class, 'job-description')]", "//*[contains(@class, 'description')]",
+                               "//article"],
+}
+_JD_SELECTORS = {site: [_xp(f"({x})[1]") for x in xs] for site, xs in _JD_SELECTORS.items()}
+# h1.top-card-layout__title, h1[class*='title']
+_JD_LI_TITLE = _xp(f"(//h1[{_cls('top-card-layout__title')} or contains(@class, 'title')])[1]")
+# a.topcard__org-name-link, [class*='company-name']
+_JD_LI_COMPANY = _xp(f"(//*[(self::a and {_cls('topcard__org-name-link')})"
+                     f" or contains(@class, 'company-name')])[1]")
+_JD_BLOCKS = _xp("(//*[self::article or self::section or self::div])[position() <= 20]")
+
+
+def extract_jd_from_page(markup, url):
+    """(jd, title, company) from a job page using the per-site selectors, or
+    the first long article/section/div that reads like a JD."""
+    root = _parse_html(markup)
+    if root is None:
+        return "", "", ""
+    jd = title = company = ""
+    selectors = next((v for k, v in _JD_SELECTORS.items() if k in url), None)
+    if selectors:
+        for xpath in selectors:
+            el = _first(xpath, root)
+            if el is not None and len(node_text(el)) > 100:
+                jd = node_text(el, "\n")[:5000]
+                break
+        if "linkedin.com" in url:
+            title = node_text(_first(_JD_LI_TITLE, root))
+            company = node_text(_first(_JD_LI_COMPANY, root))
+    else:
+        for tag in _JD_BLOCKS(root):
+            text = node_text(tag)
+            if len(text) > 500 and any(kw in text.lower() for kw in ["responsibilities", "requirements", "qualifications"]):
+                jd = text[:5000]
+                break
+    return jd, title, company
 
 
 def _scrape_mycareersfuture(keywords, location, max_days):
@@ -2714,9 +5732,9 @@ def _scrape_mycareersfuture(keywords, location, max_days):
     try:
         query = urllib.parse.quote_plus(keywords)
         # MCF API supports pagination (limit up to 100), sorted by newest
-        api_url = f"https://api.mycareersfuture.gov.sg/v2/jobs?search={query}&limit=50&page=0&sortBy=new_posting_date"
+        api_url = f"{MCF_API_BASE}/v2/jobs?search={query}&limit=50&page=0&sortBy=new_posting_date"
 
-        resp = http_requests.get(api_url, headers={
+        resp = _upstream_request("mcf", "GET", api_url, headers={
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
             "Accept": "application/json",
         }, timeout=20)
@@ -2742,8 +5760,7 @@ def _scrape_mycareersfuture(keywords, location, max_days):
 
                 # Description (HTML) — strip tags for plain text
                 desc_html = item.get("description", "") or ""
-                from bs4 import BeautifulSoup
-                desc_text = BeautifulSoup(desc_html, "html.parser").get_text(separator=" ", strip=True)[:4000]
+                desc_text = html_to_text(desc_html)[:4000]
 
                 # Posted date → days ago
                 posted = item.get("metadata", {}).get("newPostingDate", "")
@@ -2795,7 +5812,8 @@ def _apify_run_actor(actor_id, run_input, max_results=50):
     try:
         import time as _t
         # Start actor run
-        start_resp = http_requests.post(
+        start_resp = _upstream_request(
+            "apify", "POST",
             f"https://api.apify.com/v2/acts/{actor_id}/runs",
             headers={"Authorization": f"Bearer {APIFY_API_KEY}"},
             json=run_input,
@@ -2810,7 +5828,8 @@ def _apify_run_actor(actor_id, run_input, max_results=50):
         # Poll for completion (max 60s)
         for _ in range(20):
             _t.sleep(3)
-            status_resp = http_requests.get(
+            status_resp = _upstream_request(
+                "apify", "GET",
                 f"https://api.apify.com/v2/acts/{actor_id}/runs/{run_id}",
                 headers={"Authorization": f"Bearer {APIFY_API_KEY}"},
                 timeout=15
@@ -2824,7 +5843,8 @@ def _apify_run_actor(actor_id, run_input, max_results=50):
 
         # Fetch results
         dataset_id = status_resp.json().get("data", {}).get("defaultDatasetId")
-        items_resp = http_requests.get(
+        items_resp = _upstream_request(
+            "apify", "GET",
             f"https://api.apify.com/v2/datasets/{dataset_id}/items?limit={max_results}",
             headers={"Authorization": f"Bearer {APIFY_API_KEY}"},
             timeout=20
@@ -2954,7 +5974,6 @@ def _scrape_linkedin_guest(keywords, location, max_days):
 
     jobs = []
     try:
-        from bs4 import BeautifulSoup
         query = urllib.parse.quote_plus(keywords)
         loc = urllib.parse.quote_plus(location)
         time_filter = "r86400" if max_days <= 1 else "r604800" if max_days <= 7 else "r2592000"
@@ -2967,28 +5986,21 @@ def _scrape_linkedin_guest(keywords, location, max_days):
         # LinkedIn guest API returns 10 per page — fetch 3 pages = 30 jobs
         for start in [0, 10, 20]:
             try:
-                url = (f"https://www.linkedin.com/jobs-guest/jobs/api/seeMoreJobPostings/search"
+                url = (f"{LINKEDIN_BASE}/jobs-guest/jobs/api/seeMoreJobPostings/search"
                        f"?keywords={query}&location={loc}&f_TPR={time_filter}&start={start}")
-                resp = http_requests.get(url, headers=headers, timeout=15)
+                resp = _upstream_request("linkedin_guest", "GET", url, headers=headers, timeout=15)
                 if resp.status_code != 200:
                     continue
-                soup = BeautifulSoup(resp.text, "html.parser")
-                cards = soup.select("div.base-card, li.result-card, div.job-search-card")
-                for card in cards:
+                for card in linkedin_job_cards(resp.text):
                     try:
-                        title_el = card.select_one("h3.base-search-card__title, h3[class*='title']")
-                        title = title_el.get_text(strip=True) if title_el else ""
-                        company_el = card.select_one("h4.base-search-card__subtitle, a[class*='company']")
-                        company = company_el.get_text(strip=True) if company_el else ""
-                        link_el = card.select_one("a.base-card__full-link, a[class*='job-card']")
-                        href = link_el.get("href", "") if link_el else ""
-                        loc_el = card.select_one("span.job-search-card__location")
-                        job_loc = loc_el.get_text(strip=True) if loc_el else location
-                        time_el = card.select_one("time")
+                        title = card["title"]
+                        company = card["company"]
+                        href = card["href"]
+                        job_loc = card["location"] if card["location"] is not None else location
                         days_ago = None
-                        if time_el and time_el.get("datetime"):
+                        if card["datetime"]:
                             try:
-                                pd = _dt.datetime.strptime(time_el["datetime"][:10], "%Y-%m-%d")
+                                pd = _dt.datetime.strptime(card["datetime"][:10], "%Y-%m-%d")
                                 days_ago = (_dt.datetime.now() - pd).days
                             except Exception:
                                 pass
@@ -3019,7 +6031,7 @@ def _scrape_workable(keywords, location, max_days):
     jobs = []
     try:
         # Workable has a search API
-        api_url = "https://jobs.workable.com/api/v1/jobs"
+        api_url = f"{WORKABLE_BASE}/api/v1/jobs"
         params = {
             "query": keywords,
             "location": location,
@@ -3062,21 +6074,20 @@ def _scrape_workable(keywords, location, max_days):
 
         # Fallback: HTML scraping
         if not jobs:
-            from bs4 import BeautifulSoup
             query = urllib.parse.quote_plus(keywords)
             loc = urllib.parse.quote_plus(location)
-            url = f"https://jobs.workable.com/?query={query}&location={loc}"
+            url = f"{WORKABLE_BASE}/?query={query}&location={loc}"
             try:
                 resp = http_requests.get(url, headers={
                     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
                     "Accept": "text/html",
                 }, timeout=15)
-                soup = BeautifulSoup(resp.text, "html.parser")
+                ld_scripts, links = workable_page_parts(resp.text)
 
                 # Try JSON-LD
-                for script in soup.find_all("script", type="application/ld+json"):
+                for script in ld_scripts:
                     try:
-                        ld_data = json.loads(script.string or "")
+                        ld_data = json.loads(script)
                         if isinstance(ld_data, list):
                             for jp in ld_data:
                                 if jp.get("@type") == "JobPosting" and jp.get("title"):
@@ -3094,13 +6105,10 @@ def _scrape_workable(keywords, location, max_days):
 
                 # Try links
                 if not jobs:
-                    all_links = soup.select("a[href*='/j/'], a[href*='/view/']")
                     seen = set()
-                    for link in all_links[:30]:
-                        href = link.get("href", "")
+                    for href, title_text in links[:30]:
                         if href and href not in seen:
                             seen.add(href)
-                            title_text = link.get_text(strip=True)
                             if 3 < len(title_text) < 200:
                                 full_url = href if href.startswith("http") else f"https://jobs.workable.com{href}"
                                 jobs.append({
@@ -3129,7 +6137,7 @@ def _scrape_linkedin_public(keywords, location, max_days):
         loc = urllib.parse.quote_plus(location)
         # LinkedIn public jobs search — f_TPR=r2592000 = last 30 days
         time_filter = "r86400" if max_days <= 1 else "r604800" if max_days <= 7 else "r2592000"
-        url = f"https://www.linkedin.com/jobs/search/?keywords={query}&location={loc}&f_TPR={time_filter}&position=1&pageNum=0"
+        url = f"{LINKEDIN_BASE}/jobs/search/?keywords={query}&location={loc}&f_TPR={time_filter}&position=1&pageNum=0"
 
         headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
@@ -3137,21 +6145,14 @@ def _scrape_linkedin_public(keywords, location, max_days):
             "Accept-Language": "en-US,en;q=0.9",
         }
 
-        from bs4 import BeautifulSoup
-        resp = http_requests.get(url, headers=headers, timeout=20, allow_redirects=True)
+        resp = _upstream_request("linkedin_guest", "GET", url, headers=headers, timeout=20, allow_redirects=True)
         if resp.status_code == 200:
-            soup = BeautifulSoup(resp.text, "html.parser")
-            cards = soup.select("div.base-card, li.result-card, div.job-search-card")
-            for card in cards[:30]:
+            for card in linkedin_job_cards(resp.text, limit=30):
                 try:
-                    title_el = card.select_one("h3.base-search-card__title, h3[class*='title']")
-                    title = title_el.get_text(strip=True) if title_el else ""
-                    company_el = card.select_one("h4.base-search-card__subtitle, a[class*='company']")
-                    company = company_el.get_text(strip=True) if company_el else ""
-                    link_el = card.select_one("a.base-card__full-link, a[class*='job-card']")
-                    href = link_el.get("href", "") if link_el else ""
-                    loc_el = card.select_one("span.job-search-card__location")
-                    job_loc = loc_el.get_text(strip=True) if loc_el else location
+                    title = card["title"]
+                    company = card["company"]
+                    href = card["href"]
+                    job_loc = card["location"] if card["location"] is not None else location
 
                     if title:
                         jobs.append({
@@ -3187,10 +6188,10 @@ def _scrape_mcf_extended(keywords, location, max_days):
 
         for search_term in related_searches[:2]:
             query = urllib.parse.quote_plus(search_term)
-            api_url = f"https://api.mycareersfuture.gov.sg/v2/jobs?search={query}&limit=25&page=0&sortBy=new_posting_date"
+            api_url = f"{MCF_API_BASE}/v2/jobs?search={query}&limit=25&page=0&sortBy=new_posting_date"
 
             try:
-                resp = http_requests.get(api_url, headers={
+                resp = _upstream_request("mcf", "GET", api_url, headers={
                     "User-Agent": "Mozilla/5.0",
                     "Accept": "application/json",
                 }, timeout=15)
@@ -3213,8 +6214,7 @@ def _scrape_mcf_extended(keywords, location, max_days):
                                 salary_str = f"${sal_min}-${sal_max}"
 
                         desc_html = item.get("description", "") or ""
-                        from bs4 import BeautifulSoup
-                        desc_text = BeautifulSoup(desc_html, "html.parser").get_text(separator=" ", strip=True)[:4000]
+                        desc_text = html_to_text(desc_html)[:4000]
 
                         posted = item.get("metadata", {}).get("newPostingDate", "")
                         days_ago = None
@@ -3245,92 +6245,235 @@ def _scrape_mcf_extended(keywords, location, max_days):
     return jobs, None
 
 
-def _ai_score_discovered_jobs(jobs_list):
-    """Score discovered jobs with AI using active profile context. Processes in batches of 15."""
-    if not jobs_list:
-        return jobs_list
-    
-    # Only score jobs that have some useful text (title/company at minimum)
-    to_score = [j for j in jobs_list if j.get("role")]
-    if not to_score:
-        return jobs_list
+# ─── BATCHED AI SCORING (shared by discovery and the agent) ──────────────────
+# Jobs are packed into batches sized to a per-call token budget (prompt +
+# expected JSON output), each returned item is validated on its own, and only
+# the items that came back missing or malformed are retried. Replies are
+# parsed element by element so one bad object (or a truncated tail) doesn't
+# cost the whole batch, and the batch size adapts to how cleanly the model
+# has been answering.
 
-    # Get active profile for personalized scoring
-    profile = get_active_profile()
-    profile_summary = f"{profile.get('name', 'Candidate')} — {profile.get('headline', 'Professional')}. Skills: {', '.join(profile.get('skills', [])[:10])}. {profile.get('summary', '')[:200]}"
+SCORE_BATCH_TOKEN_BUDGET = int(os.environ.get("SCORE_BATCH_TOKEN_BUDGET", "4000"))
+SCORE_BATCH_MAX_JOBS     = int(os.environ.get("SCORE_BATCH_MAX_JOBS", "20"))
+SCORE_BATCH_MIN_JOBS     = 3
+SCORE_OUTPUT_TOKENS_PER_JOB = 90
+_SCORE_PRIORITIES = ("Apply Today", "Apply This Week", "Lower Priority", "Skip")
+
+
+def _salvage_json_array(text):
+    """
+    Tolerant JSON-array reader: returns (objects, complete) where `objects`
+    is every well-formed {...} element found after the opening '[' and
+    `complete` is False when the array was cut off (no closing ']').
+    Malformed elements are skipped instead of failing the whole reply.
+    """
+    decoder = json.JSONDecoder()
+    text = _re.sub(r'```json|```', '', text or "")
+    start = text.find("[")
+    if start == -1:
+        return [], False
+    items, pos, n = [], start + 1, len(text)
+    while pos < n:
+        while pos < n and text[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= n:
+            break
+        if text[pos] == "]":
+            return items, True
+        if text[pos] == "{":
+            try:
+                obj, end = decoder.raw_decode(text, pos)
+                items.append(obj)
+                pos = end
+                continue
+            except ValueError:
+                pass
+        # Malformed element — resync at the next object start
+        nxt = text.find("{", pos + 1)
+        if nxt == -1:
+            break
+        pos = nxt
+    return items, False
 
-    BATCH_SIZE = 15
-    for batch_start in range(0, len(to_score), BATCH_SIZE):
-        batch = to_score[batch_start:batch_start + BATCH_SIZE]
 
-        # Build compact job batch for AI
-        batch_text = ""
-        for i, j in enumerate(batch):
-            jd_snippet = (j.get("jd", "") or "")[:200]
-            batch_text += f"\nJOB {i+1}: {j.get('role','')} at {j.get('company','')} ({j.get('platform','')}) — {jd_snippet}\n---"
+class _AdaptiveBatchSizer:
+    """Additive-increase / multiplicative-decrease cap on jobs per scoring call."""
 
-        prompt = f"""You are a career coach for the Singapore job market.
+    def __init__(self, initial, lo, hi):
+        self.size, self.lo, self.hi = initial, lo, hi
+        self._lock = threading.Lock()
 
-CANDIDATE PROFILE:
-{profile_summary}
+    def record(self, status):
+        with self._lock:
+            if status in ("truncated", "error"):
+                self.size = max(self.lo, self.size // 2)
+            elif status == "clean":
+                self.size = min(self.hi, self.size + 2)
+            return self.size
 
-SCORING RULES:
-- Score 1-10 based on fit with the candidate's profile
-- +2 for in-house product/tech companies, -2 for consulting firms (max 4/10)
-- Score 0 if "no visa sponsorship" detected
-- Score 1-2 MAX for pure software engineering/developer roles (e.g. Software Engineer, Frontend Developer, Backend Engineer, DevOps, SRE) — these are NOT a match for BA/PM/PO profiles
-- Score 1-2 MAX for roles requiring 8+ years when candidate has ~5 years
-- Heavily penalise roles that don't match the candidate's core domain (business analysis, product management, digital transformation)
-- Labels: 🔥 Strong Match (9-10), ✅ Good Fit (7-8), 🟡 Possible (5-6), ❌ Weak Fit (1-4)
-- Priority: Apply Today, Apply This Week, Lower Priority, Skip
 
-JOBS:
-{batch_text}
+_score_batch_sizer = _AdaptiveBatchSizer(15, SCORE_BATCH_MIN_JOBS, SCORE_BATCH_MAX_JOBS)
+_score_run_history = deque(maxlen=50)      # per-run calls-per-scored-job, newest last
+_score_totals = {"runs": 0, "jobs": 0, "scored": 0, "calls": 0}
 
-Return ONLY a JSON array (no markdown), one object per job:
-[{{"idx": 0, "score": 8, "label": "✅ Good Fit", "reason": "Two sentences.", "priority": "Apply This Week"}}]
-Score every single job listed ({len(batch)} jobs). Use idx starting from 0."""
 
-        try:
-            result = call_claude(prompt)
-            clean = _re.sub(r'```json|```', '', result).strip()
-            rankings = json.loads(clean)
-            for r in rankings:
-                idx = r.get("idx", -1)
-                if 0 <= idx < len(batch):
-                    batch[idx]["aiScore"] = r.get("score")
-                    batch[idx]["aiLabel"] = r.get("label", "")
-                    batch[idx]["aiReason"] = r.get("reason", "")
-                    batch[idx]["aiPriority"] = r.get("priority", "")
-            print(f"[Discovery] Scored batch {batch_start//BATCH_SIZE + 1}: {len(rankings)}/{len(batch)} jobs")
-        except Exception as e:
-            print(f"[Discovery] AI scoring failed for batch {batch_start//BATCH_SIZE + 1}: {e}")
+def _score_job_line(i, j, jd_tokens):
+    jd_snippet = _trim_jd(j.get("jd", "") or "", jd_tokens).replace("\n", " ")
+    return f"\nJOB {i}: {j.get('role','')} at {j.get('company','')} ({j.get('platform','')}) — {jd_snippet}\n---"
+
+
+def _validate_score_item(r, n):
+    """Return (idx, cleaned) for a well-formed ranking item, else None."""
+    if not isinstance(r, dict):
+        return None
+    try:
+        idx = int(r.get("idx"))
+        score = float(r.get("score"))
+    except (TypeError, ValueError):
+        return None
+    if not (0 <= idx < n) or not (0 <= score <= 10):
+        return None
+    priority = r.get("priority", "")
+    if priority not in _SCORE_PRIORITIES:
+        priority = next((p for p in _SCORE_PRIORITIES if p.lower() in str(priority).lower()), "")
+    score = int(score) if score == int(score) else round(score, 1)
+    return idx, {"aiScore": score, "aiLabel": str(r.get("label", "")),
+                 "aiReason": str(r.get("reason", "")), "aiPriority": priority}
+
+
+def _next_score_batch(queue, prefix_tokens, jd_tokens):
+    """Pop the next batch off `queue`: fits SCORE_BATCH_TOKEN_BUDGET and the adaptive size cap."""
+    cap = _score_batch_sizer.size
+    batch, tokens = [], prefix_tokens
+    while queue and len(batch) < cap:
+        t = _estimate_tokens(_score_job_line(len(batch), queue[0], jd_tokens)) + SCORE_OUTPUT_TOKENS_PER_JOB
+        if batch and tokens + t > SCORE_BATCH_TOKEN_BUDGET:
+            break
+        batch.append(queue.pop(0))
+        tokens += t
+    return batch
+
+
+def _score_batch_once(batch, P, jd_tokens, tag):
+    """
+    One LLM call for `batch`. Applies valid items in place and returns
+    (jobs left unscored, status) — status is clean / partial / truncated / error.
+    """
+    batch_text = "".join(_score_job_line(i, j, jd_tokens) for i, j in enumerate(batch))
+    prompt = build_prompt("batch_score", P, count=len(batch), jobs=batch_text)
+    result = call_claude(prompt, max_tokens=160 + SCORE_OUTPUT_TOKENS_PER_JOB * len(batch), route="batch_score")
+    if result.startswith("Error:"):
+        print(f"[{tag}] Batch of {len(batch)} failed: {result[:120]}")
+        return list(batch), "error"
+    rankings, complete = _salvage_json_array(result)
+    done = set()
+    for r in rankings:
+        item = _validate_score_item(r, len(batch))
+        if item and item[0] not in done:
+            batch[item[0]].update(item[1])
+            done.add(item[0])
+    left = [j for i, j in enumerate(batch) if i not in done]
+    if not complete:
+        status = "truncated" if rankings else "error"
+    else:
+        status = "partial" if left else "clean"
+    return left, status
 
-    # Second pass: retry any unscored jobs individually
-    unscored = [j for j in to_score if j.get("aiScore") is None and j.get("role")]
-    if unscored:
-        print(f"[Discovery] Retrying {len(unscored)} unscored jobs individually...")
-        for j in unscored[:10]:  # Limit retries
+
+def score_jobs_batched(jobs, P=None, jd_tokens=50, tag="Scoring", single_retries=10):
+    """
+    Score `jobs` in place (aiScore/aiLabel/aiReason/aiPriority) with as few
+    LLM calls as the token budget allows. Failed items get one batched retry,
+    then up to `single_retries` individual attempts.
+    Returns {"scored", "failed", "calls"}.
+    """
+    jobs = [j for j in jobs if j.get("role")]
+    if not jobs:
+        return {"scored": 0, "failed": 0, "calls": 0}
+    P = P or get_active_profile()
+    prefix_tokens = _estimate_tokens(get_prompt_prefix("batch_score", P))
+    calls = 0
+
+    pending = jobs
+    for attempt in range(2):
+        failed, queue = [], list(pending)
+        while queue:
+            metrics.set("jobhunt_queue_depth", len(queue), {"queue": "score_batch"})
+            batch = _next_score_batch(queue, prefix_tokens, jd_tokens)
+            left, status = _score_batch_once(batch, P, jd_tokens, tag)
+            calls += 1
+            size = _score_batch_sizer.record(status)
+            print(f"[{tag}] Batch{' (retry)' if attempt else ''}: {len(batch) - len(left)}/{len(batch)} scored "
+                  f"[{status}] — next batch size {size}")
+            failed.extend(left)
+        pending = failed
+        if not pending:
+            break
+    metrics.set("jobhunt_queue_depth", 0, {"queue": "score_batch"})
+
+    if pending and single_retries:
+        print(f"[{tag}] Retrying {min(len(pending), single_retries)} unscored jobs individually...")
+        for j in pending[:single_retries]:
+            prompt = build_prompt("score", P, role=j.get('role', ''), company=j.get('company', ''),
+                                  jd=_trim_jd(j.get("jd", "") or "", jd_tokens + 25))
+            result = call_claude(prompt, route="score")
+            calls += 1
             try:
-                jd_snippet = (j.get("jd", "") or "")[:300]
-                mini_prompt = f"""Score this job for: {profile_summary}
-Job: {j.get('role','')} at {j.get('company','')} — {jd_snippet}
-Return ONLY JSON: {{"score": 7, "label": "✅ Good Fit", "reason": "Two sentences.", "priority": "Apply This Week"}}"""
-                result = call_claude(mini_prompt)
-                clean = _re.sub(r'```json|```', '', result).strip()
-                m = _re.search(r'\{.*\}', clean, _re.DOTALL)
-                if m:
-                    scored = json.loads(m.group())
-                    j["aiScore"] = scored.get("score")
-                    j["aiLabel"] = scored.get("label", "")
-                    j["aiReason"] = scored.get("reason", "")
-                    j["aiPriority"] = scored.get("priority", "")
+                m = _re.search(r'\{.*\}', _re.sub(r'```json|```', '', result), _re.DOTALL)
+                item = _validate_score_item(dict(json.loads(m.group()), idx=0), 1) if m else None
+                if item:
+                    j.update(item[1])
             except Exception:
                 pass
+        pending = [j for j in pending if j.get("aiScore") is None]
+
+    scored = len(jobs) - len(pending)
+    _score_run_history.append({
+        "ts": _dt.datetime.utcnow().isoformat(timespec="seconds"), "tag": tag,
+        "jobs": len(jobs), "scored": scored, "calls": calls,
+        "calls_per_scored_job": round(calls / scored, 3) if scored else None,
+        "batch_size": _score_batch_sizer.size,
+    })
+    for k, v in (("runs", 1), ("jobs", len(jobs)), ("scored", scored), ("calls", calls)):
+        _score_totals[k] += v
+    return {"scored": scored, "failed": len(pending), "calls": calls}
+
+
+def scoring_stats():
+    totals = dict(_score_totals)
+    totals["calls_per_scored_job"] = round(totals["calls"] / totals["scored"], 3) if totals["scored"] else None
+    return {"batch_size": _score_batch_sizer.size, "totals": totals, "history": list(_score_run_history)}
 
+
+def _ai_score_discovered_jobs(jobs_list):
+    """Score discovered jobs with AI using active profile context (batched, see score_jobs_batched)."""
+    if not jobs_list:
+        return jobs_list
+
+    # Only score jobs that have some useful text (title/company at minimum)
+    to_score = [j for j in jobs_list if j.get("role") and j.get("aiScore") is None]
+    if to_score:
+        stats = score_jobs_batched(to_score, get_active_profile(), jd_tokens=50, tag="Discovery")
+        print(f"[Discovery] Scored {stats['scored']}/{len(to_score)} jobs in {stats['calls']} calls")
     return jobs_list
 
 
+def _dedup_discovered_jobs(jobs):
+    """Drop repeats across scrapers by query-less URL or role|company, keeping the first."""
+    seen_urls, seen_tc = set(), set()
+    unique = []
+    for j in jobs:
+        url = (j.get("url") or "").split("?")[0]
+        tc = f"{(j.get('role') or '').lower().strip()}|{(j.get('company') or '').lower().strip()}"
+        if (url and url in seen_urls) or tc in seen_tc:
+            continue
+        if url:
+            seen_urls.add(url)
+        seen_tc.add(tc)
+        unique.append(j)
+    return unique
+
+
 @app.route("/api/discover-jobs", methods=["POST"])
 def discover_jobs():
     """Search multiple job platforms and return AI-scored results."""
@@ -3376,20 +6519,7 @@ def discover_jobs():
             except Exception as e:
                 details[platform] = {"count": 0, "error": str(e)}
 
-    # Deduplicate by URL
-    seen_urls = set()
-    unique_jobs = []
-    for j in all_jobs:
-        clean_url = (j.get("url") or "").split("?")[0]
-        tc = (j.get("role", "").lower() + "|" + j.get("company", "").lower())
-        if clean_url and clean_url in seen_urls:
-            continue
-        if tc in seen_urls:
-            continue
-        if clean_url:
-            seen_urls.add(clean_url)
-        seen_urls.add(tc)
-        unique_jobs.append(j)
+    unique_jobs = _dedup_discovered_jobs(all_jobs)
 
     # Filter old jobs if we have date info
     if max_days:
@@ -3505,52 +6635,14 @@ def bulk_apply():
         try:
             ai_role = is_ai_role(jd, role_type)
             P = get_active_profile()
-            framing = build_product_framing(P)
 
             # Rate limit: 2s between each job's API calls (= ~20 req/min, under Groq limit)
             if api_call_count > 0:
                 _time2.sleep(2)
 
             # Generate resume via AI
-            resume_prompt = f"""Write a complete 2-page ATS resume for {P['name']} targeting: {role} at {company}.
-JOB DESCRIPTION: {jd[:2000]}
-"(AI & Personal Projects section will be added automatically)"
-
-Use this master data — select bullets most relevant to the JD:
-Contact: {P.get('mobile','')} | {P.get('email','')} | {P.get('linkedin','')}
-Address: {P.get('address','')}
-
-KPMG Singapore Feb 2021–Present bullets pool (pick 6-8):
-- Defined and drove product vision, roadmap and delivery strategy for large-scale digital transformation for financial institutions
-- Owned and prioritised product backlog ensuring alignment with business objectives, regulatory requirements and customer experience goals
-- Drove product scope decisions through impact analysis generating ~5% additional business value
-- Led sprint ceremonies (Planning, Reviews, Retros, PI Planning) across multi-squad programme, 30% velocity increase
-- Managed 3rd party vendors, go-live planning, data migrations from legacy systems, 99.9% uptime
-- Designed end-to-end test scenarios on Loan IQ applications, 25% defect reduction
-- Supported automation and AI-enabled solution design including API integrations, saving 30 man-days
-- Built business cases and executive presentations for new features securing stakeholder approval
-- Collaborated with UX, architecture and engineering teams to deliver scalable digital platforms
-- Drove data-informed product decisions by defining KPIs and analysing performance metrics
-Key Achievements: ~5% project profit from impact analysis | 30 man-days saved via automation | Maintained delivery timeline through critical sprint-to-SIT phase
-
-J.P. Morgan Oct 2023–Jan 2024 (pick 3): Requirements gathering from trading teams | Quantitative analysis of 5 stocks, 10% portfolio value increase | KPI measurement: Annual Return, Variance, Standard Deviation
-
-Amazon India Mar 2018–Mar 2019 (pick 2-3): Power BI dashboards from SQL Server, 20% quality improvement | Functional/non-functional specs with 95% stakeholder satisfaction | Tableau/Power BI data visualisation, 15% efficiency increase
-
-Skills: Agile, SAFe 6.0, JIRA, Tableau, Power BI, PSQL, Python, API integrations, Stakeholder Management, Product Vision, Roadmapping, Business Analysis, Risk Mitigation, Change Management, Budget Forecasting, KPI Tracking, AI-enabled Product Integration, SEO, GEO, CRO, Generative AI, LLM
-Education: MSc Engineering Business Management, Coventry University UK (2019-2020) | BEng Electronics, Anna University India (2012-2016) | SAFe 6.0 Certified
-
-FORMAT (plain text, no markdown):
-Line 1: Amretha Karthikeyan
-Line 2: #02-321 153 Gangsa Road, Singapore-670153
-Line 3: Mobile: +65-90256503, email: amretha.ammu@gmail.com
-Line 4: https://www.linkedin.com/in/amretha-nishanth-534b39101/
-Line 5: [most relevant headline]
-Then: PROFESSIONAL SUMMARY (4 sentences, JD keywords) | SKILL SET (Data visualization tools: ... / Programming: ... / Others: ... / Certification: ...) | PROFESSIONAL EXPERIENCE (company+date bold line, job title on next line, bullets) | ACADEMIC QUALIFICATION
-ALL CAPS section headers. "- " bullets. No slashes on job titles. Target 750-850 words. Do NOT write HEADER. Do NOT mention the target company name anywhere in the resume.
-
-BULLET QUALITY — CRITICAL: Every bullet = [Action verb] + [specific thing] + [real number/%/$] + [business impact]. BANNED: spearheaded, leveraged, transformative, innovative, synergies, holistic, robust, dynamic, customer-centric. Must sound like a real person, not AI."""
-            resume_text = call_claude(resume_prompt)
+            resume_prompt = build_prompt("resume", P, **resume_prompt_fields(role, _trim_jd(jd, 500), job.get("matchedKeywords"), ai_role, P))
+            resume_text = call_claude(resume_prompt, route="resume", job_id=job_id)
             resume_text = _inject_ai_projects(resume_text)
             api_call_count += 1
 
@@ -3560,25 +6652,23 @@ BULLET QUALITY — CRITICAL: Every bullet = [Action verb] + [specific thing] + [
             _time2.sleep(2)
 
             # Generate cover letter via AI
-            cover_prompt = f"""Write a 300-word cover letter for {P['name']} applying to {role} at {company}.
-{framing}
-JOB DESCRIPTION: {jd[:1500]}
-Rules: Plain text only. No bold, no headers. Start with 'Dear Hiring Manager,' on its own line. Be specific to company and role. Include metrics (~5% business value, 30 man-days saved). Never use [URL] or placeholder text — use actual values."""
-            cover_text = call_claude(cover_prompt)
+            cover_prompt = build_prompt("cover_letter", P, **cover_letter_prompt_fields(role, company, _trim_jd(jd, 375), ai_role, P))
+            cover_text = call_claude(cover_prompt, route="cover", job_id=job_id)
             api_call_count += 1
 
             if cover_text.startswith("Error:") or cover_text.startswith("API error:"):
                 raise Exception(f"AI error: {cover_text}")
 
-            # Create .docx
-            resume_bytes = _create_docx_from_text(resume_text)
-            cover_bytes = _create_docx_from_text(cover_text)
+            # Create .docx + pdf/html/md in one pass
+            doc_key = _doc_key_for(job_id, resume_text + cover_text)
+            rendered = _render_and_cache_docs(doc_key, resume_text, cover_text, role, company)
 
             results.append({
                 "id": job_id,
                 "status": "generated",
-                "resume_docx_b64": b64mod.b64encode(resume_bytes).decode(),
-                "cover_docx_b64": b64mod.b64encode(cover_bytes).decode(),
+                "resume_docx_b64": b64mod.b64encode(rendered["resume"]["docx"]).decode(),
+                "cover_docx_b64": b64mod.b64encode(rendered["cover"]["docx"]).decode(),
+                "formats": _doc_format_urls(doc_key),
                 "resume_variant": "AI",
                 "resume_filename": f"Resume_{company.replace(' ','_')}.docx",
                 "cover_filename": f"CoverLetter_{company.replace(' ','_')}.docx",
@@ -3628,8 +6718,9 @@ def send_whatsapp(message):
         # Ensure to/from are prefixed with whatsapp:
         if not to.startswith("whatsapp:"): to = f"whatsapp:{to}"
         if not frm.startswith("whatsapp:"): frm = f"whatsapp:{frm}"
-        url  = f"https://api.twilio.com/2010-04-01/Accounts/{sid}/Messages.json"
-        resp = http_requests.post(url, auth=(sid, token), data={"From": frm, "To": to, "Body": message})
+        url  = f"{TWILIO_API_BASE}/2010-04-01/Accounts/{sid}/Messages.json"
+        resp = _upstream_request("twilio", "POST", url, auth=(sid, token),
+                                 data={"From": frm, "To": to, "Body": message}, timeout=20)
         if resp.status_code in (200, 201):
             print(f"[WhatsApp] Sent: {message[:60]}...")
             return True
@@ -3679,7 +6770,7 @@ def _send_whatsapp_summary(summary):
 
 
 def agent_process_job(job):
-    """Full agent pipeline for one job: score → generate docs → save."""
+    """Agent pipeline for one job already batch-scored by agent_run: generate docs → save."""
     log     = []
     job_id  = job.get("id")
     role    = job.get("role", "Unknown")
@@ -3688,103 +6779,40 @@ def agent_process_job(job):
 
     log.append(f"Processing: {role} @ {company}")
 
-    # STEP 1: AI Score
-    if jd and len(jd) > 50 and job.get("aiScore") is None:
-        try:
-            P = get_active_profile()
-            skills_short = ', '.join(P.get('skills', [])[:8])
-            prompt = f"""You are a career coach for the tech job market.
-
-CANDIDATE: {P.get('name','Unknown')} — {P.get('headline','')}
-Summary: {P.get('summary','')[:200]}
-Skills: {skills_short}
-Certification: {P.get('certification','')}
-Target: In-house product roles (NOT consulting).
-
-SCORING RULES:
-- Score 1-10 based on fit
-- +2 for in-house product companies (Grab, Sea, Airwallex, Stripe, GovTech, startups)
-- -2 for consulting (KPMG, Deloitte, Accenture, Big4) — max 4/10 for consulting roles
-- Score 0 if JD says "no visa sponsorship"
-- Labels: 🔥 Strong Match (9-10), ✅ Good Fit (7-8), 🟡 Possible (5-6), ❌ Weak Fit (1-4)
-- Priority: Apply Today, Apply This Week, Lower Priority, Skip
-
-JOB:
-Title: {role}
-Company: {company}
-JD: {jd[:500]}
-
-Return ONLY valid JSON, no markdown:
-{{"score": 8, "label": "✅ Good Fit", "reason": "Two sentence reason.", "priority": "Apply This Week"}}"""
-
-            result = call_claude(prompt)
-            clean  = result.strip().strip("```json").strip("```").strip()
-            # Find JSON object in response
-            import re
-            m = re.search(r'\{.*\}', clean, re.DOTALL)
-            if m:
-                scored = json.loads(m.group())
-                job["aiScore"]    = scored.get("score")
-                job["aiLabel"]    = scored.get("label", "")
-                job["aiReason"]   = scored.get("reason", "")
-                job["aiPriority"] = scored.get("priority", "")
-                log.append(f"  Scored: {job['aiLabel']} ({job['aiScore']}/10)")
-        except Exception as e:
-            log.append(f"  Scoring failed: {e}")
-    elif job.get("aiScore") is not None:
-        log.append(f"  Already scored: {job.get('aiLabel')} ({job.get('aiScore')}/10)")
+    # STEP 1: AI Score — agent_run batch-scores (and retries) up front
+    if job.get("aiScore") is not None:
+        log.append(f"  Scored: {job.get('aiLabel')} ({job.get('aiScore')}/10)")
+    elif len(jd.strip()) > 50:
+        log.append(f"  Scoring failed — left unscored for the next run")
     else:
         log.append(f"  No JD — skipping score")
 
     # STEP 2: Generate docs (score >= 5, no docs yet)
     score = job.get("aiScore") or 0
     if score >= 5 and not job.get("resume_docx_b64"):
+        trace_stage("docs")
         try:
             import base64 as b64mod
             ai_role = is_ai_role(jd, job.get("roleType", ""))
             P_agent = get_active_profile()
-            framing_agent = build_product_framing(P_agent)
-
-            # Build structured experience text for resume
-            exp_lines_r = ""
-            for exp in P_agent.get('experience', []):
-                exp_lines_r += f"\n--- {exp.get('role','')} at {exp.get('company','')} ({exp.get('period','')}) ---\n"
-                for b in exp.get('bullets', []):
-                    exp_lines_r += f"  - {b}\n"
-            skills_r = ', '.join(P_agent.get('skills', []))
-
-            resume_prompt = f"""Write a COMPLETE ATS-optimised resume (750+ words, plain text, no markdown) for {P_agent['name']} targeting: {role} at {company}.
-{framing_agent}
-JOB DESCRIPTION: {jd[:2000]}
-{"AI ROLE: Feature AI projects with URL: " + P_agent.get('aiProjectUrl','') if ai_role else ""}
-CANDIDATE: {P_agent.get('mobile','')}, {P_agent.get('email','')}, {P_agent.get('linkedin','')}
-Skills: {skills_r}
-Experience:
-{exp_lines_r}
-Education: {'; '.join([e.get('degree','') + ' — ' + e.get('school','') for e in P_agent.get('education',[])])}
-Certification: {P_agent.get('certification','')}
-
-Include ALL {len(P_agent.get('experience',[]))} roles with 5-8 bullets each. Include 25+ skills. Include education + SAFe cert.
-ALL CAPS headers. "- " for bullets. Every bullet = verb + metric. At least 750 words."""
-            resume_text = call_claude(resume_prompt, max_tokens=8192)
-
-            cover_prompt = f"""Write a 300-350 word cover letter for {P_agent['name']} applying to {role} at {company}.
-{framing_agent}
-JOB DESCRIPTION: {jd[:2000]}
-{"AI ROLE: Mention AI project with URL." if ai_role else ""}
-Plain text, specific to company, include metrics (~5% business value, 30 man-days). Reference SAFe certification."""
-            cover_text = call_claude(cover_prompt)
-
-            resume_bytes = _create_docx_from_text(resume_text)
-            cover_bytes = _create_docx_from_text(cover_text)
-
-            job["resume_docx_b64"]     = b64mod.b64encode(resume_bytes).decode()
-            job["cover_docx_b64"]      = b64mod.b64encode(cover_bytes).decode()
+
+            resume_prompt = build_prompt("resume", P_agent, **resume_prompt_fields(role, _trim_jd(jd, 500), job.get("matchedKeywords"), ai_role, P_agent))
+            resume_text = call_claude(resume_prompt, route="resume")
+            resume_text = _inject_ai_projects(resume_text)
+
+            cover_prompt = build_prompt("cover_letter", P_agent, **cover_letter_prompt_fields(role, company, _trim_jd(jd, 500), ai_role, P_agent))
+            cover_text = call_claude(cover_prompt, route="cover")
+
+            doc_key  = _doc_key_for(job.get("id"), resume_text + cover_text)
+            rendered = _render_and_cache_docs(doc_key, resume_text, cover_text, role, company)
+
+            job["resume_docx_b64"]     = b64mod.b64encode(rendered["resume"]["docx"]).decode()
+            job["cover_docx_b64"]      = b64mod.b64encode(rendered["cover"]["docx"]).decode()
             job["resume_variant"]      = "AI"
             job["resume_filename"]     = f"Resume_{company.replace(' ','_')}.docx"
             job["cover_filename"]      = f"CoverLetter_{company.replace(' ','_')}.docx"
             job["resume_generated_at"] = datetime.datetime.utcnow().isoformat()
-            log.append(f"  Docs generated (AI + python-docx)")
+            log.append(f"  Docs generated (AI + python-docx, pdf/html/md cached)")
         except Exception as e:
             log.append(f"  Doc gen error: {e}")
     elif score < 5:
@@ -3793,6 +6821,7 @@ Plain text, specific to company, include metrics (~5% business value, 30 man-day
         log.append(f"  Docs already exist")
 
     # STEP 3: Save to Supabase
+    trace_stage("save")
     try:
         sb = get_supabase()
         if sb:
@@ -3828,34 +6857,55 @@ Plain text, specific to company, include metrics (~5% business value, 30 man-day
     return job, log
 
 
-def agent_run(jobs_to_process, trigger="manual"):
-    """Run agent pipeline over list of jobs, then notify."""
-    results  = []
-    all_logs = []
-    scored   = []
-    docs_gen = []
-
-    for job in jobs_to_process:
-        enriched, log = agent_process_job(job)
-        all_logs.extend(log)
-        results.append(enriched)
-        if enriched.get("aiScore") is not None:
-            scored.append(enriched)
-        if enriched.get("resume_docx_b64"):
-            docs_gen.append(enriched)
-
-    top_jobs = sorted(scored, key=lambda j: j.get("aiScore", 0), reverse=True)[:5]
-    summary  = {
-        "trigger":  trigger,
-        "total":    len(jobs_to_process),
-        "scored":   len(scored),
-        "docs":     len(docs_gen),
-        "top_jobs": top_jobs,
-        "logs":     all_logs,
-        "results":  results,
-    }
-    _send_agent_notifications(summary)
-    return summary
+def agent_run(jobs_to_process, trigger="manual", notify=True):
+    """Run agent pipeline over list of jobs, then notify (unless notify=False)."""
+    with start_trace("agent.run", trigger=trigger, jobs=len(jobs_to_process)):
+        results  = []
+        all_logs = []
+        scored   = []
+        docs_gen = []
+
+        # Score everything still unscored up front in batched calls; agent_process_job
+        # then sees aiScore set and only handles docs + persistence.
+        pending = [j for j in jobs_to_process
+                   if len((j.get("jd") or "").strip()) > 50 and j.get("aiScore") is None]
+        if pending:
+            trace_stage("batch_score", jobs=len(pending))
+            stats = score_jobs_batched(pending, jd_tokens=125, tag="Agent")
+            all_logs.append(f"Batch-scored {stats['scored']}/{len(pending)} jobs in {stats['calls']} AI calls"
+                            + (f" ({stats['failed']} failed)" if stats["failed"] else ""))
+
+        trace_stage("process_jobs", jobs=len(jobs_to_process))
+        for n, job in enumerate(jobs_to_process):
+            metrics.set("jobhunt_queue_depth", len(jobs_to_process) - n, {"queue": "agent"})
+            with span("job", job_id=str(job.get("id", "")), role=job.get("role", ""),
+                      company=job.get("company", "")) as js:
+                enriched, log = agent_process_job(job)
+                js.set(score=enriched.get("aiScore"), docs=bool(enriched.get("resume_docx_b64")))
+            all_logs.extend(log)
+            results.append(enriched)
+            if enriched.get("aiScore") is not None:
+                scored.append(enriched)
+            if enriched.get("resume_docx_b64"):
+                docs_gen.append(enriched)
+
+        metrics.set("jobhunt_queue_depth", 0, {"queue": "agent"})
+
+        top_jobs = sorted(scored, key=lambda j: j.get("aiScore", 0), reverse=True)[:5]
+        summary  = {
+            "trigger":  trigger,
+            "total":    len(jobs_to_process),
+            "scored":   len(scored),
+            "docs":     len(docs_gen),
+            "top_jobs": top_jobs,
+            "logs":     all_logs,
+            "results":  results,
+        }
+        if notify:
+            trace_stage("notify")
+            _send_agent_notifications(summary)
+        start_company_precompute(scored)
+        return summary
 
 
 def _send_agent_notifications(summary):
@@ -3930,143 +6980,155 @@ def agent_autonomous_pipeline(config=None):
       Step 6: Save everything to Supabase
       Step 7: Send WhatsApp + email notification summary
     """
-    config = config or {}
-    pipeline_log = []
-    P = get_active_profile()
+    with start_trace("agent.autonomous_pipeline", trigger="autonomous") as root:
+        config = config or {}
+        pipeline_log = []
+        P = get_active_profile()
 
-    def log(msg):
-        pipeline_log.append(msg)
-        print(f"[Agent] {msg}")
-
-    log(f"🤖 Starting autonomous pipeline for {P.get('name', 'user')}")
-
-    # ── Step 1: Job Discovery from web scrapers ──
-    discovered_jobs = []
-    keywords = config.get("keywords", P.get("headline", "Product Manager"))
-    location = config.get("location", "Singapore")
-    max_days = config.get("max_days", 30)
-    platforms = config.get("platforms", ["mycareersfuture", "linkedin_guest", "workable"])
-
-    if platforms:
-        from concurrent.futures import ThreadPoolExecutor
-        scraper_map = {
-            "mycareersfuture": _scrape_mycareersfuture,
-            "linkedin_guest": _scrape_linkedin_guest,
-            "workable": _scrape_workable,
-            "mcf_extended": _scrape_mcf_extended,
-            "linkedin": _scrape_linkedin_public,
-        }
-        log(f"Step 1: Discovering jobs — keywords='{keywords}', location='{location}', platforms={platforms}")
-        with ThreadPoolExecutor(max_workers=3) as pool:
-            futures = {}
-            for p_name in platforms:
-                fn = scraper_map.get(p_name)
-                if fn:
-                    futures[p_name] = pool.submit(fn, keywords, location, max_days)
-            for p_name, fut in futures.items():
-                try:
-                    results = fut.result(timeout=60)
-                    discovered_jobs.extend(results)
-                    log(f"  {p_name}: {len(results)} jobs found")
-                except Exception as e:
-                    log(f"  {p_name}: error — {str(e)[:60]}")
-
-        # Deduplicate by title+company
-        seen = set()
-        unique = []
-        for j in discovered_jobs:
-            key = f"{j.get('role','').lower().strip()}|{j.get('company','').lower().strip()}"
-            if key not in seen:
-                seen.add(key)
-                unique.append(j)
-        discovered_jobs = unique
-        log(f"  Total unique discovered: {len(discovered_jobs)}")
-    else:
-        log("Step 1: Skipping discovery (no platforms configured)")
+        def log(msg):
+            pipeline_log.append(msg)
+            trace_event(msg)
+            print(f"[Agent] {msg}")
+
+        log(f"🤖 Starting autonomous pipeline for {P.get('name', 'user')}")
+
+        # ── Step 1: Job Discovery from web scrapers ──
+        discovered_jobs = []
+        keywords = config.get("keywords", P.get("headline", "Product Manager"))
+        location = config.get("location", "Singapore")
+        max_days = config.get("max_days", 30)
+        platforms = config.get("platforms", ["mycareersfuture", "linkedin_guest", "workable"])
+
+        if platforms:
+            trace_stage("discover", platforms=",".join(platforms))
+            from concurrent.futures import ThreadPoolExecutor
+            scraper_map = {
+                "mycareersfuture": _scrape_mycareersfuture,
+                "linkedin_guest": _scrape_linkedin_guest,
+                "workable": _scrape_workable,
+                "mcf_extended": _scrape_mcf_extended,
+                "linkedin": _scrape_linkedin_public,
+            }
+            log(f"Step 1: Discovering jobs — keywords='{keywords}', location='{location}', platforms={platforms}")
+            with ThreadPoolExecutor(max_workers=3) as pool:
+                futures = {}
+                for p_name in platforms:
+                    fn = scraper_map.get(p_name)
+                    if fn:
+                        futures[p_name] = pool.submit(traced(fn, f"scrape {p_name}", platform=p_name),
+                                                      keywords, location, max_days)
+                for p_name, fut in futures.items():
+                    try:
+                        results = fut.result(timeout=60)
+                        # Scrapers return (jobs, error)
+                        if isinstance(results, tuple):
+                            results = results[0] or []
+                        discovered_jobs.extend(results)
+                        log(f"  {p_name}: {len(results)} jobs found")
+                    except Exception as e:
+                        log(f"  {p_name}: error — {str(e)[:60]}")
+
+            # Deduplicate by title+company
+            trace_stage("dedup", discovered=len(discovered_jobs))
+            seen = set()
+            unique = []
+            for j in discovered_jobs:
+                key = f"{j.get('role','').lower().strip()}|{j.get('company','').lower().strip()}"
+                if key not in seen:
+                    seen.add(key)
+                    unique.append(j)
+            discovered_jobs = unique
+            log(f"  Total unique discovered: {len(discovered_jobs)}")
+        else:
+            log("Step 1: Skipping discovery (no platforms configured)")
 
-    # ── Step 2: (LinkedIn Selenium scrape removed — using discovery scrapers only) ──
-    linkedin_jobs = []
-    log("Step 2: Skipping LinkedIn login scrape (removed — use bookmarklet instead)")
+        # ── Step 2: (LinkedIn Selenium scrape removed — using discovery scrapers only) ──
+        linkedin_jobs = []
+        log("Step 2: Skipping LinkedIn login scrape (removed — use bookmarklet instead)")
 
-    # ── Step 3: Merge & sync to Supabase ──
-    all_new_jobs = discovered_jobs + linkedin_jobs
-    total_added = 0
-    total_skipped = 0
+        # ── Step 3: Merge & sync to Supabase ──
+        all_new_jobs = discovered_jobs + linkedin_jobs
+        total_added = 0
+        total_skipped = 0
 
-    if all_new_jobs:
-        log(f"Step 3: Syncing {len(all_new_jobs)} jobs to Supabase...")
+        if all_new_jobs:
+            trace_stage("supabase_sync", jobs=len(all_new_jobs))
+            log(f"Step 3: Syncing {len(all_new_jobs)} jobs to Supabase...")
 
-        # Sync discovered jobs
-        if discovered_jobs:
-            sb = get_supabase()
-            if sb:
-                try:
-                    existing = sb.table("jobs").select("id,url").execute().data or []
-                    existing_urls = {(j.get("url") or "").split("?")[0] for j in existing if j.get("url")}
-                    import time as _time
-                    to_insert = []
-                    for dj in discovered_jobs:
-                        clean_url = (dj.get("url") or "").split("?")[0]
-                        if clean_url and clean_url in existing_urls:
-                            total_skipped += 1
-                            continue
-                        job_id = str(int(_time.time() * 1000)) + str(len(to_insert))
-                        to_insert.append({
-                            "id": job_id,
-                            "role": dj.get("role", ""),
-                            "company": dj.get("company", ""),
-                            "url": clean_url,
-                            "jd": (dj.get("jd") or "")[:8000],
-                            "status": "saved",
-                            "source": dj.get("source", "Discovery"),
-                            "roleType": "Business Analyst",
-                            "dateApplied": datetime.datetime.now().isoformat(),
-                        })
-                        if clean_url:
-                            existing_urls.add(clean_url)
-                    if to_insert:
-                        sb.table("jobs").upsert(to_insert, on_conflict="id").execute()
-                    total_added += len(to_insert)
-                    log(f"  Discovery sync: {len(to_insert)} new, {total_skipped} duplicates")
-                except Exception as e:
-                    log(f"  Discovery sync error: {str(e)[:60]}")
-    else:
-        log("Step 3: No new jobs to sync")
+            # Sync discovered jobs
+            if discovered_jobs:
+                sb = get_supabase()
+                if sb:
+                    try:
+                        existing = sb.table("jobs").select("id,url").execute().data or []
+                        existing_urls = {(j.get("url") or "").split("?")[0] for j in existing if j.get("url")}
+                        import time as _time
+                        to_insert = []
+                        for dj in discovered_jobs:
+                            clean_url = (dj.get("url") or "").split("?")[0]
+                            if clean_url and clean_url in existing_urls:
+                                total_skipped += 1
+                                continue
+                            job_id = str(int(_time.time() * 1000)) + str(len(to_insert))
+                            to_insert.append({
+                                "id": job_id,
+                                "role": dj.get("role", ""),
+                                "company": dj.get("company", ""),
+                                "url": clean_url,
+                                "jd": (dj.get("jd") or "")[:8000],
+                                "status": "saved",
+                                "source": dj.get("source", "Discovery"),
+                                "roleType": "Business Analyst",
+                                "dateApplied": datetime.datetime.now().isoformat(),
+                            })
+                            if clean_url:
+                                existing_urls.add(clean_url)
+                        if to_insert:
+                            sb.table("jobs").upsert(to_insert, on_conflict="id").execute()
+                        total_added += len(to_insert)
+                        log(f"  Discovery sync: {len(to_insert)} new, {total_skipped} duplicates")
+                    except Exception as e:
+                        log(f"  Discovery sync error: {str(e)[:60]}")
+        else:
+            log("Step 3: No new jobs to sync")
 
-    log(f"  Summary: {total_added} added, {total_skipped} skipped")
+        log(f"  Summary: {total_added} added, {total_skipped} skipped")
 
-    # ── Step 4 + 5 + 6: Score, generate docs, save (via existing agent_run) ──
-    sb = get_supabase()
-    agent_summary = None
-    if sb:
-        try:
-            res = sb.table("jobs").select("*").execute()
-            jobs = [j for j in (res.data or []) if not j.get("isDemo")]
-            to_run = [
-                j for j in jobs
-                if (j.get("jd") and j.get("aiScore") is None) or
-                   (j.get("aiScore", 0) >= 5 and not j.get("resume_docx_b64"))
-            ]
-            if to_run:
-                log(f"Step 4-6: Processing {len(to_run)} jobs (score → docs → save)...")
-                agent_summary = agent_run(to_run, trigger="auto")
-                log(f"  Done: {agent_summary['scored']} scored, {agent_summary['docs']} docs generated")
-            else:
-                log("Step 4-6: All jobs already processed")
-        except Exception as e:
-            log(f"Step 4-6 error: {str(e)[:60]}")
-
-    log("✅ Autonomous pipeline complete")
-
-    return {
-        "pipeline_log": pipeline_log,
-        "discovered": len(discovered_jobs),
-        "linkedin": len(linkedin_jobs),
-        "added": total_added,
-        "skipped": total_skipped,
-        "scored": agent_summary["scored"] if agent_summary else 0,
-        "docs": agent_summary["docs"] if agent_summary else 0,
-    }
+        # ── Step 4 + 5 + 6: Score, generate docs, save (via existing agent_run) ──
+        trace_stage("agent_run")
+        sb = get_supabase()
+        agent_summary = None
+        if sb:
+            try:
+                res = sb.table("jobs").select("*").execute()
+                jobs = [j for j in (res.data or []) if not j.get("isDemo")]
+                to_run = [
+                    j for j in jobs
+                    if (j.get("jd") and j.get("aiScore") is None) or
+                       (j.get("aiScore", 0) >= 5 and not j.get("resume_docx_b64"))
+                ]
+                if to_run:
+                    log(f"Step 4-6: Processing {len(to_run)} jobs (score → docs → save)...")
+                    agent_summary = agent_run(to_run, trigger="auto")
+                    log(f"  Done: {agent_summary['scored']} scored, {agent_summary['docs']} docs generated")
+                else:
+                    log("Step 4-6: All jobs already processed")
+            except Exception as e:
+                log(f"Step 4-6 error: {str(e)[:60]}")
+
+        log("✅ Autonomous pipeline complete")
+        root.set(discovered=len(discovered_jobs), added=total_added, skipped=total_skipped)
+
+        return {
+            "pipeline_log": pipeline_log,
+            "discovered": len(discovered_jobs),
+            "linkedin": len(linkedin_jobs),
+            "added": total_added,
+            "skipped": total_skipped,
+            "scored": agent_summary["scored"] if agent_summary else 0,
+            "docs": agent_summary["docs"] if agent_summary else 0,
+            "trace_id": root.trace.trace_id,
+        }
 
 
 @app.route("/api/agent/autonomous", methods=["POST"])
@@ -4276,7 +7338,8 @@ def ensure_settings_table():
     except Exception:
         # Table doesn't exist — try SQL creation via Supabase REST SQL endpoint
         try:
-            resp = http_requests.post(
+            resp = _upstream_request(
+                "supabase", "POST",
                 f"{SUPABASE_URL}/rest/v1/rpc/exec_sql",
                 headers={
                     "apikey": SUPABASE_KEY,
@@ -4329,6 +7392,8 @@ def save_settings():
         if val:
             ok = upsert_setting(key, val)
             (saved if ok else failed).append(key)
+    if {"LINKEDIN_EMAIL", "LINKEDIN_PASSWORD", "LI_AT_COOKIE"} & set(saved):
+        _linkedin.reset()
     if failed:
         return jsonify({"status": "partial", "saved": saved, "failed": failed,
                         "error": f"Could not save {failed} — make sure the settings table exists in Supabase (run supabase_setup.sql)"})
@@ -4378,7 +7443,7 @@ def _linkedin_login_for_cookie():
     # Step 1: GET the login page to grab the CSRF token
     try:
         print("[LinkedIn Login] Fetching login page...")
-        r = sess.get("https://www.linkedin.com/login", timeout=20)
+        r = sess.get(f"{LINKEDIN_BASE}/login", timeout=20)
         if r.status_code != 200:
             print(f"[LinkedIn Login] Login page returned {r.status_code}")
             return None
@@ -4405,7 +7470,7 @@ def _linkedin_login_for_cookie():
     }
     try:
         r2 = sess.post(
-            "https://www.linkedin.com/checkpoint/lg/login-submit",
+            f"{LINKEDIN_BASE}/checkpoint/lg/login-submit",
             data=login_data,
             timeout=20,
             allow_redirects=True,
@@ -4443,34 +7508,540 @@ def _linkedin_login_for_cookie():
     return None
 
 
+# ─── LinkedIn session ────────────────────────────────────────────────────────
+# One Voyager session per process, shared by the saved-jobs scrape, the JD
+# backfill and /api/fetch-jd. It holds a pooled requests.Session whose cookie
+# jar carries li_at + JSESSIONID and whose default headers carry the matching
+# csrf-token, so callers no longer rebuild them or re-read LI_AT_COOKIE from
+# settings (a Supabase round trip) on every scrape. A cookie older than
+# LINKEDIN_SESSION_TTL is re-checked before use, and a 401/403 triggers one
+# refresh — stored cookie if it changed, else credential login — guarded by
+# a generation counter so concurrent workers that hit the same expiry share a
+# single login. Failed logins back off for LINKEDIN_LOGIN_COOLDOWN seconds.
+
+LINKEDIN_SESSION_TTL = float(os.environ.get("LINKEDIN_SESSION_TTL", str(6 * 3600)))
+LINKEDIN_LOGIN_COOLDOWN = float(os.environ.get("LINKEDIN_LOGIN_COOLDOWN", "300"))
+_VOYAGER_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+                  "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "application/vnd.linkedin.normalized+json+2.1",
+    "x-restli-protocol-version": "2.0.0",
+}
+
+
+class _LinkedInSession:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.http = None
+        self.li_at = None
+        self.source = None
+        self.generation = 0
+        self.checked_at = 0.0
+        self.logins = 0
+        self.refreshes = 0
+        self.last_error = None
+        self._login_blocked_until = 0.0
+
+    def _install(self, li_at, source):
+        import uuid
+        csrf = f"ajax:{uuid.uuid4()}"
+        http = http_requests.Session()
+        adapter = http_requests.adapters.HTTPAdapter(pool_maxsize=max(10, LINKEDIN_JD_CONCURRENCY))
+        http.mount("https://", adapter)
+        http.mount("http://", adapter)
+        http.headers.update(_VOYAGER_HEADERS)
+        http.headers["csrf-token"] = csrf
+        http.cookies.set("li_at", li_at)
+        http.cookies.set("JSESSIONID", f'"{csrf}"')
+        if self.http is not None:
+            self.http.close()
+        self.http, self.li_at, self.source = http, li_at, source
+        self.generation += 1
+        self.checked_at = time.time()
+        self.last_error = None
+
+    def _acquire(self, allow_login, stale=None):
+        """Install a cookie (caller holds the lock): the stored one unless it is
+        the one that just failed, else a fresh credential login."""
+        stored = (_get_li_at_cookie() or "").strip().strip('"').strip("'")
+        if stored and stored != stale:
+            self._install(stored, "stored_cookie")
+            return True
+        if not allow_login:
+            self.last_error = "no usable stored cookie"
+            return False
+        if time.time() < self._login_blocked_until:
+            self.last_error = f"login backing off for {int(self._login_blocked_until - time.time())}s"
+            return False
+        print("[LinkedIn] No usable li_at cookie — attempting credential login...")
+        li_at = _linkedin_login_for_cookie()
+        self.logins += 1
+        if not li_at:
+            self._login_blocked_until = time.time() + LINKEDIN_LOGIN_COOLDOWN
+            self.last_error = "credential login failed"
+            return False
+        self._install(li_at, "credential_login")
+        return True
+
+    def _still_valid(self):
+        try:
+            r = _upstream_request("linkedin_voyager", "GET", f"{LINKEDIN_BASE}/voyager/api/me",
+                                  session=self.http, timeout=10)
+        except Exception:
+            return True                  # can't tell — let the real call decide
+        return r.status_code not in (401, 403)
+
+    def ensure(self, allow_login=True):
+        """(generation, session) once a cookie is installed and, if it is older
+        than the TTL, re-checked; None when no session can be established.
+        Read under the lock, so the pair can't be swapped out mid-call."""
+        with self._lock:
+            if self.http is not None and time.time() - self.checked_at < LINKEDIN_SESSION_TTL:
+                return self.generation, self.http
+            if self.http is not None and self._still_valid():
+                self.checked_at = time.time()
+                return self.generation, self.http
+            stale, self.http = self.li_at, None
+            return (self.generation, self.http) if self._acquire(allow_login, stale) else None
+
+    def refresh(self, generation, allow_login=True):
+        """Replace the cookie that failed under `generation` (a no-op if another
+        thread already did); returns the new (generation, session) or None."""
+        with self._lock:
+            if self.generation != generation and self.http is not None:
+                return self.generation, self.http
+            self.refreshes += 1
+            print("[LinkedIn] Session rejected — refreshing cookie...")
+            return (self.generation, self.http) if self._acquire(allow_login, stale=self.li_at) else None
+
+    def request(self, method, url, allow_login=True, **kwargs):
+        """_upstream_request over the shared session, refreshing once on 401/403.
+        Raises RuntimeError when no session can be established."""
+        current = self.ensure(allow_login)
+        if current is None:
+            raise RuntimeError(f"LinkedIn session unavailable ({self.last_error})")
+        gen, http = current
+        resp = _upstream_request("linkedin_voyager", method, url, session=http, **kwargs)
+        if resp.status_code in (401, 403):
+            current = self.refresh(gen, allow_login)
+            if current is not None:
+                resp = _upstream_request("linkedin_voyager", method, url, session=current[1], **kwargs)
+        return resp
+
+    def reset(self):
+        """Forget the current cookie (e.g. after new credentials are saved)."""
+        with self._lock:
+            if self.http is not None:
+                self.http.close()
+            self.http = self.li_at = self.source = None
+            self._login_blocked_until = 0.0
+
+    def snapshot(self):
+        """Lock-free: ensure()/refresh() hold the lock through a validity check or
+        a full credential login, and /api/health must not wait on that."""
+        active, checked_at = self.http is not None, self.checked_at
+        return {"active": active, "source": self.source,
+                "age_s": round(time.time() - checked_at) if active else None,
+                "logins": self.logins, "refreshes": self.refreshes, "last_error": self.last_error}
+
+
+_linkedin = _LinkedInSession()
+
+
 def _get_or_login_li_at():
     """
     Get the li_at cookie — try stored cookie first, then auto-login with credentials.
     Returns (li_at_string, source_label) or (None, error_label).
     """
-    # 1. Check for a stored / manually-provided li_at cookie
-    li_at = _get_li_at_cookie()
-    if li_at:
-        li_at = li_at.strip().strip('"').strip("'")
-        return li_at, "stored_cookie"
+    if _linkedin.ensure():
+        return _linkedin.li_at, _linkedin.source
+    return None, "no_credentials"
 
-    # 2. Try credential-based login
-    print("[LinkedIn] No stored li_at cookie — attempting credential login...")
-    li_at = _linkedin_login_for_cookie()
-    if li_at:
-        return li_at, "credential_login"
 
-    return None, "no_credentials"
+_URN_ID_RE = re.compile(r"(\d{6,})")
+
+
+def _urn_key(urn):
+    """Normalized lookup key for a Voyager URN: its numeric id, so that
+    urn:li:fsd_jobPosting:123, urn:li:fs_normalized_jobPosting:123 and
+    (urn:li:fsd_jobPosting:123,…) compound refs all meet."""
+    m = _URN_ID_RE.search(urn or "")
+    return m.group(1) if m else urn
+
+
+def _voyager_paging(data):
+    paging = data.get("paging", {})
+    if not paging and isinstance(data.get("data"), dict):
+        for v in data["data"].values():
+            if isinstance(v, dict) and "paging" in v:
+                paging = v["paging"]
+                break
+    return paging
+
+
+def _voyager_included(data):
+    # LinkedIn uses "included" array with entity types
+    included = data.get("included", data.get("elements", []))
+    if not included and "data" in data:
+        # GraphQL wrapper
+        inner = data["data"]
+        if isinstance(inner, dict):
+            for v in inner.values():
+                if isinstance(v, dict) and "elements" in v:
+                    included = v["elements"]
+                    break
+        if not included:
+            included = data.get("included", [])
+    return included
+
+
+def _is_saved_wrapper(item):
+    return "SavedJob" in item.get("$type", "") or "savedJob" in str(item.get("$recipeTypes", ""))
+
+
+def _saved_before(item, cutoff):
+    """True when a saved-job wrapper's savedAt is older than `cutoff`."""
+    saved_at = item.get("savedAt") or item.get("createdAt") or 0
+    if isinstance(saved_at, (int, float)) and saved_at > 1e12:
+        saved_at = saved_at / 1000  # ms to seconds
+    if saved_at and saved_at > 0:
+        return datetime.datetime.fromtimestamp(saved_at, tz=datetime.timezone.utc) < cutoff
+    return False
+
+
+def _voyager_page_is_last(data, cutoff):
+    """Cheap pre-parse check: the page is empty or already reaches the cutoff."""
+    included = _voyager_included(data)
+    return not included or any(_is_saved_wrapper(it) and _saved_before(it, cutoff) for it in included)
+
+
+def _parse_voyager_saved_page(data, cutoff):
+    """Parse one page of the Voyager saved-jobs response into job dicts.
+    Returns (page_jobs, raw_count, total_results, stale); jobs saved/listed
+    before `cutoff` are dropped and `stale` counts saved items dropped that way."""
+    included = _voyager_included(data)
+
+    # Build lookup maps for companies and job postings from included entities
+    companies = {}
+    postings = {}
+    saved_meta = []  # saved-job wrapper entities with timestamps
+
+    for item in included:
+        urn = item.get("entityUrn") or item.get("$id") or ""
+        t = item.get("$type", "")
+
+        # Company / Organization
+        if "Company" in t or "Organization" in t or "company" in urn:
+            companies[urn] = item.get("name") or item.get("universalName") or "Unknown"
+
+        # Job Posting
+        if "JobPosting" in t or "jobPosting" in urn:
+            postings[urn] = item
+
+        # Saved-job wrapper (has savedAt timestamp)
+        if _is_saved_wrapper(item):
+            saved_meta.append(item)
+
+        # Also capture items that have 'title' + 'companyDetails' (direct posting)
+        if item.get("title") and (item.get("companyDetails") or item.get("companyName")):
+            postings[urn] = item
+
+    # Exact URN first, then the numeric id (postings are sometimes referenced
+    # under a different URN namespace than the one they are included as).
+    # Both fallback indexes are only built the first time they are needed.
+    fallback = {}
+
+    def posting_by_key(ref):
+        if "postings" not in fallback:
+            fallback["postings"] = {}
+            for k, v in postings.items():
+                fallback["postings"].setdefault(_urn_key(k), v)
+        return fallback["postings"].get(_urn_key(ref))
+
+    def inline_company(urn):
+        if "companies" not in fallback:
+            fallback["companies"] = {ci.get("entityUrn"): ci["companyName"] for ci in included
+                                     if ci.get("companyName") and ci.get("entityUrn")}
+        return fallback["companies"].get(urn)
+
+    # If we got saved_meta wrappers, extract job refs from them
+    page_jobs = []
+    stale = 0
+    if saved_meta:
+        for sm in saved_meta:
+            if _saved_before(sm, cutoff):
+                stale += 1
+                continue  # Skip jobs saved more than max_days ago
+
+            # Find the job posting reference
+            jp_ref = sm.get("jobPosting") or sm.get("*jobPosting") or ""
+            if isinstance(jp_ref, dict):
+                jp_ref = jp_ref.get("entityUrn") or jp_ref.get("$id") or ""
+            jp = postings.get(jp_ref) or (posting_by_key(jp_ref) if jp_ref else None) or {}
+
+            title = jp.get("title") or sm.get("title") or ""
+            if not title:
+                continue
+
+            # Company name
+            company = "Unknown"
+            comp_ref = jp.get("companyDetails", {}).get("*companyResolutionResult") or \
+                       jp.get("companyDetails", {}).get("company") or \
+                       jp.get("*company") or ""
+            if isinstance(comp_ref, str) and comp_ref in companies:
+                company = companies[comp_ref]
+            elif jp.get("companyName"):
+                company = jp["companyName"]
+            else:
+                company = inline_company(jp.get("entityUrn")) or company
+
+            # Extract job ID from URN
+            job_urn = jp.get("entityUrn") or jp_ref or ""
+            m = re.search(r"(\d{8,})", job_urn)
+            job_id = m.group(1) if m else ""
+            if not job_id:
+                continue  # no numeric job ID → not a real job posting, skip
+            job_url = f"https://www.linkedin.com/jobs/view/{job_id}/" if job_id else ""
+
+            # JD text
+            jd = ""
+            desc = jp.get("description") or jp.get("descriptionText") or {}
+            if isinstance(desc, dict):
+                jd = desc.get("text", "")
+            elif isinstance(desc, str):
+                jd = desc
+
+            page_jobs.append({
+                "role": title,
+                "company": company,
+                "url": job_url,
+                "linkedInId": f"li_{job_id}" if job_id else "",
+                "jd": jd[:4000],
+                "source": "LinkedIn",
+                "status": "saved",
+                "roleType": "Business Analyst",
+                "dateApplied": datetime.datetime.now().isoformat(),
+            })
+    else:
+        # Fallback: parse postings directly (flat response format)
+        for urn, jp in postings.items():
+            title = jp.get("title", "")
+            if not title:
+                continue
+
+            # Skip profile/sidebar entities — real job postings always have a numeric job ID
+            m_check = re.search(r"(\d{8,})", urn)
+            if not m_check:
+                continue  # no job ID in URN → not a real job posting
+
+            # Check listedAt / repostedAt for 30-day filter
+            listed = jp.get("listedAt") or jp.get("repostedAt") or 0
+            if isinstance(listed, (int, float)) and listed > 1e12:
+                listed = listed / 1000
+            if listed and listed > 0:
+                listed_dt = datetime.datetime.fromtimestamp(listed, tz=datetime.timezone.utc)
+                if listed_dt < cutoff:
+                    continue
+
+            company = "Unknown"
+            comp_ref = jp.get("companyDetails", {}).get("*companyResolutionResult") or \
+                       jp.get("*company") or ""
+            if isinstance(comp_ref, str) and comp_ref in companies:
+                company = companies[comp_ref]
+            elif jp.get("companyName"):
+                company = jp["companyName"]
+
+            m = re.search(r"(\d{8,})", urn)
+            job_id = m.group(1) if m else ""
+            job_url = f"https://www.linkedin.com/jobs/view/{job_id}/" if job_id else ""
+
+            jd = ""
+            desc = jp.get("description") or jp.get("descriptionText") or {}
+            if isinstance(desc, dict):
+                jd = desc.get("text", "")
+            elif isinstance(desc, str):
+                jd = desc
+
+            page_jobs.append({
+                "role": title,
+                "company": company,
+                "url": job_url,
+                "linkedInId": f"li_{job_id}" if job_id else "",
+                "jd": jd[:4000],
+                "source": "LinkedIn",
+                "status": "saved",
+                "roleType": "Business Analyst",
+                "dateApplied": datetime.datetime.now().isoformat(),
+            })
+
+    total_results = _voyager_paging(data).get("total", 0)
+    raw_count = len(included)  # how many raw items LinkedIn returned (before our date filtering)
+    return page_jobs, raw_count, total_results, stale
+
+
+# ─── LinkedIn JD backfill ────────────────────────────────────────────────────
+# Saved-jobs listings mostly arrive without descriptions. The missing JDs are
+# fetched from the Voyager jobPostings endpoint by a small pool sharing the
+# LinkedIn session, paced by an AIMD limiter: a 429/999 (or an open circuit)
+# halves the allowed concurrency and pauses new requests for Retry-After,
+# each success lets it creep back up. Jobs whose JD is already in the jobs
+# table are never fetched. Callers can give the backfill a time budget; what
+# is still in flight when it runs out keeps going in the background and the
+# late JDs are written to the stored rows as they land.
+
+LINKEDIN_JD_CONCURRENCY = int(os.environ.get("LINKEDIN_JD_CONCURRENCY", "4"))
+LINKEDIN_JD_SYNC_SECONDS = float(os.environ.get("LINKEDIN_JD_SYNC_SECONDS", "20"))
+LINKEDIN_JD_ATTEMPTS = 3
+LINKEDIN_PAGE_INTERVAL = float(os.environ.get("LINKEDIN_PAGE_INTERVAL", "1"))
+_LINKEDIN_THROTTLE_STATUSES = (429, 999)
+
+
+class _AdaptiveLimiter:
+    """Concurrency limit that halves on throttling and grows by ~1 per round of successes."""
+
+    def __init__(self, limit):
+        self.max = max(1, limit)
+        self.limit = float(self.max)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.throttled = 0
+        self._streak = 0                 # consecutive throttles, drives the default pause
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                wait = self.paused_until - time.time()
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                self._cond.wait(wait if wait > 0 else None)
+
+    def release(self, throttled=False, retry_after=None):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.throttled += 1
+                self._streak += 1
+                self.limit = max(1.0, self.limit / 2)
+                pause = retry_after if retry_after is not None else 0.5 * 2 ** min(self._streak, 6)
+                self.paused_until = max(self.paused_until, time.time() + min(pause, CIRCUIT_MAX_COOLDOWN))
+            else:
+                self._streak = 0
+                self.limit = min(float(self.max), self.limit + 1 / self.limit)
+            self._cond.notify_all()
 
 
-def linkedin_scrape_saved_jobs_via_cookie(max_days=30):
+def _stored_linkedin_jd_ids():
+    """linkedInIds whose row already carries a JD (empty set without Supabase)."""
+    sb = get_supabase()
+    if not sb:
+        return set()
+    try:
+        rows = sb.table("jobs").select("linkedInId").neq("jd", "").execute().data or []
+    except Exception as e:
+        print(f"[LinkedIn JD] could not read stored JDs: {e}")
+        return set()
+    return {r["linkedInId"] for r in rows if r.get("linkedInId")}
+
+
+def _fetch_linkedin_jd(job, limiter):
+    job_id = job["linkedInId"].replace("li_", "")
+    jd_url = (
+        f"{LINKEDIN_BASE}/voyager/api/jobs/jobPostings/{job_id}"
+        f"?decorationId=com.linkedin.voyager.deco.jobs.web.shared.WebFullJobPosting-65"
+    )
+    for _ in range(LINKEDIN_JD_ATTEMPTS):
+        limiter.acquire()
+        try:
+            r = _linkedin.request("GET", jd_url, timeout=15)
+        except UpstreamUnavailable as e:
+            limiter.release(throttled=True, retry_after=e.retry_in)
+            continue
+        except Exception as e:
+            limiter.release()
+            print(f"[LinkedIn Cookie] JD fetch error for {job_id}: {e}")
+            return False
+        if r.status_code in _LINKEDIN_THROTTLE_STATUSES:
+            limiter.release(throttled=True, retry_after=_retry_after_seconds(r))
+            continue
+        limiter.release()
+        if r.status_code != 200:
+            return False
+        try:
+            jdata = r.json()
+        except ValueError:
+            return False
+        desc = jdata.get("description") or jdata.get("descriptionText") or {}
+        if isinstance(desc, dict):
+            job["jd"] = desc.get("text", "")[:4000]
+        elif isinstance(desc, str):
+            job["jd"] = desc[:4000]
+        return bool(job.get("jd"))
+    print(f"[LinkedIn Cookie] JD fetch for {job_id} gave up after {LINKEDIN_JD_ATTEMPTS} throttled attempts")
+    return False
+
+
+def _persist_late_jds(futures, late_jobs):
+    """Background tail of a budgeted backfill: wait for the stragglers, then
+    PATCH their JDs onto the rows the caller has inserted meanwhile."""
+    from concurrent.futures import wait as _wait
+    _wait(futures)
+    sb = get_supabase()
+    pending = [j for j in late_jobs if j.get("jd")]
+    for attempt in range(5):
+        if not sb or not pending:
+            break
+        missing = []
+        for job in pending:
+            try:
+                res = sb.table("jobs").update({"jd": job["jd"][:8000]}).eq("linkedInId", job["linkedInId"]).execute()
+                if not res.data:
+                    missing.append(job)
+            except Exception as e:
+                print(f"[LinkedIn JD] late JD for {job['linkedInId']} not saved: {e}")
+        pending = missing
+        if pending:
+            time.sleep(2 * (attempt + 1))     # row not inserted yet
+    print(f"[LinkedIn JD] background backfill done — {sum(1 for j in late_jobs if j.get('jd'))}"
+          f"/{len(late_jobs)} late JDs")
+
+
+def backfill_linkedin_jds(jobs, budget=None):
+    """Fill job["jd"] in place for LinkedIn jobs missing one. Waits at most
+    `budget` seconds (None = until done); returns how many are still in flight."""
+    from concurrent.futures import ThreadPoolExecutor, wait as _wait
+
+    stored = _stored_linkedin_jd_ids()
+    todo = [j for j in jobs if not j.get("jd") and j.get("linkedInId") and j["linkedInId"] not in stored]
+    if not todo:
+        return 0
+    print(f"[LinkedIn Cookie] Fetching JDs for {len(todo)} jobs "
+          f"({len(jobs) - len(todo)} have one or are stored already)...")
+    limiter = _AdaptiveLimiter(LINKEDIN_JD_CONCURRENCY)
+    pool = ThreadPoolExecutor(max_workers=limiter.max, thread_name_prefix="li-jd")
+    futures = {pool.submit(traced(_fetch_linkedin_jd), j, limiter): j for j in todo}
+    pool.shutdown(wait=False)
+    done, not_done = _wait(futures, timeout=budget)
+    if limiter.throttled:
+        print(f"[LinkedIn Cookie] JD backfill throttled {limiter.throttled}x, concurrency now {int(limiter.limit)}")
+    if not_done:
+        late = [futures[f] for f in not_done]
+        print(f"[LinkedIn Cookie] {len(late)} JDs continue in the background")
+        threading.Thread(target=_persist_late_jds, args=(list(not_done), late), daemon=True).start()
+    return len(not_done)
+
+
+def linkedin_scrape_saved_jobs_via_cookie(max_days=30, jd_budget=None):
     """
     Scrape LinkedIn saved jobs using the li_at session cookie.
     Tries stored cookie first, falls back to email/password login.
     Uses LinkedIn's internal Voyager REST API — lightweight HTTP requests only.
+    JD backfill waits at most `jd_budget` seconds (None = until done); the
+    rest finishes in the background and is saved to the stored rows.
     Returns (jobs_list, error_message).
     """
-    import re, uuid, time as _time
+    import time as _time
 
     li_at, source = _get_or_login_li_at()
     if not li_at:
@@ -4479,67 +8050,54 @@ def linkedin_scrape_saved_jobs_via_cookie(max_days=30):
             return [], "Login failed — LinkedIn may require a security verification. Log in from your browser, then retry."
         return [], "no_credentials"
 
-    # Clean the cookie value (user might copy with quotes)
-    li_at = li_at.strip().strip('"').strip("'")
-
-    csrf_token = f"ajax:{uuid.uuid4()}"
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-                      "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-        "Accept": "application/vnd.linkedin.normalized+json+2.1",
-        "x-restli-protocol-version": "2.0.0",
-        "csrf-token": csrf_token,
-    }
-    cookies = {
-        "li_at": li_at,
-        "JSESSIONID": f'"{ csrf_token }"',
-    }
-
     all_jobs = []
     start = 0
     page_size = 40
     max_pages = 15  # safety limit
     cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=max_days)
 
-    for page in range(max_pages):
-        url = (
-            "https://www.linkedin.com/voyager/api/graphql"
+    # Pages are requested at most every LINKEDIN_PAGE_INTERVAL seconds, and
+    # page N+1 is already in flight while page N is parsed.
+    last_request = [0.0]
+
+    def page_url(start):
+        return (
+            f"{LINKEDIN_BASE}/voyager/api/graphql"
             f"?variables=(count:{page_size},start:{start})"
             "&queryId=voyagerJobsDashSavedJobPostingsByMember.f9ffd3a93b94f4e03e6a55301002cda7"
         )
+
+    def fetch_page(start):
+        wait = last_request[0] + LINKEDIN_PAGE_INTERVAL - _time.monotonic()
+        if wait > 0:
+            _time.sleep(wait)  # polite delay
+        last_request[0] = _time.monotonic()
+        return _linkedin.request("GET", page_url(start), timeout=20)
+
+    pager = ThreadPoolExecutor(max_workers=1, thread_name_prefix="li-pages")
+    ahead = pager.submit(traced(fetch_page), start)
+
+    for page in range(max_pages):
         print(f"[LinkedIn Cookie] Page {page+1}, start={start}...")
 
         try:
-            resp = http_requests.get(url, headers=headers, cookies=cookies, timeout=20)
+            resp = ahead.result()
         except Exception as e:
             print(f"[LinkedIn Cookie] Request error: {e}")
             break
+        ahead = None
 
         if resp.status_code in (401, 403):
-            # Cookie expired — try re-login with credentials
-            print("[LinkedIn Cookie] Session expired, attempting credential re-login...")
-            new_li_at = _linkedin_login_for_cookie()
-            if new_li_at:
-                li_at = new_li_at
-                cookies["li_at"] = li_at
-                print("[LinkedIn Cookie] Re-login successful, retrying request...")
-                try:
-                    resp = http_requests.get(url, headers=headers, cookies=cookies, timeout=20)
-                except Exception as e:
-                    print(f"[LinkedIn Cookie] Retry error: {e}")
-                    break
-                if resp.status_code != 200:
-                    return [], "LinkedIn session expired and re-login did not help"
-            else:
-                return [], "LinkedIn session expired — re-login failed. Verify from browser & retry."
+            # The session already refreshed once (stored cookie / credential login)
+            return [], "LinkedIn session expired — re-login failed. Verify from browser & retry."
         if resp.status_code != 200:
             # Try fallback REST endpoint
             url2 = (
-                "https://www.linkedin.com/voyager/api/savesToDashJobPostings"
+                f"{LINKEDIN_BASE}/voyager/api/savesToDashJobPostings"
                 f"?count={page_size}&q=savesToDashJobPostingsByMember&start={start}"
             )
             try:
-                resp = http_requests.get(url2, headers=headers, cookies=cookies, timeout=20)
+                resp = _linkedin.request("GET", url2, timeout=20)
             except Exception as e:
                 print(f"[LinkedIn Cookie] Fallback request error: {e}")
                 break
@@ -4555,215 +8113,40 @@ def linkedin_scrape_saved_jobs_via_cookie(max_days=30):
             print(f"[LinkedIn Cookie] Invalid JSON response")
             break
 
-        # Parse the response — LinkedIn uses "included" array with entity types
-        included = data.get("included", data.get("elements", []))
-        if not included and "data" in data:
-            # GraphQL wrapper
-            inner = data["data"]
-            if isinstance(inner, dict):
-                for v in inner.values():
-                    if isinstance(v, dict) and "elements" in v:
-                        included = v["elements"]
-                        break
-            if not included:
-                included = data.get("included", [])
-
-        # Build lookup maps for companies and job postings from included entities
-        companies = {}
-        postings = {}
-        saved_meta = []  # saved-job wrapper entities with timestamps
-
-        for item in included:
-            urn = item.get("entityUrn") or item.get("$id") or ""
-            t = item.get("$type", "")
-
-            # Company / Organization
-            if "Company" in t or "Organization" in t or "company" in urn:
-                companies[urn] = item.get("name") or item.get("universalName") or "Unknown"
-
-            # Job Posting
-            if "JobPosting" in t or "jobPosting" in urn:
-                postings[urn] = item
-
-            # Saved-job wrapper (has savedAt timestamp)
-            if "SavedJob" in t or "savedJob" in str(item.get("$recipeTypes", "")):
-                saved_meta.append(item)
-
-            # Also capture items that have 'title' + 'companyDetails' (direct posting)
-            if item.get("title") and (item.get("companyDetails") or item.get("companyName")):
-                postings[urn] = item
-
-        # If we got saved_meta wrappers, extract job refs from them
-        page_jobs = []
-        if saved_meta:
-            for sm in saved_meta:
-                # Get savedAt timestamp for 30-day filter
-                saved_at = sm.get("savedAt") or sm.get("createdAt") or 0
-                if isinstance(saved_at, (int, float)) and saved_at > 1e12:
-                    saved_at = saved_at / 1000  # ms to seconds
-                if saved_at and saved_at > 0:
-                    saved_dt = datetime.datetime.fromtimestamp(saved_at, tz=datetime.timezone.utc)
-                    if saved_dt < cutoff:
-                        continue  # Skip jobs saved more than max_days ago
-
-                # Find the job posting reference
-                jp_ref = sm.get("jobPosting") or sm.get("*jobPosting") or ""
-                if isinstance(jp_ref, dict):
-                    jp_ref = jp_ref.get("entityUrn") or jp_ref.get("$id") or ""
-                jp = postings.get(jp_ref, {})
-                if not jp and isinstance(jp_ref, str):
-                    # Try partial match
-                    for k, v in postings.items():
-                        if jp_ref in k or k in jp_ref:
-                            jp = v
-                            break
-
-                title = jp.get("title") or sm.get("title") or ""
-                if not title:
-                    continue
-
-                # Company name
-                company = "Unknown"
-                comp_ref = jp.get("companyDetails", {}).get("*companyResolutionResult") or \
-                           jp.get("companyDetails", {}).get("company") or \
-                           jp.get("*company") or ""
-                if isinstance(comp_ref, str) and comp_ref in companies:
-                    company = companies[comp_ref]
-                elif jp.get("companyName"):
-                    company = jp["companyName"]
-                else:
-                    # Scan included for inline company names
-                    for ci in included:
-                        cn = ci.get("companyName")
-                        if cn and ci.get("entityUrn") == jp.get("entityUrn"):
-                            company = cn
-                            break
-
-                # Extract job ID from URN
-                job_urn = jp.get("entityUrn") or jp_ref or ""
-                m = re.search(r"(\d{8,})", job_urn)
-                job_id = m.group(1) if m else ""
-                if not job_id:
-                    continue  # no numeric job ID → not a real job posting, skip
-                job_url = f"https://www.linkedin.com/jobs/view/{job_id}/" if job_id else ""
-
-                # JD text
-                jd = ""
-                desc = jp.get("description") or jp.get("descriptionText") or {}
-                if isinstance(desc, dict):
-                    jd = desc.get("text", "")
-                elif isinstance(desc, str):
-                    jd = desc
-
-                page_jobs.append({
-                    "role": title,
-                    "company": company,
-                    "url": job_url,
-                    "linkedInId": f"li_{job_id}" if job_id else "",
-                    "jd": jd[:4000],
-                    "source": "LinkedIn",
-                    "status": "saved",
-                    "roleType": "Business Analyst",
-                    "dateApplied": datetime.datetime.now().isoformat(),
-                })
-        else:
-            # Fallback: parse postings directly (flat response format)
-            for urn, jp in postings.items():
-                title = jp.get("title", "")
-                if not title:
-                    continue
+        # Start the next page before parsing this one, unless paging, an empty
+        # page or a saved item past the cutoff already says this is the last
+        total_results = _voyager_paging(data).get("total", 0)
+        if (page + 1 < max_pages and not (total_results > 0 and start + page_size >= total_results)
+                and not _voyager_page_is_last(data, cutoff)):
+            ahead = pager.submit(traced(fetch_page), start + page_size)
 
-                # Skip profile/sidebar entities — real job postings always have a numeric job ID
-                m_check = re.search(r"(\d{8,})", urn)
-                if not m_check:
-                    continue  # no job ID in URN → not a real job posting
-
-                # Check listedAt / repostedAt for 30-day filter
-                listed = jp.get("listedAt") or jp.get("repostedAt") or 0
-                if isinstance(listed, (int, float)) and listed > 1e12:
-                    listed = listed / 1000
-                if listed and listed > 0:
-                    listed_dt = datetime.datetime.fromtimestamp(listed, tz=datetime.timezone.utc)
-                    if listed_dt < cutoff:
-                        continue
-
-                company = "Unknown"
-                comp_ref = jp.get("companyDetails", {}).get("*companyResolutionResult") or \
-                           jp.get("*company") or ""
-                if isinstance(comp_ref, str) and comp_ref in companies:
-                    company = companies[comp_ref]
-                elif jp.get("companyName"):
-                    company = jp["companyName"]
-
-                m = re.search(r"(\d{8,})", urn)
-                job_id = m.group(1) if m else ""
-                job_url = f"https://www.linkedin.com/jobs/view/{job_id}/" if job_id else ""
-
-                jd = ""
-                desc = jp.get("description") or jp.get("descriptionText") or {}
-                if isinstance(desc, dict):
-                    jd = desc.get("text", "")
-                elif isinstance(desc, str):
-                    jd = desc
-
-                page_jobs.append({
-                    "role": title,
-                    "company": company,
-                    "url": job_url,
-                    "linkedInId": f"li_{job_id}" if job_id else "",
-                    "jd": jd[:4000],
-                    "source": "LinkedIn",
-                    "status": "saved",
-                    "roleType": "Business Analyst",
-                    "dateApplied": datetime.datetime.now().isoformat(),
-                })
+        page_jobs, raw_count, total_results, stale = _parse_voyager_saved_page(data, cutoff)
 
         all_jobs.extend(page_jobs)
         print(f"[LinkedIn Cookie] Page {page+1}: {len(page_jobs)} jobs (total: {len(all_jobs)})")
 
-        # Pagination: check if there are more
-        paging = data.get("paging", {})
-        if not paging and "data" in data:
-            for v in data["data"].values():
-                if isinstance(v, dict) and "paging" in v:
-                    paging = v["paging"]
-                    break
-        total_results = paging.get("total", 0)
-        raw_count = len(included)  # how many raw items LinkedIn returned (before our date filtering)
-        # Stop only if: (a) LinkedIn returned NO raw items, or (b) we've fetched past the total count
+        # Stop if: (a) LinkedIn returned NO raw items, (b) we've fetched past the total count,
+        # or (c) saved items (newest first) have reached the max_days cutoff
         if raw_count == 0:
             print(f"[LinkedIn Cookie] No more raw items from API, stopping pagination")
             break
         if total_results > 0 and start + page_size >= total_results:
             print(f"[LinkedIn Cookie] Reached total ({total_results}), stopping pagination")
             break
+        if stale:
+            print(f"[LinkedIn Cookie] {stale} saved jobs older than {max_days} days, stopping pagination")
+            break
         start += page_size
-        _time.sleep(1)  # polite delay
+        if ahead is None:
+            ahead = pager.submit(traced(fetch_page), start)
+
+    if ahead is not None:
+        ahead.cancel()
+    pager.shutdown(wait=False)
 
     # ── Fetch JDs for jobs that don't have them yet ──
     if all_jobs:
-        missing_jd = [j for j in all_jobs if not j.get("jd") and j.get("linkedInId")]
-        if missing_jd:
-            print(f"[LinkedIn Cookie] Fetching JDs for {len(missing_jd)} jobs...")
-            for i, job in enumerate(missing_jd):
-                job_id = job["linkedInId"].replace("li_", "")
-                jd_url = (
-                    f"https://www.linkedin.com/voyager/api/jobs/jobPostings/{job_id}"
-                    f"?decorationId=com.linkedin.voyager.deco.jobs.web.shared.WebFullJobPosting-65"
-                )
-                try:
-                    r = http_requests.get(jd_url, headers=headers, cookies=cookies, timeout=15)
-                    if r.status_code == 200:
-                        jdata = r.json()
-                        desc = jdata.get("description") or jdata.get("descriptionText") or {}
-                        if isinstance(desc, dict):
-                            job["jd"] = desc.get("text", "")[:4000]
-                        elif isinstance(desc, str):
-                            job["jd"] = desc[:4000]
-                except Exception as e:
-                    print(f"[LinkedIn Cookie] JD fetch error for {job_id}: {e}")
-                if i % 10 == 9:
-                    _time.sleep(1)
+        backfill_linkedin_jds(all_jobs, budget=jd_budget)
 
     # Deduplicate by job URL
     seen = set()
@@ -4864,7 +8247,8 @@ def linkedin_import_from_bookmarklet():
 def linkedin_saved_jobs_only():
     """
     Scrape ONLY LinkedIn saved jobs (last 30 days) via credentials / li_at cookie.
-    Runs synchronously — returns the result directly (no background thread).
+    Runs synchronously — returns the result directly; JDs that take longer than
+    LINKEDIN_JD_SYNC_SECONDS are backfilled in the background.
     """
     import time as _ts
     import traceback
@@ -4889,7 +8273,8 @@ def linkedin_saved_jobs_only():
         # Step 2: Scrape saved jobs
         print(f"[LinkedIn-Only] Scraping saved jobs (auth via {li_src})...")
         try:
-            li_jobs, li_err = linkedin_scrape_saved_jobs_via_cookie(max_days=30)
+            li_jobs, li_err = linkedin_scrape_saved_jobs_via_cookie(max_days=30,
+                                                                    jd_budget=LINKEDIN_JD_SYNC_SECONDS)
         except Exception as e:
             print(f"[LinkedIn-Only] Scrape error: {e}")
             traceback.print_exc()
@@ -4966,11 +8351,12 @@ def agent_full_run():
       5. Email / WhatsApp notification
     """
     def bg():
-        with app.app_context():
+        with app.app_context(), start_trace("agent.full_run", trigger="full_run"):
             summary = {"scraped": 0, "skipped": 0, "scored": 0, "docs": 0, "error": None}
             li_saved_count = 0
 
             # ── Step 0: Scrape LinkedIn saved jobs (credentials → cookie → Voyager API) ──
+            trace_stage("linkedin_saved")
             li_at, li_src = _get_or_login_li_at()
             if li_at:
                 print(f"[FullRun] Scraping LinkedIn saved jobs (auth via {li_src})...")
@@ -5026,6 +8412,7 @@ def agent_full_run():
                     print("[FullRun] No LinkedIn credentials or cookie set — skipping saved jobs")
 
             # ── Step 1: Discover jobs from all 5 HTTP scrapers ──
+            trace_stage("discover")
             print("[FullRun] Discovering jobs from 5 platforms (no login needed)...")
             try:
                 import time as _time_disc
@@ -5043,7 +8430,8 @@ def agent_full_run():
                 disc_jobs = []
                 scraper_details = {}
                 with ThreadPoolExecutor(max_workers=5) as tex:
-                    futs = {tex.submit(fn, kw, "Singapore", 14): name for name, fn in all_scrapers.items()}
+                    futs = {tex.submit(traced(fn, f"scrape {name}", platform=name), kw, "Singapore", 14): name
+                            for name, fn in all_scrapers.items()}
                     for fut in as_completed(futs):
                         name = futs[fut]
                         try:
@@ -5060,19 +8448,11 @@ def agent_full_run():
 
                 print(f"[FullRun] Total discovered: {len(disc_jobs)} jobs from {len(scraper_details)} platforms")
 
-                # Deduplicate by URL + title|company
-                seen = set()
-                unique_disc = []
-                for dj in disc_jobs:
-                    curl = (dj.get("url") or "").split("?")[0]
-                    tc = f"{dj.get('role','').lower().strip()}|{dj.get('company','').lower().strip()}"
-                    if (curl and curl in seen) or tc in seen:
-                        continue
-                    if curl: seen.add(curl)
-                    seen.add(tc)
-                    unique_disc.append(dj)
+                trace_stage("dedup", discovered=len(disc_jobs))
+                unique_disc = _dedup_discovered_jobs(disc_jobs)
 
                 # Sync to Supabase, skipping existing
+                trace_stage("supabase_sync", jobs=len(unique_disc))
                 sb_disc = get_supabase()
                 if sb_disc and unique_disc:
                     ex_res = sb_disc.table("jobs").select("url").execute()
@@ -5104,6 +8484,7 @@ def agent_full_run():
                     print(f"[FullRun] Synced: {len(to_insert)} new, {summary['skipped']} duplicates")
 
                 # Build platform breakdown for email
+                trace_stage("notify")
                 li_line = f"<li><strong>LinkedIn Saved Jobs: {li_saved_count} new</strong></li>" if li_saved_count else ""
                 platform_lines = li_line + "".join(
                     f"<li>{n}: {c} jobs</li>" for n, c in scraper_details.items()
@@ -5122,6 +8503,7 @@ def agent_full_run():
                 send_email("⚠️ Job Discovery Failed", f"<h2>Error</h2><p>{e}</p>")
 
             # ── Step 2 + 3: Score + generate docs ──
+            trace_stage("agent_run")
             sb = get_supabase()
             if not sb:
                 return
@@ -5161,8 +8543,9 @@ def agent_cron():
         return jsonify({"error": "Unauthorized"}), 401
 
     def bg():
-        with app.app_context():
+        with app.app_context(), start_trace("agent.cron", trigger="cron"):
             # Step 1: Discover jobs from all platforms (lightweight HTTP — no Chrome)
+            trace_stage("discover")
             print("[Cron] Discovering jobs from all platforms...")
             try:
                 import time as _time_cron
@@ -5178,7 +8561,8 @@ def agent_cron():
                 }
                 disc_jobs = []
                 with ThreadPoolExecutor(max_workers=5) as tex:
-                    futs = {tex.submit(fn, kw, "Singapore", 14): n for n, fn in cron_scrapers.items()}
+                    futs = {tex.submit(traced(fn, f"scrape {n}", platform=n), kw, "Singapore", 14): n
+                            for n, fn in cron_scrapers.items()}
                     for fut in as_completed(futs):
                         try:
                             batch = fut.result(timeout=30)
@@ -5188,6 +8572,7 @@ def agent_cron():
                         except Exception:
                             pass
 
+                trace_stage("supabase_sync", jobs=len(disc_jobs))
                 sb = get_supabase()
                 added = 0
                 if sb and disc_jobs:
@@ -5221,6 +8606,7 @@ def agent_cron():
                 print(f"[Cron] Discovery error: {e}")
 
             # Step 2: Run AI agent on all pending jobs
+            trace_stage("agent_run")
             sb = get_supabase()
             if not sb:
                 return